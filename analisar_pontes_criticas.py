@@ -0,0 +1,121 @@
+"""
+Trechos críticos (pontes) da malha municipal
+
+Um trecho municipal é crítico quando a sua remoção desconecta parte da malha
+vicinal do SRE. Sobre a rede combinada municipal + DER (rede_viaria.npz,
+gerada por construir_rede_viaria.py a partir de malha_municipal_sp.gpkg e da
+malha DER) roda uma busca de pontes de Tarjan iterativa, em tempo linear, e
+marca cada ponte com a extensão de rede que ela isola do SRE.
+
+Saídas:
+- pontes_criticas.gpkg: segmentos municipais críticos com a extensão isolada
+- pontes_criticas_municipios.csv: agregação por município
+
+A rede precisa ter sido gerada das camadas atuais (hash conferido por
+carregar_rede_viaria), pois os segmentos são indexados por posição.
+
+Autor: Análise automatizada
+Data: Janeiro/2026
+"""
+
+import geopandas as gpd
+import numpy as np
+import pandas as pd
+import shapely
+from pathlib import Path
+from datetime import datetime
+from construir_rede_viaria import MALHA_MUNICIPAL, INTERMEDIARIO_DIR, REDE_VIARIA, carregar_rede_viaria
+from grafo_malha import ORIGEM_VICINAL, pontes_rede
+import warnings
+warnings.filterwarnings('ignore')
+
+# Configurações
+RELATORIO_DIR = Path(r'D:\ESTUDO_VICINAIS_V2\resultados\relatorios')
+MUNICIPIOS_SP = Path(__file__).parent / 'docs' / 'data' / 'municipios_sp.geojson'
+PONTES_CRITICAS = INTERMEDIARIO_DIR / 'pontes_criticas.gpkg'
+
+
+def log_section(titulo):
+    """Imprime seção formatada"""
+    print(f"\n{'='*60}")
+    print(f"{titulo}")
+    print(f"{'='*60}")
+
+
+def pontes_por_segmento(rede):
+    """
+    Segmentos municipais que contêm ao menos uma ponte
+
+    Retorna um DataFrame com a posição do segmento na malha municipal
+    (id_segmento) e a maior extensão isolada (km) entre as suas arestas.
+    Só contam as pontes que isolam alguma extensão do SRE.
+    """
+    ponte, extensao_isolada = pontes_rede(rede)
+    aresta_origem = np.asarray(rede['aresta_origem'])
+    criticas = np.flatnonzero(ponte & (extensao_isolada > 0) & (aresta_origem == ORIGEM_VICINAL))
+
+    segmento = np.asarray(rede['aresta_segmento'])[criticas]
+    pontes = pd.DataFrame({
+        'id_segmento': np.asarray(rede['segmento_id'])[segmento],
+        'extensao_isolada_km': extensao_isolada[criticas] / 1000,
+    })
+    print(f"  Pontes na rede: {ponte.sum():,} ({(ponte & (extensao_isolada > 0)).sum():,} isolam extensão do SRE)")
+    return pontes.groupby('id_segmento', as_index=False)['extensao_isolada_km'].max()
+
+
+def agregar_por_municipio(criticos):
+    """Número de trechos críticos e extensão isolada por município (pelo ponto médio)"""
+    municipios = gpd.read_file(MUNICIPIOS_SP)[['CD_MUN', 'NM_MUN', 'geometry']].to_crs(criticos.crs)
+    pontos = gpd.GeoDataFrame(
+        criticos[['extensao_isolada_km']],
+        geometry=shapely.line_interpolate_point(np.asarray(criticos.geometry, dtype=object), 0.5, normalized=True),
+        crs=criticos.crs,
+    )
+    pontos = gpd.sjoin(pontos, municipios, predicate='within', how='inner')
+    pontos = pontos[~pontos.index.duplicated()]
+
+    resumo = pontos.groupby(['CD_MUN', 'NM_MUN'])['extensao_isolada_km'].agg(
+        trechos_criticos='size', maior_extensao_isolada_km='max', soma_extensao_isolada_km='sum'
+    ).reset_index()
+    return resumo.sort_values('maior_extensao_isolada_km', ascending=False)
+
+
+def main():
+    log_section("TRECHOS CRÍTICOS (PONTES) DA MALHA MUNICIPAL")
+    print(f"Início: {datetime.now().strftime('%Y-%m-%d %H:%M:%S')}")
+
+    print(f"\nMapeando rede: {REDE_VIARIA}")
+    rede = carregar_rede_viaria(mmap=True)
+    print(f"  Nós: {len(rede['nos_xy']):,} | arestas: {len(rede['aresta_comprimento']):,}")
+
+    log_section("BUSCA DE PONTES (TARJAN ITERATIVO)")
+    inicio = datetime.now()
+    pontes = pontes_por_segmento(rede)
+    print(f"  Segmentos municipais críticos: {len(pontes):,}")
+    print(f"  Tempo: {(datetime.now() - inicio).total_seconds():.1f}s")
+
+    print(f"\nCarregando malha municipal: {MALHA_MUNICIPAL}")
+    municipal = gpd.read_file(MALHA_MUNICIPAL).to_crs(rede['crs'].item())
+    criticos = municipal.iloc[pontes['id_segmento']].copy()
+    criticos['id_segmento'] = pontes['id_segmento'].to_numpy()
+    criticos['extensao_isolada_km'] = pontes['extensao_isolada_km'].to_numpy()
+
+    print(f"\nSalvando: {PONTES_CRITICAS}")
+    criticos.to_crs(epsg=4326).to_file(PONTES_CRITICAS, driver='GPKG')
+
+    log_section("AGREGAÇÃO POR MUNICÍPIO")
+    resumo = agregar_por_municipio(criticos)
+    resumo_file = RELATORIO_DIR / 'pontes_criticas_municipios.csv'
+    resumo.to_csv(resumo_file, index=False, encoding='utf-8')
+    print(f"Municípios com trechos críticos: {len(resumo)}")
+    print(resumo.head(10).to_string(index=False))
+    print(f"\nArquivo: {resumo_file}")
+
+    print(f"\nFim: {datetime.now().strftime('%Y-%m-%d %H:%M:%S')}")
+    print("\n✅ Análise de pontes concluída!")
+
+    return criticos
+
+
+if __name__ == "__main__":
+    resultado = main()
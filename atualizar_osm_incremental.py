@@ -0,0 +1,194 @@
+"""
+Atualização incremental da base OSM a partir de arquivos OsmChange (.osc)
+
+Em vez de baixar um novo PBF e refazer toda a extração, aplica um ou mais
+diffs .osc (diários/semanais do Geofabrik ou planet) à base já extraída:
+
+1. Atualiza em osm_sp_highways apenas as ways afetadas (alteradas no .osc ou
+   com nós movidos), usando o estado incremental gravado por
+   extrair_pbf_subtrair_der.py
+2. Refaz o recorte de SP e a subtração DER só para essas ways e atualiza
+   osm_sp_menos_der.gpkg
+
+Nos GeoPackages só as linhas das ways afetadas são trocadas (removidas por
+osm_id e reinseridas, ver esquema_malha.atualizar_gpkg); o GeoParquet da base
+é o único arquivo regravado por inteiro, e é gravado depois do GPKG para
+continuar sendo o preferido por ler_base_osm.
+3. Marca os municípios afetados (geometria antiga ou nova) como "sujos" em
+   municipios_sujos.json, para as etapas seguintes recalcularem só eles
+
+Autor: Análise automatizada
+Data: Janeiro/2026
+"""
+
+import argparse
+import json
+import geopandas as gpd
+import numpy as np
+import pandas as pd
+import pyogrio
+from datetime import datetime
+from extracao_pbf import (
+    MUNICIPIOS_SP, carregar_limite_sp, carregar_estado, salvar_estado, aplicar_osc,
+    ler_base_osm
+)
+from esquema_malha import gravar_malha, atualizar_gpkg
+from extrair_pbf_subtrair_der import (
+    INTERMEDIARIO_DIR, OUTPUT_DIR, BASE_OSM, BASE_OSM_PARQUET, ESTADO_OSM, subtrair_der
+)
+import warnings
+warnings.filterwarnings('ignore')
+
+# Configurações
+MENOS_DER = OUTPUT_DIR / 'osm_sp_menos_der.gpkg'
+MUNICIPIOS_SUJOS = INTERMEDIARIO_DIR / 'municipios_sujos.json'
+
+
+def log_section(titulo):
+    """Imprime seção formatada"""
+    print(f"\n{'='*60}")
+    print(f"{titulo}")
+    print(f"{'='*60}")
+
+
+def atualizar_base(base, resultado):
+    """
+    Substitui na base as ways afetadas pelo .osc
+
+    Retorna (base_nova, antigas, atualizadas): antigas são as linhas que
+    saíram da base e atualizadas as que entraram (já recortadas para SP).
+    """
+    afetadas = np.union1d(resultado['alteradas'], resultado['movidas'])
+    mascara = base['osm_id'].isin(afetadas)
+    antigas = base[mascara]
+
+    # Ways movidas: mesmas tags, geometria reconstruída
+    geom_movidas = resultado['geom_movidas']
+    movidas = antigas[antigas['osm_id'].isin(geom_movidas.index)].copy()
+    movidas['geometry'] = geom_movidas.loc[movidas['osm_id']].values
+
+    atualizadas = pd.concat([movidas, resultado['gdf_alteradas'].to_crs(base.crs)], ignore_index=True)
+    atualizadas = gpd.GeoDataFrame(atualizadas, geometry='geometry', crs=base.crs)
+
+    base_nova = pd.concat([base[~mascara], atualizadas], ignore_index=True)
+    return gpd.GeoDataFrame(base_nova, geometry='geometry', crs=base.crs), antigas, atualizadas
+
+
+def marcar_municipios_sujos(geometrias, osc_files):
+    """Acrescenta ao municipios_sujos.json os municípios tocados pelas geometrias"""
+    municipios = gpd.read_file(MUNICIPIOS_SP)[['CD_MUN', 'geometry']].to_crs(epsg=4326)
+    afetadas = gpd.GeoDataFrame(geometry=list(geometrias), crs='EPSG:4326')
+    tocados = gpd.sjoin(afetadas, municipios, predicate='intersects', how='inner')
+    codigos = set(tocados['CD_MUN'].astype(str))
+
+    sujos = {'municipios': [], 'osc': []}
+    if MUNICIPIOS_SUJOS.exists():
+        with open(MUNICIPIOS_SUJOS, 'r', encoding='utf-8') as f:
+            sujos = json.load(f)
+
+    sujos['municipios'] = sorted(set(sujos['municipios']) | codigos)
+    sujos['osc'] = sujos['osc'] + [str(o) for o in osc_files]
+    sujos['atualizado'] = datetime.now().strftime('%Y-%m-%d %H:%M:%S')
+
+    with open(MUNICIPIOS_SUJOS, 'w', encoding='utf-8') as f:
+        json.dump(sujos, f, ensure_ascii=False, indent=2)
+
+    return codigos
+
+
+def atualizar_ways(arquivo, osm_ids, novas):
+    """
+    Troca num GeoPackage as linhas das ways `osm_ids` pelas de `novas`
+
+    Só a coluna osm_id é lida para achar as linhas (fids) a remover; `novas`
+    é reprojetada para o CRS da camada antes de ser acrescentada.
+    """
+    atual = gpd.read_file(arquivo, columns=['osm_id'], read_geometry=False, fid_as_index=True)
+    crs = pyogrio.read_info(arquivo)['crs']
+    atualizar_gpkg(arquivo, atual.index[atual['osm_id'].isin(osm_ids)], novas.to_crs(crs))
+
+
+def main(osc_files):
+    log_section("ATUALIZAÇÃO INCREMENTAL OSM (.osc)")
+    print(f"Início: {datetime.now().strftime('%Y-%m-%d %H:%M:%S')}")
+
+    if not ESTADO_OSM.exists():
+        raise FileNotFoundError(
+            f"Estado incremental não encontrado: {ESTADO_OSM}\n"
+            "Rode extrair_pbf_subtrair_der.py (sem --streaming) uma vez antes."
+        )
+
+    print(f"\nCarregando estado: {ESTADO_OSM}")
+    estado = carregar_estado(ESTADO_OSM)
+    print(f"  Ways: {len(estado['osm_id']):,} | nós: {len(estado['no_id']):,}")
+
+    print(f"\nCarregando base OSM: {BASE_OSM}")
+    base = ler_base_osm(BASE_OSM)
+    print(f"  Total: {len(base):,} highways")
+
+    limite = carregar_limite_sp()
+
+    # 1. Aplicar os .osc em ordem (o mais antigo primeiro)
+    todas_antigas = []
+    afetadas = np.array([], dtype=np.int64)
+    for osc_file in osc_files:
+        log_section(f"APLICANDO {osc_file}")
+        estado, resultado = aplicar_osc(estado, osc_file, limite)
+        base, antigas, atualizadas = atualizar_base(base, resultado)
+
+        print(f"  Ways no .osc: {len(resultado['alteradas']):,}")
+        print(f"  Ways com nós movidos: {len(resultado['movidas']):,}")
+        print(f"  Removidas da base: {len(antigas):,} | reinseridas: {len(atualizadas):,}")
+        if len(resultado['pendentes']):
+            print(f"  ⚠ Pendentes (nó fora do estado, aguardam extração completa): "
+                  f"{len(resultado['pendentes']):,}")
+        if len(resultado['fora_sp']):
+            print(f"  Fora de SP após a alteração: {len(resultado['fora_sp']):,}")
+
+        todas_antigas.append(antigas)
+        afetadas = np.union1d(afetadas, np.union1d(resultado['alteradas'], resultado['movidas']))
+
+    antigas = pd.concat(todas_antigas, ignore_index=True)
+    atualizadas = base[base['osm_id'].isin(afetadas)]
+
+    # 2. Gravar base e estado
+    log_section("GRAVANDO BASE ATUALIZADA")
+    if BASE_OSM.exists():
+        atualizar_ways(BASE_OSM, afetadas, atualizadas)
+    gravar_malha(base, BASE_OSM_PARQUET)
+    print(f"Base: {BASE_OSM_PARQUET} ({len(base):,} highways)")
+    salvar_estado(estado, ESTADO_OSM)
+    print(f"Estado: {ESTADO_OSM}")
+
+    # 3. Subtração DER apenas das ways afetadas
+    if len(atualizadas):
+        novas_menos_der, removidos = subtrair_der(atualizadas)
+    else:
+        novas_menos_der, removidos = atualizadas, 0
+    atualizar_ways(MENOS_DER, afetadas, novas_menos_der)
+
+    # 4. Municípios afetados
+    log_section("MUNICÍPIOS AFETADOS")
+    geometrias = pd.concat([antigas.geometry.to_crs(epsg=4326), atualizadas.geometry.to_crs(epsg=4326)])
+    codigos = marcar_municipios_sujos(geometrias, osc_files)
+    print(f"Municípios marcados nesta atualização: {len(codigos)}")
+    print(f"Arquivo: {MUNICIPIOS_SUJOS}")
+
+    # Resumo
+    log_section("RESUMO FINAL")
+    print(f"Arquivos .osc: {len(osc_files)}")
+    print(f"Ways afetadas: {len(afetadas):,}")
+    print(f"Reinseridas: {len(atualizadas):,} | removidas pelo DER: {removidos:,}")
+    print(f"Municípios sujos: {len(codigos)}")
+    print(f"\nFim: {datetime.now().strftime('%Y-%m-%d %H:%M:%S')}")
+    print("\n✅ Atualização concluída!")
+
+    return base
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Atualização incremental da base OSM com .osc")
+    parser.add_argument('osc', nargs='+', help="Arquivos OsmChange (.osc/.osc.gz), do mais antigo ao mais novo")
+    args = parser.parse_args()
+
+    resultado = main(args.osc)
@@ -0,0 +1,203 @@
+"""
+Acessibilidade por município sobre a rede viária (isócronas de distância)
+
+Para cada um dos 645 municípios calcula a extensão de rede (municipal + DER)
+alcançável a até 5, 10 e 20 km, pela rede, a partir de:
+
+- sede municipal (nó da rede mais próximo da sede)
+- entroncamento com o SRE mais próximo da sede (nó ligado ao SRE)
+
+Cada município é uma busca de Dijkstra limitada ao maior raio, independente
+das demais, então as buscas são distribuídas em um ProcessPoolExecutor; cada
+processo mapeia em memória a mesma rede_viaria.npz (gerada por
+construir_rede_viaria.py) em vez de receber uma cópia do grafo. A rede é
+conferida uma vez, no processo principal, contra o hash das camadas atuais
+(carregar_rede_viaria).
+
+Os indicadores são gravados em municipios_indicadores.json, ao lado dos
+indicadores de densidade.
+
+Autor: Análise automatizada
+Data: Janeiro/2026
+"""
+
+import argparse
+import json
+import os
+import geopandas as gpd
+import numpy as np
+from pathlib import Path
+from datetime import datetime
+from scipy.spatial import cKDTree
+from scipy.sparse.csgraph import dijkstra
+from concurrent.futures import ProcessPoolExecutor
+from construir_rede_viaria import REDE_VIARIA, carregar_rede_viaria
+from grafo_malha import carregar_rede, matriz_rede, extensao_alcancada
+import warnings
+warnings.filterwarnings('ignore')
+
+# Configurações
+BASE_DIR = Path(__file__).parent
+DATA_DIR = BASE_DIR / 'docs' / 'data'
+MUNICIPIOS_SP = DATA_DIR / 'municipios_sp.geojson'
+SEDES_MUNICIPAIS = r'D:\ESTUDO_VICINAIS_V2\dados\sedes_municipais_ibge.gpkg'  # pontos com CD_MUN
+INDICADORES = DATA_DIR / 'municipios_indicadores.json'
+
+RAIOS_KM = (5, 10, 20)
+
+# Estado de cada processo: rede mapeada em memória e matriz de pesos
+_REDE = None
+_MATRIZ = None
+
+
+def log_section(titulo):
+    """Imprime seção formatada"""
+    print(f"\n{'='*60}")
+    print(f"{titulo}")
+    print(f"{'='*60}")
+
+
+def _iniciar_processo(arquivo_rede):
+    """Initializer do pool: mapeia a rede uma vez por processo"""
+    global _REDE, _MATRIZ
+    _REDE = carregar_rede(arquivo_rede, mmap=True)
+    _MATRIZ = matriz_rede(_REDE)
+
+
+def _busca_limitada(origem, limite):
+    """Dijkstra a partir de um nó, até `limite` metros (inf além disso)"""
+    return dijkstra(_MATRIZ, directed=True, indices=origem, limit=limite)
+
+
+def acessibilidade_municipio(args):
+    """
+    Worker: isócronas de um município
+
+    Recebe (no_sede, no_sre_euclidiano). O entroncamento com o SRE é o nó
+    ligado ao SRE mais próximo da sede pela rede; se nenhum estiver dentro
+    do maior raio, usa o mais próximo em linha reta.
+    """
+    no_sede, no_sre_euclidiano = args
+    raios = np.array(RAIOS_KM) * 1000
+    limite = raios.max()
+
+    dist_sede = _busca_limitada(no_sede, limite)
+    sre_alcancados = np.flatnonzero(np.isfinite(dist_sede) & np.asarray(_REDE['no_sre']))
+    if len(sre_alcancados):
+        no_sre = sre_alcancados[np.argmin(dist_sede[sre_alcancados])]
+        dist_sede_sre = dist_sede[no_sre]
+    else:
+        no_sre, dist_sede_sre = no_sre_euclidiano, np.inf
+
+    dist_sre = _busca_limitada(no_sre, limite)
+    return (
+        extensao_alcancada(_REDE, dist_sede, raios),
+        extensao_alcancada(_REDE, dist_sre, raios),
+        dist_sede_sre,
+    )
+
+
+def carregar_sedes(municipios):
+    """
+    Sede de cada município (EPSG:31983), na ordem de `municipios`
+
+    Usa os pontos de SEDES_MUNICIPAIS quando disponível; municípios sem sede
+    no arquivo (ou sem o arquivo) usam um ponto interno do polígono.
+    """
+    sedes = municipios.geometry.representative_point()
+    if Path(SEDES_MUNICIPAIS).exists():
+        pontos = gpd.read_file(SEDES_MUNICIPAIS)[['CD_MUN', 'geometry']].to_crs(municipios.crs)
+        pontos = pontos.drop_duplicates('CD_MUN').set_index(pontos['CD_MUN'].astype(str)).geometry
+        encontradas = municipios['CD_MUN'].isin(pontos.index)
+        sedes[encontradas] = pontos.loc[municipios.loc[encontradas, 'CD_MUN']].values
+        print(f"  Sedes do IBGE: {encontradas.sum()} | ponto interno do polígono: {(~encontradas).sum()}")
+    else:
+        print(f"  ⚠ {SEDES_MUNICIPAIS} não encontrado, usando ponto interno do polígono")
+    return sedes
+
+
+def calcular_acessibilidade(rede, municipios, workers=None):
+    """
+    Isócronas de todos os municípios em paralelo
+
+    Retorna um dicionário CD_MUN -> indicadores (extensões em km).
+    """
+    nos_xy = np.asarray(rede['nos_xy'])
+    no_sre = np.flatnonzero(np.asarray(rede['no_sre']))
+    if len(no_sre) == 0:
+        raise ValueError("A rede não tem nós ligados ao SRE (rode construir_rede_viaria.py)")
+
+    sedes = carregar_sedes(municipios)
+    xy_sedes = np.column_stack([sedes.x, sedes.y])
+    _, no_sede = cKDTree(nos_xy).query(xy_sedes)
+    _, mais_proximo = cKDTree(nos_xy[no_sre]).query(xy_sedes)
+    tarefas = list(zip(no_sede, no_sre[mais_proximo]))
+
+    workers = workers or os.cpu_count()
+    print(f"  {len(tarefas)} municípios em {workers} processos (raio máximo {max(RAIOS_KM)} km)")
+
+    indicadores = {}
+    with ProcessPoolExecutor(max_workers=workers, initializer=_iniciar_processo,
+                             initargs=(str(REDE_VIARIA),)) as executor:
+        resultados = executor.map(acessibilidade_municipio, tarefas, chunksize=8)
+        for n, (cd_mun, (ext_sede, ext_sre, dist)) in enumerate(zip(municipios['CD_MUN'], resultados), 1):
+            item = {}
+            for raio, ext in zip(RAIOS_KM, ext_sede):
+                item[f'acess_sede_{raio}km'] = round(float(ext) / 1000, 2)
+            for raio, ext in zip(RAIOS_KM, ext_sre):
+                item[f'acess_sre_{raio}km'] = round(float(ext) / 1000, 2)
+            item['dist_sede_sre_km'] = round(float(dist) / 1000, 2) if np.isfinite(dist) else None
+            indicadores[cd_mun] = item
+            if n % 100 == 0 or n == len(tarefas):
+                print(f"  {n}/{len(tarefas)} municípios concluídos...")
+
+    return indicadores
+
+
+def main(workers=None):
+    log_section("ACESSIBILIDADE POR MUNICÍPIO (REDE VIÁRIA)")
+    print(f"Início: {datetime.now().strftime('%Y-%m-%d %H:%M:%S')}")
+
+    print(f"\nMapeando rede: {REDE_VIARIA}")
+    rede = carregar_rede_viaria(mmap=True)
+    print(f"  Nós: {len(rede['nos_xy']):,} | arestas: {len(rede['aresta_comprimento']):,}")
+
+    print(f"\nCarregando municípios: {MUNICIPIOS_SP}")
+    municipios = gpd.read_file(MUNICIPIOS_SP)[['CD_MUN', 'NM_MUN', 'geometry']].to_crs(rede['crs'].item())
+    municipios['CD_MUN'] = municipios['CD_MUN'].astype(str)
+    print(f"  Total: {len(municipios)} municípios")
+
+    log_section("BUSCAS LIMITADAS (DIJKSTRA)")
+    indicadores = calcular_acessibilidade(rede, municipios, workers=workers)
+
+    log_section("GRAVANDO INDICADORES")
+    with open(INDICADORES, 'r', encoding='utf-8') as f:
+        municipios_json = json.load(f)
+
+    atualizados = 0
+    for item in municipios_json:
+        valores = indicadores.get(str(item['Cod_ibge']))
+        if valores is not None:
+            item.update(valores)
+            atualizados += 1
+
+    with open(INDICADORES, 'w', encoding='utf-8') as f:
+        json.dump(municipios_json, f, ensure_ascii=False, indent=2)
+    print(f"Municípios atualizados: {atualizados}/{len(municipios_json)}")
+    print(f"Arquivo: {INDICADORES}")
+
+    ext_sede = np.array([v[f'acess_sede_{max(RAIOS_KM)}km'] for v in indicadores.values()])
+    print(f"\nExtensão mediana a até {max(RAIOS_KM)} km da sede: {np.median(ext_sede):,.1f} km")
+    print(f"\nFim: {datetime.now().strftime('%Y-%m-%d %H:%M:%S')}")
+    print("\n✅ Acessibilidade calculada!")
+
+    return indicadores
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Isócronas de acessibilidade por município")
+    parser.add_argument('--workers', type=int, default=0,
+                        help="Processos para as buscas (0 = todos os núcleos)")
+    args = parser.parse_args()
+
+    resultado = main(workers=args.workers or None)
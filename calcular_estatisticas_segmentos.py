@@ -3,9 +3,9 @@ Script para calcular estatísticas dos segmentos viários individuais
 da malha vicinal estimada
 """
 
-import geopandas as gpd
 import json
 from pathlib import Path
+from esquema_malha import ler_malha
 import numpy as np
 
 BASE_DIR = Path(__file__).parent
@@ -19,7 +19,7 @@ print("=" * 70)
 malha_file = DATA_DIR / 'malha_vicinais.geojson'
 print(f"\n[LOAD] Carregando {malha_file.name}...")
 
-malha = gpd.read_file(malha_file)
+malha = ler_malha(malha_file)
 print(f"[OK] {len(malha)} segmentos carregados")
 
 # USAR COLUNA 'metros' (fonte de verdade calculada em UTM 23S pelo Silvio)
@@ -74,7 +74,7 @@ for min_val, max_val, label in faixas:
 if 'sup_tipo_c' in malha.columns:
     print("[INFO] Analisando coluna: sup_tipo_c")
     
-    tipos_dist = malha.groupby('sup_tipo_c').agg({
+    tipos_dist = malha.groupby('sup_tipo_c', observed=True).agg({
         'comp_km': ['count', 'sum']
     }).reset_index()
     tipos_dist.columns = ['tipo', 'quantidade', 'extensao_km']
@@ -0,0 +1,144 @@
+"""
+Construção da rede viária completa (malha municipal + malha DER)
+
+Monta uma única vez a rede roteável da rede combinada e grava em
+rede_viaria.npz (CSR sem compressão), para ser mapeado em memória pelas
+etapas de conectividade, acessibilidade e controle de qualidade sem reler
+as geometrias:
+
+- nós (coordenadas em EPSG:31983) e marca de nó ligado ao SRE
+- arestas (uma por peça entre junções: as linhas são divididas nos vértices
+  compartilhados e onde uma via termina no meio de outra) com origem
+  (Vicinal/DER), comprimento e classe (highway do OSM ou jurisdição do DER)
+- mapeamento aresta -> segmento -> posição do segmento na camada de origem
+- hash do conteúdo das camadas de origem (hash_municipal, hash_der), para
+  quem reutiliza a rede detectar que ela ficou desatualizada
+
+Autor: Análise automatizada
+Data: Janeiro/2026
+"""
+
+import geopandas as gpd
+import numpy as np
+import pandas as pd
+from pathlib import Path
+from datetime import datetime
+from esquema_malha import hash_arquivo, ler_malha
+from sobreposicao_der import JURISDICOES_SRE, hash_arquivo_der
+from grafo_malha import (
+    ORIGEM_VICINAL, ORIGEM_DER, TOLERANCIA_SNAP_M, construir_rede, marcar_nos_sre, salvar_rede,
+    carregar_rede, hashes_divergentes
+)
+import warnings
+warnings.filterwarnings('ignore')
+
+# Configurações
+MALHA_MUNICIPAL = r'D:\ESTUDO_VICINAIS_V2\resultados\dados_processados\malha_municipal_sp.gpkg'
+MALHA_DER = r'D:\ESTUDO_VICINAIS_V2\dados\Sistema Rodoviário Estadual\MALHA_RODOVIARIA\MALHA_OUT.shp'
+INTERMEDIARIO_DIR = Path(r'D:\ESTUDO_VICINAIS_V2\resultados\intermediarios')
+REDE_VIARIA = INTERMEDIARIO_DIR / 'rede_viaria.npz'
+
+# Nós a até esta distância de uma rodovia do SRE são considerados ligados a ela
+TOLERANCIA_CONEXAO_M = 50
+
+# Extremidade de via a até esta distância do meio de outra linha é ligada a
+# ela (OSM e DER são digitalizados de forma independente)
+TOLERANCIA_JUNCAO_M = 5
+
+
+def log_section(titulo):
+    """Imprime seção formatada"""
+    print(f"\n{'='*60}")
+    print(f"{titulo}")
+    print(f"{'='*60}")
+
+
+def hashes_camadas(arquivo_municipal=MALHA_MUNICIPAL, arquivo_der=MALHA_DER):
+    """Hash do conteúdo das camadas de origem, com as chaves gravadas na rede"""
+    return {'hash_municipal': hash_arquivo(arquivo_municipal), 'hash_der': hash_arquivo_der(arquivo_der)}
+
+
+def carregar_rede_viaria(mmap=True):
+    """
+    Mapeia REDE_VIARIA, conferindo que ela foi gerada das camadas atuais
+
+    Os segmentos da rede guardam a posição nas camadas de origem; depois de
+    uma edição da malha (ver refinar_subtrair_der.py --incremental) uma rede
+    antiga apontaria para os segmentos errados.
+    """
+    rede = carregar_rede(REDE_VIARIA, mmap=mmap)
+    divergentes = hashes_divergentes(rede, hashes_camadas())
+    if divergentes:
+        raise ValueError(f"{REDE_VIARIA} não corresponde às camadas atuais ({', '.join(divergentes)}): "
+                         "rode construir_rede_viaria.py")
+    return rede
+
+
+def montar_rede_viaria(municipal, der, tolerancia_snap=TOLERANCIA_SNAP_M,
+                       tolerancia_conexao=TOLERANCIA_CONEXAO_M, tolerancia_juncao=TOLERANCIA_JUNCAO_M):
+    """
+    Monta a rede combinada (nodada) a partir das camadas já em EPSG:31983
+
+    Os segmentos municipais vêm primeiro (segmento_id = posição na camada
+    municipal) e depois os do DER (segmento_id = posição no shapefile). Um
+    segmento pode virar várias arestas (ver grafo_malha.construir_grafo).
+    """
+    geoms = np.concatenate([
+        np.asarray(municipal.geometry, dtype=object),
+        np.asarray(der.geometry, dtype=object),
+    ])
+    origem = np.concatenate([
+        np.full(len(municipal), ORIGEM_VICINAL, dtype=np.int8),
+        np.full(len(der), ORIGEM_DER, dtype=np.int8),
+    ])
+    classe = pd.concat([
+        municipal['highway'].reset_index(drop=True),
+        ('DER ' + der['Jurisdicao'].fillna('')).reset_index(drop=True),
+    ], ignore_index=True)
+    segmento_id = np.concatenate([np.arange(len(municipal)), np.arange(len(der))])
+
+    rede = construir_rede(geoms, tolerancia_snap, origem=origem, classe=classe,
+                          segmento_id=segmento_id, crs=municipal.crs.to_string(),
+                          nodar=True, tolerancia_juncao=tolerancia_juncao)
+
+    sre = der[der['Jurisdicao'].isin(JURISDICOES_SRE)]
+    marcar_nos_sre(rede, sre.geometry, tolerancia_conexao)
+    return rede
+
+
+def main():
+    log_section("CONSTRUÇÃO DA REDE VIÁRIA (MUNICIPAL + DER)")
+    print(f"Início: {datetime.now().strftime('%Y-%m-%d %H:%M:%S')}")
+
+    print(f"\nCarregando malha municipal: {MALHA_MUNICIPAL}")
+    municipal = ler_malha(MALHA_MUNICIPAL).to_crs(epsg=31983)
+    print(f"  Total: {len(municipal):,} segmentos")
+
+    print(f"\nCarregando malha DER: {MALHA_DER}")
+    der = gpd.read_file(MALHA_DER).to_crs(epsg=31983)
+    print(f"  Total: {len(der):,} segmentos")
+
+    log_section("REDE NODADA")
+    print(f"Snap de extremidades: {TOLERANCIA_SNAP_M}m | junções: {TOLERANCIA_JUNCAO_M}m | "
+          f"ligação ao SRE: {TOLERANCIA_CONEXAO_M}m")
+    rede = montar_rede_viaria(municipal, der)
+    rede.update({chave: np.array(valor) for chave, valor in hashes_camadas().items()})
+
+    n_arestas = len(rede['aresta_comprimento'])
+    ext_km = rede['aresta_comprimento'].sum() / 1000
+    print(f"  Nós: {len(rede['nos_xy']):,} ({rede['no_sre'].sum():,} ligados ao SRE)")
+    print(f"  Arestas: {n_arestas:,} ({ext_km:,.1f} km)")
+    for codigo, nome in enumerate(rede['origens']):
+        mascara = rede['aresta_origem'] == codigo
+        print(f"    {nome}: {mascara.sum():,} arestas, {rede['aresta_comprimento'][mascara].sum()/1000:,.1f} km")
+
+    INTERMEDIARIO_DIR.mkdir(parents=True, exist_ok=True)
+    salvar_rede(rede, REDE_VIARIA)
+    print(f"\nRede salva: {REDE_VIARIA}")
+    print("\n✅ Rede viária construída!")
+
+    return rede
+
+
+if __name__ == "__main__":
+    resultado = main()
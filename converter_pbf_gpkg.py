@@ -6,11 +6,14 @@ Autor: Análise automatizada
 Data: Janeiro/2026
 """
 
-import osmium
+import argparse
 import geopandas as gpd
-from shapely.geometry import LineString
 from pathlib import Path
 from datetime import datetime
+from extracao_pbf import (
+    SP_BOUNDS, HighwayHandler, filtros_highway, carregar_limite_sp,
+    extrair_highways_streaming, extrair_highways_paralelo
+)
 import warnings
 warnings.filterwarnings('ignore')
 
@@ -18,69 +21,8 @@ warnings.filterwarnings('ignore')
 PBF_FILE = r'D:\ESTUDO_VICINAIS_V2\dados\Base_OSM\sudeste-251111.osm.pbf'
 OUTPUT_DIR = Path(r'D:\ESTUDO_VICINAIS_V2\dados')
 
-# Bounds aproximados do Estado de São Paulo
-SP_BOUNDS = (-53.1, -25.3, -44.1, -19.8)
 
-
-class HighwayHandler(osmium.SimpleHandler):
-    """Handler para extrair highways do arquivo PBF"""
-    
-    def __init__(self):
-        super().__init__()
-        self.ways = []
-        self.count = 0
-        self.highway_count = 0
-        self.sp_count = 0
-        
-    def way(self, w):
-        """Processa cada way"""
-        self.count += 1
-        
-        if self.count % 1000000 == 0:
-            print(f"  {self.count:,} ways processadas, {self.sp_count:,} highways em SP...")
-        
-        # Apenas highways
-        if 'highway' not in w.tags:
-            return
-            
-        self.highway_count += 1
-        
-        try:
-            coords = [(n.lon, n.lat) for n in w.nodes]
-            
-            if len(coords) < 2:
-                return
-            
-            # Verificar se está em SP (pelo menos um ponto)
-            in_sp = False
-            for lon, lat in coords:
-                if (SP_BOUNDS[0] <= lon <= SP_BOUNDS[2] and 
-                    SP_BOUNDS[1] <= lat <= SP_BOUNDS[3]):
-                    in_sp = True
-                    break
-            
-            if not in_sp:
-                return
-                
-            self.sp_count += 1
-            
-            self.ways.append({
-                'osm_id': w.id,
-                'name': w.tags.get('name', ''),
-                'highway': w.tags.get('highway', ''),
-                'ref': w.tags.get('ref', ''),
-                'surface': w.tags.get('surface', ''),
-                'lanes': w.tags.get('lanes', ''),
-                'maxspeed': w.tags.get('maxspeed', ''),
-                'oneway': w.tags.get('oneway', ''),
-                'coords': coords
-            })
-            
-        except Exception:
-            pass
-
-
-def main():
+def main(streaming=False, workers=1):
     print("="*60)
     print("CONVERSÃO PBF -> GEOPACKAGE")
     print("="*60)
@@ -88,32 +30,34 @@ def main():
     print(f"\nArquivo: {PBF_FILE}")
     print(f"Bounds SP: {SP_BOUNDS}")
     
-    # Processar PBF
-    print("\nProcessando arquivo PBF (aguarde, ~800MB)...")
-    handler = HighwayHandler()
-    handler.apply_file(PBF_FILE, locations=True)
+    output_file = OUTPUT_DIR / 'osm_sp_linhas.gpkg'
+    
+    # Polígono do estado para o recorte exato
+    limite = carregar_limite_sp()
+    
+    if streaming:
+        return main_streaming(output_file, limite)
+    
+    if workers != 1:
+        # Processar PBF em paralelo (faixas de blocos)
+        print("\nProcessando arquivo PBF em paralelo...")
+        gdf, stats = extrair_highways_paralelo(PBF_FILE, workers, limite)
+        highway_count, sp_count, fora_limite = stats['highway_count'], stats['sp_count'], stats['fora_limite']
+    else:
+        # Processar PBF
+        print("\nProcessando arquivo PBF (aguarde, ~800MB)...")
+        handler = HighwayHandler(limite)
+        handler.apply_file(PBF_FILE, locations=True, filters=filtros_highway())
+        
+        # Converter para GeoDataFrame (com recorte pelo limite estadual)
+        print("\nCriando GeoDataFrame...")
+        gdf = handler.para_geodataframe()
+        highway_count, sp_count, fora_limite = handler.highway_count, handler.sp_count, handler.fora_limite
     
     print(f"\nResultado:")
-    print(f"  Total ways: {handler.count:,}")
-    print(f"  Highways: {handler.highway_count:,}")
-    print(f"  Highways em SP: {handler.sp_count:,}")
-    
-    # Converter para GeoDataFrame
-    print("\nCriando GeoDataFrame...")
-    
-    geometries = []
-    data = []
-    
-    for way in handler.ways:
-        coords = way.pop('coords')
-        try:
-            geom = LineString(coords)
-            geometries.append(geom)
-            data.append(way)
-        except:
-            continue
-    
-    gdf = gpd.GeoDataFrame(data, geometry=geometries, crs='EPSG:4326')
+    print(f"  Highways lidas: {highway_count:,}")
+    print(f"  Highways no retângulo SP: {sp_count:,}")
+    print(f"  Fora do limite estadual (descartadas): {fora_limite:,}")
     print(f"  Features: {len(gdf):,}")
     
     # Calcular comprimento
@@ -129,7 +73,6 @@ def main():
     print(f"\nExtensão total: {ext_km:,.1f} km")
     
     # Salvar
-    output_file = OUTPUT_DIR / 'osm_sp_linhas.gpkg'
     print(f"\nSalvando: {output_file}")
     gdf.to_file(output_file, driver='GPKG')
     
@@ -139,5 +82,38 @@ def main():
     return gdf
 
 
+def main_streaming(output_file, limite=None):
+    """Conversão em streaming: lotes gravados direto no GeoPackage"""
+    print("\nProcessando arquivo PBF em streaming (índice de nós em disco)...")
+    handler = extrair_highways_streaming(PBF_FILE, output_file, dir_indice=OUTPUT_DIR,
+                                         limite=limite)
+    
+    print(f"\nResultado:")
+    print(f"  Highways lidas: {handler.highway_count:,}")
+    print(f"  Highways no retângulo SP: {handler.sp_count:,}")
+    print(f"  Fora do limite estadual (descartadas): {handler.fora_limite:,}")
+    print(f"  Features gravadas: {handler.n_gravadas:,} em {handler.n_lotes} lotes")
+    
+    # Estatísticas acumuladas durante a gravação
+    print(f"\nDistribuição por highway:")
+    for hw, count in handler.contagem_highway.most_common(15):
+        print(f"  {hw}: {count:,}")
+    
+    print(f"\nExtensão total: {handler.extensao_m/1000:,.1f} km")
+    print(f"\nSalvo: {output_file}")
+    
+    print(f"\nFim: {datetime.now().strftime('%H:%M:%S')}")
+    print("✅ Conversão concluída!")
+    
+    return output_file
+
+
 if __name__ == "__main__":
-    resultado = main()
+    parser = argparse.ArgumentParser(description="Conversão PBF -> GeoPackage")
+    parser.add_argument('--streaming', action='store_true',
+                        help="Gravar em lotes com índice de nós em disco (memória constante)")
+    parser.add_argument('--workers', type=int, default=1,
+                        help="Processos para decodificar o PBF em faixas de blocos (0 = todos os núcleos)")
+    args = parser.parse_args()
+    
+    resultado = main(streaming=args.streaming, workers=args.workers or None)
@@ -0,0 +1,154 @@
+"""
+Esquema compacto de tipos das colunas da malha viária
+
+As tags OSM chegam como strings Python (object) com '' como ausente e são
+carregadas por todas as etapas, de extracao_pbf.py a
+gerar_segmentos_estatisticas_total.py. Este módulo define um esquema único:
+
+- categóricas: tags enumeradas (highway, surface, oneway, ref, sup_tipo_c)
+- inteiros pequenos anuláveis: lanes (UInt8) e maxspeed em km/h (UInt16)
+- float32: proporções/percentuais (0-1 ou 0-100), onde 7 dígitos bastam;
+  comprimentos continuam float64 porque somam milhões de segmentos
+- NA explícito no lugar de ''
+
+O GeoPackage e o GeoJSON não guardam categorias nem inteiros anuláveis, então
+o esquema é aplicado na leitura (ler_malha) e antes da gravação
+(gravar_malha); o GeoParquet preserva os tipos. hash_arquivo dá a chave de
+conteúdo usada pelos caches e pela rede persistida; atualizar_gpkg troca
+feições de um GeoPackage sem regravar a camada inteira.
+
+Autor: Análise automatizada
+Data: Janeiro/2026
+"""
+
+import hashlib
+import sqlite3
+import geopandas as gpd
+import numpy as np
+import pandas as pd
+from pathlib import Path
+import pyogrio
+
+# Tags enumeradas (poucos valores distintos em milhões de linhas)
+COLUNAS_CATEGORICAS = ['highway', 'surface', 'oneway', 'ref', 'sup_tipo_c']
+
+# Inteiros anuláveis: coluna -> dtype (valores fora do intervalo viram NA)
+COLUNAS_INTEIRAS = {'lanes': 'UInt8', 'maxspeed': 'UInt16'}
+
+# Proporções e percentuais
+COLUNAS_FLOAT32 = ['pct_sobreposicao_der', 'fracao_au']
+
+# Texto livre: só troca '' por NA
+COLUNAS_TEXTO = ['name']
+
+MPH_KMH = 1.609344
+
+
+def _categorica(serie):
+    """Categórica sem a categoria '' nem categorias sem uso"""
+    categorica = serie if isinstance(serie.dtype, pd.CategoricalDtype) else serie.astype('category')
+    if '' in categorica.cat.categories:
+        categorica = categorica.cat.remove_categories([''])
+    return categorica.cat.remove_unused_categories()
+
+
+def _valor_inteiro(categorias, coluna):
+    """Valor numérico de cada categoria ('60', '60 mph', '2'); NaN se não numérico"""
+    texto = pd.Series(categorias.astype(str)).str.strip()
+    if coluna == 'maxspeed':
+        partes = texto.str.extract(r'^(\d+)\s*(mph)?$', expand=True)
+        valor = pd.to_numeric(partes[0], errors='coerce').to_numpy(dtype=float)
+        return np.where(partes[1].notna().to_numpy(), np.round(valor * MPH_KMH), valor)
+    return pd.to_numeric(texto.where(texto.str.fullmatch(r'\d+')), errors='coerce').to_numpy(dtype=float)
+
+
+def _inteira(serie, coluna, dtype):
+    """
+    Inteiro pequeno anulável
+
+    Strings são interpretadas uma vez por valor distinto (via categorias);
+    valores não numéricos ('2;3', 'walk', 'none') e fora do intervalo do
+    dtype viram NA.
+    """
+    if serie.dtype == dtype:
+        return serie
+    if pd.api.types.is_numeric_dtype(serie.dtype):
+        valor = serie.to_numpy(dtype=float, na_value=np.nan)
+    else:
+        categorica = serie.astype('category')
+        por_categoria = np.append(_valor_inteiro(categorica.cat.categories, coluna), np.nan)
+        valor = por_categoria[categorica.cat.codes.to_numpy()]
+    maximo = np.iinfo(dtype.lower()).max
+    valor = np.where((valor >= 0) & (valor <= maximo), valor, np.nan)
+    return pd.Series(pd.array(valor, dtype='Float64').astype(dtype), index=serie.index)
+
+
+def aplicar_esquema(gdf):
+    """
+    Converte as colunas presentes para o esquema compacto
+
+    Idempotente e barato quando os tipos já estão certos; colunas ausentes
+    são ignoradas. Retorna uma cópia rasa (os dados das demais colunas não
+    são copiados).
+    """
+    gdf = gdf.copy(deep=False)
+    for coluna in COLUNAS_CATEGORICAS:
+        if coluna in gdf.columns:
+            gdf[coluna] = _categorica(gdf[coluna])
+    for coluna, dtype in COLUNAS_INTEIRAS.items():
+        if coluna in gdf.columns:
+            gdf[coluna] = _inteira(gdf[coluna], coluna, dtype)
+    for coluna in COLUNAS_FLOAT32:
+        if coluna in gdf.columns:
+            gdf[coluna] = gdf[coluna].astype(np.float32)
+    for coluna in COLUNAS_TEXTO:
+        if coluna in gdf.columns and not isinstance(gdf[coluna].dtype, pd.CategoricalDtype):
+            gdf[coluna] = gdf[coluna].mask(gdf[coluna] == '')
+    return gdf
+
+
+def hash_arquivo(arquivo):
+    """Hash SHA-256 do conteúdo de um arquivo"""
+    h = hashlib.sha256()
+    with open(arquivo, 'rb') as f:
+        for bloco in iter(lambda: f.read(1 << 20), b''):
+            h.update(bloco)
+    return h.hexdigest()
+
+
+def ler_malha(arquivo, **kwargs):
+    """gpd.read_file (ou read_parquet para .parquet) com o esquema aplicado"""
+    if Path(arquivo).suffix == '.parquet':
+        return aplicar_esquema(gpd.read_parquet(arquivo, **kwargs))
+    return aplicar_esquema(gpd.read_file(arquivo, **kwargs))
+
+
+def gravar_malha(gdf, arquivo, **kwargs):
+    """Aplica o esquema e grava (GeoParquet para .parquet, senão to_file)"""
+    gdf = aplicar_esquema(gdf)
+    if Path(arquivo).suffix == '.parquet':
+        gdf.to_parquet(arquivo, **kwargs)
+    else:
+        gdf.to_file(arquivo, **kwargs)
+    return gdf
+
+
+def atualizar_gpkg(arquivo, remover_fids, novas):
+    """
+    Remove feições (por fid) e acrescenta novas a um GeoPackage, sem regravá-lo
+
+    A remoção é um DELETE direto no SQLite (os gatilhos do índice espacial
+    de remoção não usam funções do GDAL); as inclusões vão pelo GDAL em modo
+    append, que mantém o índice espacial. As colunas de `novas` seguem as da
+    camada.
+    """
+    camada = pyogrio.list_layers(arquivo)[0][0]
+    if len(remover_fids):
+        conexao = sqlite3.connect(arquivo)
+        with conexao:
+            conexao.executemany(f'DELETE FROM "{camada}" WHERE fid = ?', [(int(f),) for f in remover_fids])
+        conexao.close()
+    if len(novas):
+        campos = list(pyogrio.read_info(arquivo, layer=camada)['fields'])
+        gravar_malha(novas[campos + ['geometry']], arquivo, driver='GPKG', layer=camada, mode='a')
+    print(f"Atualizado: {arquivo} (-{len(remover_fids):,} / +{len(novas):,} feições)")
@@ -0,0 +1,889 @@
+"""
+Extração de highways de arquivos OSM PBF para São Paulo
+Handlers osmium compartilhados por converter_pbf_gpkg.py e
+extrair_pbf_subtrair_der.py
+
+Dois modos:
+- em memória (HighwayHandler): acumula todas as ways em arrays colunares e
+  devolve um GeoDataFrame montado com shapely.from_ragged_array
+- streaming (extrair_highways_streaming): filtro de tags no osmium, índice de
+  nós em arquivo e gravação em lotes direto no GeoPackage de saída, com pico
+  de memória constante independente do tamanho do PBF
+- paralelo (extrair_highways_paralelo): faixas de blocos do PBF decodificadas
+  em vários processos e concatenadas na ordem do arquivo
+
+O estado incremental (refs de nós por way + tabela de nós) permite aplicar
+arquivos OsmChange (.osc) à base extraída sem reler o PBF (aplicar_osc).
+
+A base extraída também é guardada em GeoParquet num cache indexado pelo
+hash do PBF e dos parâmetros da extração (chave_extracao); ler_base_osm lê
+o GeoParquet com projeção de colunas. O GeoParquet é a base de referência:
+o GeoPackage ao lado dele é só uma cópia para abrir em SIG e é removido
+quando a base vem do cache.
+
+Autor: Análise automatizada
+Data: Janeiro/2026
+"""
+
+import hashlib
+import json
+import os
+import shutil
+import struct
+import tempfile
+from array import array
+from collections import Counter
+from concurrent.futures import ProcessPoolExecutor
+from pathlib import Path
+
+import osmium
+import geopandas as gpd
+import numpy as np
+import shapely
+
+from esquema_malha import aplicar_esquema, hash_arquivo, ler_malha
+
+# Bounds aproximados do Estado de São Paulo
+# minx, miny, maxx, maxy
+SP_BOUNDS = (-53.1, -25.3, -44.1, -19.8)
+
+# Limite exato do estado: polígonos municipais já usados pelo site
+MUNICIPIOS_SP = Path(__file__).parent / 'docs' / 'data' / 'municipios_sp.geojson'
+
+# Grade de pré-classificação do limite (graus, ~5 km)
+TAMANHO_CELULA_GRAUS = 0.05
+CELULA_FORA, CELULA_BORDA, CELULA_DENTRO = 0, 1, 2
+
+# Tags extraídas de cada way
+TAGS_HIGHWAY = ['name', 'highway', 'ref', 'surface', 'lanes', 'maxspeed', 'oneway']
+
+# Modo streaming: ways por lote gravado e tipo de índice de nós (em disco)
+TAMANHO_LOTE = 100_000
+INDICE_NOS_DISCO = 'sparse_file_array'
+
+# Cache da extração (GeoParquet) indexado pelo conteúdo do PBF e parâmetros
+CACHE_EXTRACAO_DIR = Path(r'D:\ESTUDO_VICINAIS_V2\resultados\cache\extracao_pbf')
+VERSAO_CACHE_EXTRACAO = 1
+
+
+def filtros_highway():
+    """Filtros osmium: descarta ways sem a tag highway antes do Python"""
+    return [osmium.filter.KeyFilter('highway').enable_for(osmium.osm.WAY)]
+
+
+class LimiteSP:
+    """
+    Polígono do Estado de São Paulo preparado para teste de vértices em lote
+
+    Uma grade regular sobre o bbox classifica cada célula como totalmente
+    dentro, totalmente fora ou na borda do polígono. Só os vértices que caem
+    em células de borda passam pelo teste ponto-no-polígono (preparado).
+    """
+
+    def __init__(self, poligono, tamanho_celula=TAMANHO_CELULA_GRAUS):
+        self.poligono = poligono
+        shapely.prepare(self.poligono)
+        self.bounds = poligono.bounds
+        self.tamanho_celula = tamanho_celula
+
+        minx, miny, maxx, maxy = self.bounds
+        self.n_col = int(np.ceil((maxx - minx) / tamanho_celula))
+        self.n_lin = int(np.ceil((maxy - miny) / tamanho_celula))
+
+        col, lin = np.meshgrid(np.arange(self.n_col), np.arange(self.n_lin))
+        x0 = minx + col.ravel() * tamanho_celula
+        y0 = miny + lin.ravel() * tamanho_celula
+        celulas = shapely.box(x0, y0, x0 + tamanho_celula, y0 + tamanho_celula)
+
+        classe = np.full(len(celulas), CELULA_BORDA, dtype=np.int8)
+        classe[~shapely.intersects(self.poligono, celulas)] = CELULA_FORA
+        classe[shapely.contains(self.poligono, celulas)] = CELULA_DENTRO
+        self.celulas = classe.reshape(self.n_lin, self.n_col)
+
+    def vertices_dentro(self, x, y):
+        """Retorna um array booleano: vértice (x, y) dentro ou na borda do estado"""
+        dentro = np.zeros(len(x), dtype=bool)
+        minx, miny, maxx, maxy = self.bounds
+
+        # Pré-teste barato pelo bbox
+        idx = np.flatnonzero((x >= minx) & (x <= maxx) & (y >= miny) & (y <= maxy))
+
+        # Classe da célula de cada vértice
+        col = np.minimum(((x[idx] - minx) / self.tamanho_celula).astype(np.int64), self.n_col - 1)
+        lin = np.minimum(((y[idx] - miny) / self.tamanho_celula).astype(np.int64), self.n_lin - 1)
+        classe = self.celulas[lin, col]
+
+        dentro[idx[classe == CELULA_DENTRO]] = True
+
+        # Teste exato apenas nas células de borda
+        borda = idx[classe == CELULA_BORDA]
+        dentro[borda] = shapely.intersects_xy(self.poligono, x[borda], y[borda])
+
+        return dentro
+
+    def ways_dentro(self, x, y, offsets):
+        """Retorna um array booleano por way: algum vértice dentro do estado"""
+        if len(offsets) < 2:
+            return np.zeros(0, dtype=bool)
+        dentro = self.vertices_dentro(x, y)
+        return np.logical_or.reduceat(dentro, offsets[:-1])
+
+
+def carregar_limite_sp(arquivo=MUNICIPIOS_SP):
+    """
+    Monta o LimiteSP a partir da união dos polígonos municipais
+
+    Retorna None (recorte só pelo retângulo SP_BOUNDS) se o arquivo não existir.
+    """
+    arquivo = Path(arquivo)
+    if not arquivo.exists():
+        print(f"  ⚠ Limite estadual não encontrado ({arquivo}), usando apenas SP_BOUNDS")
+        return None
+
+    print(f"  Carregando limite estadual: {arquivo}")
+    municipios = gpd.read_file(arquivo).to_crs(epsg=4326)
+    poligono = shapely.union_all(shapely.make_valid(np.asarray(municipios.geometry, dtype=object)))
+    return LimiteSP(poligono)
+
+
+class HighwayHandler(osmium.SimpleHandler):
+    """
+    Handler para extrair vias (highways) do arquivo PBF
+
+    As ways aceitas são acumuladas em formato colunar: coordenadas em
+    arrays planos de float64 (x, y) com um array de offsets por way, e
+    cada tag em uma lista própria. O GeoDataFrame é montado de uma vez
+    com shapely.from_ragged_array (ver para_geodataframe).
+
+    O teste de SP na leitura usa apenas o retângulo SP_BOUNDS. Se um
+    LimiteSP for informado, para_geodataframe descarta, de forma vetorizada,
+    as ways sem nenhum vértice dentro do polígono do estado.
+
+    Com guardar_refs=True os ids dos nós de cada way também são acumulados,
+    para montar o estado da atualização incremental (estado_incremental).
+    """
+
+    def __init__(self, limite=None, guardar_refs=False):
+        super().__init__()
+        self.limite = limite
+        self.guardar_refs = guardar_refs
+        self.mascara = None
+        self.count = 0
+        self.highway_count = 0
+        self.sp_count = 0
+        self.fora_limite = 0
+        self.limpar()
+
+    def limpar(self):
+        """Reinicia o acumulador colunar"""
+        self.x = array('d')
+        self.y = array('d')
+        self.offsets = array('q', [0])
+        self.osm_id = array('q')
+        self.refs = array('q')
+        self.tags = {tag: [] for tag in TAGS_HIGHWAY}
+
+    @property
+    def n_acumuladas(self):
+        """Número de ways no acumulador"""
+        return len(self.osm_id)
+
+    def way(self, w):
+        """Processa cada way do arquivo"""
+        self.count += 1
+
+        if self.count % 1000000 == 0:
+            print(f"  {self.count:,} ways processadas, {self.sp_count:,} highways em SP...")
+
+        # Apenas highways
+        if 'highway' not in w.tags:
+            return
+
+        self.highway_count += 1
+
+        try:
+            lons = []
+            lats = []
+            for n in w.nodes:
+                lons.append(n.lon)
+                lats.append(n.lat)
+        except Exception:
+            return  # Ignorar ways com problemas de geometria
+
+        if len(lons) < 2:
+            return
+
+        # Verificar se está em SP (pelo menos um ponto)
+        in_sp = False
+        for lon, lat in zip(lons, lats):
+            if (SP_BOUNDS[0] <= lon <= SP_BOUNDS[2] and
+                SP_BOUNDS[1] <= lat <= SP_BOUNDS[3]):
+                in_sp = True
+                break
+
+        if not in_sp:
+            return
+
+        self.sp_count += 1
+        if self.guardar_refs:
+            self.refs.extend([n.ref for n in w.nodes])
+        self.adicionar(w, lons, lats)
+
+    def adicionar(self, w, lons, lats):
+        """Acrescenta a way aceita ao acumulador colunar"""
+        self.x.extend(lons)
+        self.y.extend(lats)
+        self.offsets.append(len(self.x))
+        self.osm_id.append(w.id)
+        for tag in TAGS_HIGHWAY:
+            self.tags[tag].append(w.tags.get(tag, ''))
+
+    def para_geodataframe(self):
+        """Monta o GeoDataFrame das ways acumuladas em uma única chamada"""
+        coords = np.column_stack([
+            np.frombuffer(self.x, dtype=np.float64),
+            np.frombuffer(self.y, dtype=np.float64),
+        ])
+        offsets = np.frombuffer(self.offsets, dtype=np.int64)
+        geometrias = shapely.from_ragged_array(
+            shapely.GeometryType.LINESTRING, coords, (offsets,)
+        )
+
+        data = {'osm_id': np.frombuffer(self.osm_id, dtype=np.int64).copy()}
+        data.update(self.tags)
+
+        gdf = gpd.GeoDataFrame(data, geometry=geometrias, crs='EPSG:4326')
+
+        # Recorte exato pelo polígono do estado
+        self.mascara = None
+        if self.limite is not None:
+            mascara = self.limite.ways_dentro(coords[:, 0], coords[:, 1], offsets)
+            self.fora_limite += int((~mascara).sum())
+            self.mascara = mascara
+            gdf = gdf[mascara].reset_index(drop=True)
+
+        return aplicar_esquema(gdf)
+
+    def estado_incremental(self):
+        """Estado da atualização incremental das ways mantidas em para_geodataframe"""
+        if not self.guardar_refs:
+            raise ValueError("HighwayHandler criado sem guardar_refs=True")
+        return montar_estado(
+            np.frombuffer(self.osm_id, dtype=np.int64),
+            np.frombuffer(self.offsets, dtype=np.int64),
+            np.frombuffer(self.refs, dtype=np.int64),
+            np.frombuffer(self.x, dtype=np.float64),
+            np.frombuffer(self.y, dtype=np.float64),
+            self.mascara,
+        )
+
+
+class HighwayStreamHandler(HighwayHandler):
+    """
+    Variante em streaming do HighwayHandler
+
+    As ways aceitas são gravadas no arquivo de saída a cada `tamanho_lote`,
+    de modo que apenas um lote fica em memória.
+    """
+
+    def __init__(self, output_file, tamanho_lote=TAMANHO_LOTE, comprimento=True, limite=None):
+        super().__init__(limite)
+        self.output_file = Path(output_file)
+        self.tamanho_lote = tamanho_lote
+        self.comprimento = comprimento
+        self.n_lotes = 0
+        self.n_gravadas = 0
+        self.contagem_highway = Counter()
+        self.extensao_m = 0.0
+
+    def adicionar(self, w, lons, lats):
+        """Acumula a way e grava o lote quando cheio"""
+        super().adicionar(w, lons, lats)
+        if self.n_acumuladas >= self.tamanho_lote:
+            self.gravar_lote()
+
+    def gravar_lote(self):
+        """Grava o lote atual no GeoPackage de saída e libera a memória"""
+        if self.n_acumuladas == 0:
+            return
+
+        gdf = self.para_geodataframe()
+        self.limpar()
+        if len(gdf) == 0:
+            return
+
+        if self.comprimento:
+            gdf['comprimento_m'] = gdf.to_crs(epsg=31983).geometry.length
+            self.extensao_m += gdf['comprimento_m'].sum()
+
+        gdf.to_file(self.output_file, driver='GPKG', mode='a' if self.n_lotes else 'w')
+
+        self.n_lotes += 1
+        self.n_gravadas += len(gdf)
+        self.contagem_highway.update(gdf['highway'].tolist())
+        print(f"  Lote {self.n_lotes}: {self.n_gravadas:,} highways gravadas...")
+
+
+def extrair_highways_streaming(pbf_file, output_file, tamanho_lote=TAMANHO_LOTE,
+                               comprimento=True, dir_indice=None, limite=None):
+    """
+    Extrai as highways de SP do PBF gravando em lotes no GeoPackage
+
+    - O filtro de tags do osmium descarta ways sem highway antes do Python
+    - As localizações dos nós ficam em um índice esparso em arquivo
+      (removido ao final), não na memória
+    - As ways são gravadas a cada `tamanho_lote`
+    - Com `limite` (LimiteSP), cada lote é recortado pelo polígono do estado
+
+    Retorna o handler, com as contagens e a distribuição por highway.
+    """
+    output_file = Path(output_file)
+    if output_file.exists():
+        output_file.unlink()
+
+    fd, arquivo_indice = tempfile.mkstemp(suffix='.nodes', dir=dir_indice)
+    os.close(fd)
+
+    handler = HighwayStreamHandler(output_file, tamanho_lote, comprimento, limite)
+    try:
+        handler.apply_file(str(pbf_file), locations=True,
+                           idx=f'{INDICE_NOS_DISCO},{arquivo_indice}',
+                           filters=filtros_highway())
+        handler.gravar_lote()
+    finally:
+        os.remove(arquivo_indice)
+
+    return handler
+
+
+# ---------------------------------------------------------------------------
+# Leitura paralela por faixas de blocos do PBF
+# ---------------------------------------------------------------------------
+
+def _ler_varint(dados, i):
+    """Lê um varint protobuf a partir da posição i"""
+    valor = 0
+    deslocamento = 0
+    while True:
+        byte = dados[i]
+        i += 1
+        valor |= (byte & 0x7F) << deslocamento
+        deslocamento += 7
+        if not byte & 0x80:
+            return valor, i
+
+
+def indexar_blocos_pbf(pbf_file):
+    """
+    Lista os blocos (blobs) do PBF sem descomprimir os dados
+
+    Lê apenas o tamanho e o BlobHeader de cada bloco. Retorna
+    (cabecalho, blocos): o par (offset, tamanho) do bloco OSMHeader e a
+    lista de pares (offset, tamanho) dos blocos OSMData, em ordem no arquivo.
+    """
+    cabecalho = None
+    blocos = []
+    with open(pbf_file, 'rb') as f:
+        offset = 0
+        while True:
+            prefixo = f.read(4)
+            if len(prefixo) < 4:
+                break
+            tam_header = struct.unpack('>I', prefixo)[0]
+            blob_header = f.read(tam_header)
+
+            tipo = None
+            tam_dados = 0
+            i = 0
+            while i < len(blob_header):
+                chave, i = _ler_varint(blob_header, i)
+                campo, tipo_fio = chave >> 3, chave & 0x7
+                if tipo_fio == 2:
+                    tam, i = _ler_varint(blob_header, i)
+                    if campo == 1:
+                        tipo = blob_header[i:i + tam].decode()
+                    i += tam
+                else:
+                    valor, i = _ler_varint(blob_header, i)
+                    if campo == 3:
+                        tam_dados = valor
+
+            f.seek(tam_dados, 1)
+            tamanho = 4 + tam_header + tam_dados
+            if tipo == 'OSMHeader':
+                cabecalho = (offset, tamanho)
+            elif tipo == 'OSMData':
+                blocos.append((offset, tamanho))
+            offset += tamanho
+
+    return cabecalho, blocos
+
+
+def particionar_blocos(blocos, n_faixas):
+    """Divide os blocos em até n_faixas faixas contíguas de tamanho parecido"""
+    if not blocos:
+        return []
+    tamanhos = np.array([t for _, t in blocos], dtype=np.int64)
+    acumulado = np.cumsum(tamanhos)
+    cortes = np.searchsorted(acumulado, acumulado[-1] * np.arange(1, n_faixas) / n_faixas)
+    inicios = np.unique(np.concatenate([[0], cortes]))
+    inicios = inicios[inicios < len(blocos)]
+    fins = np.append(inicios[1:], len(blocos))
+    return [(blocos[a][0], blocos[b - 1][0] + blocos[b - 1][1]) for a, b in zip(inicios, fins)]
+
+
+def _ler_faixa(pbf_file, cabecalho, faixa):
+    """Monta um PBF válido em memória: cabeçalho + blocos da faixa"""
+    with open(pbf_file, 'rb') as f:
+        f.seek(cabecalho[0])
+        dados = f.read(cabecalho[1])
+        f.seek(faixa[0])
+        dados += f.read(faixa[1] - faixa[0])
+    return dados
+
+
+class _WaysRefsHandler(osmium.SimpleHandler):
+    """Decodifica as highways de uma faixa: refs de nós + tags, em colunas"""
+
+    def __init__(self):
+        super().__init__()
+        self.refs = array('q')
+        self.offsets = array('q', [0])
+        self.osm_id = array('q')
+        self.tags = {tag: [] for tag in TAGS_HIGHWAY}
+
+    def way(self, w):
+        refs = [n.ref for n in w.nodes]
+        if len(refs) < 2:
+            return
+        self.refs.extend(refs)
+        self.offsets.append(len(self.refs))
+        self.osm_id.append(w.id)
+        for tag in TAGS_HIGHWAY:
+            self.tags[tag].append(w.tags.get(tag, ''))
+
+
+class _NosHandler(osmium.SimpleHandler):
+    """Decodifica os nós de uma faixa em arrays (id, lon, lat)"""
+
+    def __init__(self):
+        super().__init__()
+        self.ids = array('q')
+        self.lon = array('d')
+        self.lat = array('d')
+
+    def node(self, n):
+        loc = n.location
+        if loc.valid():
+            self.ids.append(n.id)
+            self.lon.append(loc.lon)
+            self.lat.append(loc.lat)
+
+
+def _decodificar_ways_faixa(args):
+    """Worker da fase 1: highways da faixa em formato colunar"""
+    pbf_file, cabecalho, faixa = args
+    handler = _WaysRefsHandler()
+    handler.apply_buffer(_ler_faixa(pbf_file, cabecalho, faixa), 'pbf', filters=filtros_highway())
+    return {
+        'refs': np.frombuffer(handler.refs, dtype=np.int64).copy(),
+        'offsets': np.frombuffer(handler.offsets, dtype=np.int64).copy(),
+        'osm_id': np.frombuffer(handler.osm_id, dtype=np.int64).copy(),
+        'tags': handler.tags,
+    }
+
+
+def _decodificar_nos_faixa(args):
+    """Worker da fase 2: localização dos nós da faixa usados pelas highways"""
+    pbf_file, cabecalho, faixa, arquivo_ids = args
+    # Memory-map + ndarray direto no IdFilter: sem lista Python de ids por processo
+    necessarios = np.load(arquivo_ids, mmap_mode='r')
+    filtros = [
+        osmium.filter.EntityFilter(osmium.osm.NODE),
+        osmium.filter.IdFilter(necessarios).enable_for(osmium.osm.NODE),
+    ]
+    handler = _NosHandler()
+    handler.apply_buffer(_ler_faixa(pbf_file, cabecalho, faixa), 'pbf', filters=filtros)
+
+    return (np.frombuffer(handler.ids, dtype=np.int64).copy(),
+            np.frombuffer(handler.lon, dtype=np.float64).copy(),
+            np.frombuffer(handler.lat, dtype=np.float64).copy())
+
+
+def extrair_highways_paralelo(pbf_file, workers=None, limite=None, faixas_por_worker=4,
+                              dir_temp=None, guardar_estado=False):
+    """
+    Extrai as highways de SP decodificando faixas de blocos do PBF em paralelo
+
+    Fase 1: cada processo decodifica as highways de uma faixa de blocos
+    (refs de nós + tags, em colunas); a união das refs dá os nós necessários.
+    Fase 2: cada processo decodifica os nós de uma faixa, com filtro de ids
+    no osmium para entregar só os necessários. As coordenadas são então resolvidas de forma vetorizada
+    (searchsorted) e o filtro de SP (retângulo + LimiteSP) é aplicado em lote.
+
+    As faixas são concatenadas na ordem do arquivo, então o resultado é o
+    mesmo (e na mesma ordem) da leitura sequencial com HighwayHandler.
+    Retorna (gdf, estatisticas). Com guardar_estado=True, estatisticas['estado']
+    traz o estado da atualização incremental (ver montar_estado).
+    """
+    workers = workers or os.cpu_count()
+    cabecalho, blocos = indexar_blocos_pbf(pbf_file)
+    faixas = particionar_blocos(blocos, workers * faixas_por_worker)
+    print(f"  {len(blocos):,} blocos em {len(faixas)} faixas, {workers} processos")
+
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        # Fase 1: highways (refs + tags) por faixa
+        print("  Fase 1: decodificando highways...")
+        partes = list(executor.map(_decodificar_ways_faixa,
+                                   [(str(pbf_file), cabecalho, f) for f in faixas]))
+
+        refs = np.concatenate([p['refs'] for p in partes])
+        base = np.cumsum([0] + [len(p['refs']) for p in partes[:-1]])
+        offsets = np.concatenate([[0]] + [p['offsets'][1:] + b for p, b in zip(partes, base)])
+        osm_id = np.concatenate([p['osm_id'] for p in partes])
+        tags = {tag: [v for p in partes for v in p['tags'][tag]] for tag in TAGS_HIGHWAY}
+        del partes
+
+        necessarios = np.unique(refs)
+        print(f"  Highways: {len(osm_id):,} | nós necessários: {len(necessarios):,}")
+
+        # Fase 2: localização apenas dos nós necessários
+        print("  Fase 2: decodificando nós...")
+        fd, arquivo_ids = tempfile.mkstemp(suffix='.npy', dir=dir_temp)
+        os.close(fd)
+        try:
+            np.save(arquivo_ids, necessarios)
+            nos = list(executor.map(_decodificar_nos_faixa,
+                                    [(str(pbf_file), cabecalho, f, arquivo_ids) for f in faixas]))
+        finally:
+            os.remove(arquivo_ids)
+
+    ids_nos = np.concatenate([n[0] for n in nos])
+    lon_nos = np.concatenate([n[1] for n in nos])
+    lat_nos = np.concatenate([n[2] for n in nos])
+    del nos
+    ordem = np.argsort(ids_nos, kind='stable')
+    ids_nos, lon_nos, lat_nos = ids_nos[ordem], lon_nos[ordem], lat_nos[ordem]
+
+    # Resolver coordenadas; ways com nó ausente são descartadas (como no
+    # location handler sequencial)
+    pos = np.minimum(np.searchsorted(ids_nos, refs), max(len(ids_nos) - 1, 0))
+    encontrado = ids_nos[pos] == refs if len(ids_nos) else np.zeros(len(refs), dtype=bool)
+    x = lon_nos[pos]
+    y = lat_nos[pos]
+
+    n_ways = len(osm_id)
+    inicio = offsets[:-1]
+    completa = np.logical_and.reduceat(encontrado, inicio) if n_ways else np.zeros(0, dtype=bool)
+    no_retangulo = (x >= SP_BOUNDS[0]) & (x <= SP_BOUNDS[2]) & (y >= SP_BOUNDS[1]) & (y <= SP_BOUNDS[3])
+    em_sp = completa & (np.logical_or.reduceat(no_retangulo, inicio) if n_ways else completa)
+
+    estatisticas = {'highway_count': n_ways, 'sp_count': int(em_sp.sum()), 'fora_limite': 0}
+
+    manter = em_sp.copy()
+    if limite is not None:
+        dentro = limite.ways_dentro(x, y, offsets)
+        manter &= dentro
+        estatisticas['fora_limite'] = int((em_sp & ~dentro).sum())
+
+    geometrias = shapely.from_ragged_array(
+        shapely.GeometryType.LINESTRING, np.column_stack([x, y]), (offsets,)
+    )
+    data = {'osm_id': osm_id}
+    data.update(tags)
+    gdf = gpd.GeoDataFrame(data, geometry=geometrias, crs='EPSG:4326')
+    gdf = aplicar_esquema(gdf[manter].reset_index(drop=True))
+
+    if guardar_estado:
+        estatisticas['estado'] = montar_estado(osm_id, offsets, refs, x, y, manter)
+
+    return gdf, estatisticas
+
+
+# ---------------------------------------------------------------------------
+# Atualização incremental a partir de arquivos OsmChange (.osc)
+# ---------------------------------------------------------------------------
+
+def _selecionar_ways(offsets, mascara):
+    """Máscara de vértices e novos offsets das ways selecionadas por `mascara`"""
+    tamanhos = np.diff(offsets)
+    vertices = np.repeat(mascara, tamanhos)
+    novos_offsets = np.concatenate([[0], np.cumsum(tamanhos[mascara])]).astype(np.int64)
+    return vertices, novos_offsets
+
+
+def montar_estado(osm_id, offsets, refs, x, y, mascara=None):
+    """
+    Monta o estado da atualização incremental
+
+    O estado guarda, para cada way da base extraída, os ids dos seus nós
+    (refs + offsets) e uma tabela ordenada id -> (lon, lat) com os nós
+    usados. É o suficiente para reconstruir a geometria de uma way quando
+    um .osc move os seus nós, sem reler o PBF.
+    """
+    osm_id = np.asarray(osm_id, dtype=np.int64)
+    offsets = np.asarray(offsets, dtype=np.int64)
+    refs = np.asarray(refs, dtype=np.int64)
+    x = np.asarray(x, dtype=np.float64)
+    y = np.asarray(y, dtype=np.float64)
+
+    if mascara is not None:
+        vertices, offsets = _selecionar_ways(offsets, mascara)
+        osm_id, refs, x, y = osm_id[mascara], refs[vertices], x[vertices], y[vertices]
+
+    no_id, idx = np.unique(refs, return_index=True)
+    return {
+        'osm_id': osm_id.copy(),
+        'offsets': offsets.copy(),
+        'refs': refs.copy(),
+        'no_id': no_id,
+        'no_lon': x[idx],
+        'no_lat': y[idx],
+    }
+
+
+def salvar_estado(estado, arquivo):
+    """Grava o estado incremental em .npz"""
+    np.savez(arquivo, **estado)
+
+
+def carregar_estado(arquivo):
+    """Lê o estado incremental gravado por salvar_estado"""
+    with np.load(arquivo) as dados:
+        return {chave: dados[chave] for chave in dados.files}
+
+
+class OscHandler(osmium.SimpleHandler):
+    """
+    Lê um arquivo OsmChange (.osc / .osc.gz)
+
+    Nós: id, localização e se foi removido. Ways: para cada id, a última
+    versão do arquivo -- (refs, tags) se é uma highway ativa ou None se foi
+    removida ou deixou de ter a tag highway.
+    """
+
+    def __init__(self):
+        super().__init__()
+        self.no_id = array('q')
+        self.no_lon = array('d')
+        self.no_lat = array('d')
+        self.no_removido = array('b')
+        self.ways = {}
+
+    def node(self, n):
+        self.no_id.append(n.id)
+        if n.deleted or not n.location.valid():
+            self.no_lon.append(np.nan)
+            self.no_lat.append(np.nan)
+            self.no_removido.append(1)
+        else:
+            self.no_lon.append(n.location.lon)
+            self.no_lat.append(n.location.lat)
+            self.no_removido.append(0)
+
+    def way(self, w):
+        if w.deleted or 'highway' not in w.tags:
+            self.ways[w.id] = None
+        else:
+            self.ways[w.id] = ([n.ref for n in w.nodes],
+                               {tag: w.tags.get(tag, '') for tag in TAGS_HIGHWAY})
+
+
+def aplicar_osc(estado, osc_file, limite=None):
+    """
+    Aplica um .osc ao estado incremental e reconstrói só as ways afetadas
+
+    Ways afetadas:
+    - alteradas: ways presentes no .osc (criadas, modificadas ou removidas)
+    - movidas: ways da base que referenciam um nó alterado no .osc
+
+    As geometrias são reconstruídas a partir da tabela de nós atualizada e
+    passam pelo mesmo filtro da extração (SP_BOUNDS + LimiteSP). Ways com
+    nó fora da tabela (nó antigo que não pertencia a nenhuma highway e não
+    veio no .osc) ficam como pendentes e saem da base até a próxima
+    extração completa.
+
+    Retorna (estado_novo, resultado), com resultado contendo:
+    - 'alteradas': ids das ways do .osc (saem da base antes de reinserir)
+    - 'movidas': ids das ways da base com nós alterados
+    - 'gdf_alteradas': GeoDataFrame (osm_id + tags) das ways do .osc aceitas
+    - 'geom_movidas': GeoSeries indexada por osm_id das ways movidas aceitas
+    - 'pendentes', 'fora_sp': ids descartados
+    """
+    handler = OscHandler()
+    handler.apply_file(str(osc_file))
+
+    # 1. Tabela de nós: o último registro de cada id vence (.osc depois do estado)
+    ids = np.concatenate([estado['no_id'], np.frombuffer(handler.no_id, dtype=np.int64)])
+    lon = np.concatenate([estado['no_lon'], np.frombuffer(handler.no_lon, dtype=np.float64)])
+    lat = np.concatenate([estado['no_lat'], np.frombuffer(handler.no_lat, dtype=np.float64)])
+    removido = np.concatenate([np.zeros(len(estado['no_id']), dtype=bool),
+                               np.frombuffer(handler.no_removido, dtype=np.int8).astype(bool)])
+    no_id, idx = np.unique(ids[::-1], return_index=True)
+    no_lon, no_lat, no_removido = lon[::-1][idx], lat[::-1][idx], removido[::-1][idx]
+    no_id, no_lon, no_lat = no_id[~no_removido], no_lon[~no_removido], no_lat[~no_removido]
+    nos_alterados = np.unique(np.frombuffer(handler.no_id, dtype=np.int64))
+
+    # 2. Ways afetadas
+    osm_id, offsets, refs = estado['osm_id'], estado['offsets'], estado['refs']
+    ids_osc = np.fromiter(handler.ways.keys(), dtype=np.int64, count=len(handler.ways))
+    em_osc = np.isin(osm_id, ids_osc)
+    if len(osm_id):
+        movida = np.logical_or.reduceat(np.isin(refs, nos_alterados), offsets[:-1]) & ~em_osc
+    else:
+        movida = np.zeros(0, dtype=bool)
+
+    novas = [(wid, v[0], v[1]) for wid, v in handler.ways.items() if v is not None and len(v[0]) >= 2]
+
+    # 3. Novo conjunto de ways: base sem as do .osc + ways do .osc ativas
+    vertices, offsets_mant = _selecionar_ways(offsets, ~em_osc)
+    tamanhos_novas = np.array([len(r) for _, r, _ in novas], dtype=np.int64)
+    osm_id_todas = np.concatenate([osm_id[~em_osc], np.array([wid for wid, _, _ in novas], dtype=np.int64)])
+    refs_todas = np.concatenate([refs[vertices]] + [np.array(r, dtype=np.int64) for _, r, _ in novas])
+    offsets_todas = np.concatenate([offsets_mant, offsets_mant[-1] + np.cumsum(tamanhos_novas)])
+    eh_nova = np.concatenate([np.zeros(len(offsets_mant) - 1, dtype=bool), np.ones(len(novas), dtype=bool)])
+    alvo = np.concatenate([movida[~em_osc], np.zeros(len(novas), dtype=bool)]) | eh_nova
+
+    # 4. Reconstruir apenas as ways alvo
+    vert_alvo, offsets_alvo = _selecionar_ways(offsets_todas, alvo)
+    refs_alvo = refs_todas[vert_alvo]
+    pos = np.minimum(np.searchsorted(no_id, refs_alvo), max(len(no_id) - 1, 0))
+    encontrado = no_id[pos] == refs_alvo if len(no_id) else np.zeros(len(refs_alvo), dtype=bool)
+    x, y = no_lon[pos], no_lat[pos]
+
+    n_alvo = int(alvo.sum())
+    if n_alvo:
+        inicio = offsets_alvo[:-1]
+        completa = np.logical_and.reduceat(encontrado, inicio)
+        no_retangulo = (x >= SP_BOUNDS[0]) & (x <= SP_BOUNDS[2]) & (y >= SP_BOUNDS[1]) & (y <= SP_BOUNDS[3])
+        em_sp = np.logical_or.reduceat(no_retangulo, inicio)
+        if limite is not None:
+            em_sp &= limite.ways_dentro(x, y, offsets_alvo)
+    else:
+        completa = em_sp = np.zeros(0, dtype=bool)
+    aceita = completa & em_sp
+
+    geometrias = shapely.from_ragged_array(
+        shapely.GeometryType.LINESTRING, np.column_stack([x, y]), (offsets_alvo,)
+    ) if n_alvo else np.array([], dtype=object)
+
+    ids_alvo = osm_id_todas[alvo]
+    nova_alvo = eh_nova[alvo]
+
+    tags_novas = {wid: t for wid, _, t in novas}
+    sel = aceita & nova_alvo
+    data = {'osm_id': ids_alvo[sel]}
+    for tag in TAGS_HIGHWAY:
+        data[tag] = [tags_novas[wid][tag] for wid in ids_alvo[sel]]
+    gdf_alteradas = aplicar_esquema(gpd.GeoDataFrame(data, geometry=list(geometrias[sel]), crs='EPSG:4326'))
+
+    sel = aceita & ~nova_alvo
+    geom_movidas = gpd.GeoSeries(list(geometrias[sel]), index=ids_alvo[sel], crs='EPSG:4326')
+
+    # 5. Novo estado: descarta as ways alvo rejeitadas e poda a tabela de nós
+    manter = np.ones(len(osm_id_todas), dtype=bool)
+    manter[np.flatnonzero(alvo)[~aceita]] = False
+    vertices, offsets_final = _selecionar_ways(offsets_todas, manter)
+    refs_final = refs_todas[vertices]
+    nos_final = np.unique(refs_final)
+    pos = np.searchsorted(no_id, nos_final)
+    estado_novo = {
+        'osm_id': osm_id_todas[manter],
+        'offsets': offsets_final,
+        'refs': refs_final,
+        'no_id': nos_final,
+        'no_lon': no_lon[pos],
+        'no_lat': no_lat[pos],
+    }
+
+    resultado = {
+        'alteradas': ids_osc,
+        'movidas': osm_id[movida],
+        'gdf_alteradas': gdf_alteradas,
+        'geom_movidas': geom_movidas,
+        'pendentes': ids_alvo[~completa],
+        'fora_sp': ids_alvo[completa & ~em_sp],
+    }
+    return estado_novo, resultado
+
+
+# ---------------------------------------------------------------------------
+# Cache da extração em GeoParquet
+# ---------------------------------------------------------------------------
+
+def chave_extracao(pbf_file, arquivo_limite=MUNICIPIOS_SP):
+    """
+    Chave do cache da extração
+
+    Combina o hash do conteúdo do PBF com os parâmetros que mudam o
+    resultado: filtro/tag list, retângulo SP_BOUNDS e o arquivo do limite
+    estadual usado no recorte (None se ausente).
+    """
+    arquivo_limite = Path(arquivo_limite)
+    return {
+        'versao': VERSAO_CACHE_EXTRACAO,
+        'hash_pbf': hash_arquivo(pbf_file),
+        'filtro': 'highway',
+        'tags': TAGS_HIGHWAY,
+        'sp_bounds': list(SP_BOUNDS),
+        'hash_limite': hash_arquivo(arquivo_limite) if arquivo_limite.exists() else None,
+    }
+
+
+def caminho_cache_extracao(chave, cache_dir=CACHE_EXTRACAO_DIR):
+    """GeoParquet do cache correspondente à chave (pode não existir)"""
+    hash_chave = hashlib.sha256(json.dumps(chave, sort_keys=True).encode()).hexdigest()[:20]
+    return Path(cache_dir) / f'osm_sp_highways_{hash_chave}.parquet'
+
+
+def salvar_cache_extracao(arquivo_parquet, arquivo_estado, chave, cache_dir=CACHE_EXTRACAO_DIR):
+    """Copia a base (GeoParquet) e o estado incremental para o cache"""
+    arquivo_cache = caminho_cache_extracao(chave, cache_dir)
+    arquivo_cache.parent.mkdir(parents=True, exist_ok=True)
+    shutil.copyfile(arquivo_parquet, arquivo_cache)
+    if arquivo_estado is not None and Path(arquivo_estado).exists():
+        shutil.copyfile(arquivo_estado, arquivo_cache.with_suffix('.npz'))
+    with open(arquivo_cache.with_suffix('.json'), 'w', encoding='utf-8') as f:
+        json.dump(chave, f, ensure_ascii=False, indent=2)
+    return arquivo_cache
+
+
+def restaurar_cache_extracao(chave, arquivo_parquet, arquivo_estado, cache_dir=CACHE_EXTRACAO_DIR):
+    """
+    Copia a entrada do cache para os arquivos de trabalho
+
+    Nada de uma extração anterior fica ao lado da base restaurada: sem estado
+    incremental no cache, arquivo_estado é removido (aplicar .osc sobre uma
+    tabela de nós de outro PBF corromperia a base), e o GeoPackage da
+    extração anterior também (o GeoParquet é a base de referência, ver
+    ler_base_osm). Retorna True se a entrada existia (extração pode ser
+    pulada).
+    """
+    arquivo_cache = caminho_cache_extracao(chave, cache_dir)
+    if not arquivo_cache.exists():
+        return False
+    shutil.copyfile(arquivo_cache, arquivo_parquet)
+    if arquivo_cache.with_suffix('.npz').exists():
+        shutil.copyfile(arquivo_cache.with_suffix('.npz'), arquivo_estado)
+    else:
+        Path(arquivo_estado).unlink(missing_ok=True)
+    Path(arquivo_parquet).with_suffix('.gpkg').unlink(missing_ok=True)
+    return True
+
+
+def ler_base_osm(arquivo, colunas=None):
+    """
+    Lê a base OSM extraída, de preferência do GeoParquet ao lado do GPKG
+
+    `arquivo` pode ser o .gpkg ou o .parquet. O GeoParquet é usado quando
+    existe e não é mais antigo que o GPKG (o modo streaming só grava o
+    GPKG); `colunas` restringe as colunas lidas (a geometria é sempre lida).
+    O esquema compacto (esquema_malha) é aplicado na leitura.
+    """
+    arquivo = Path(arquivo)
+    parquet = arquivo.with_suffix('.parquet')
+    gpkg = arquivo.with_suffix('.gpkg')
+
+    if parquet.exists() and (not gpkg.exists() or parquet.stat().st_mtime >= gpkg.stat().st_mtime):
+        return ler_malha(parquet, columns=None if colunas is None else list(colunas) + ['geometry'])
+    return ler_malha(gpkg, columns=colunas)
@@ -2,14 +2,27 @@
 Extração da Malha Viária Municipal do Estado de São Paulo
 Metodologia: Exclusão progressiva de vias federais, estaduais e urbanas
 
+As etapas de filtro formam um pipeline declarativo (ETAPAS). Cada etapa é
+uma função pura (linhas ativas, config) -> máscara das linhas mantidas, sem
+copiar o GeoDataFrame. A máscara acumulada de cada etapa fica em cache em
+disco com chave encadeada (conteúdo da entrada + configuração desta etapa e
+das anteriores), então alterar uma etapa só reavalia ela e as seguintes.
+
 Autor: Análise automatizada
 Data: Janeiro/2026
 """
 
+import argparse
+import hashlib
+import json
+import time
 import geopandas as gpd
 import pandas as pd
+import numpy as np
 import re
 from pathlib import Path
+from esquema_malha import aplicar_esquema, hash_arquivo, ler_malha, gravar_malha
+from filtro_area_urbana import FRACAO_MAXIMA_AU, fracao_em_area_urbana
 
 # Configurações
 INPUT_FILE = r'D:\ESTUDO_VICINAIS_V2\dados\base_linhas.gpkg'
@@ -17,47 +30,83 @@ OUTPUT_DIR = Path(r'D:\ESTUDO_VICINAIS_V2\resultados\dados_processados')
 INTERMEDIARIO_DIR = Path(r'D:\ESTUDO_VICINAIS_V2\resultados\intermediarios')
 RELATORIO_DIR = Path(r'D:\ESTUDO_VICINAIS_V2\resultados\relatorios')
 AU_IBGE_FILE = r'D:\ESTUDO_VICINAIS_V2\dados\au_ibge.gpkg'
+CACHE_DIR = Path(r'D:\ESTUDO_VICINAIS_V2\resultados\cache\filtros_malha')
+
+# Versão do formato das máscaras em cache (incrementar invalida o cache)
+VERSAO_CACHE = 1
 
-def log_stats(gdf, etapa, descricao):
-    """Loga estatísticas de cada etapa"""
+# Tipos de highway claramente não-municipais ou urbanos
+EXCLUIR_HIGHWAY = [
+    'motorway', 'motorway_link',
+    'trunk', 'trunk_link',
+    'residential', 'living_street',
+    'service'
+]
+
+def log_stats(gdf, etapa, descricao, mascara=None):
+    """Loga estatísticas de cada etapa (só as linhas da máscara, quando dada)"""
+    total = len(gdf) if mascara is None else int(mascara.sum())
     print(f"\n{'='*60}")
     print(f"ETAPA {etapa}: {descricao}")
     print(f"{'='*60}")
-    print(f"Total de registros: {len(gdf):,}")
+    print(f"Total de registros: {total:,}")
     if 'highway' in gdf.columns:
+        highway = gdf['highway'] if mascara is None else gdf['highway'][mascara]
         print(f"\nDistribuição por highway:")
-        print(gdf['highway'].value_counts().head(10).to_string())
-    return len(gdf)
+        print(highway.value_counts().head(10).to_string())
+    return total
 
-def etapa1_filtro_highway(gdf):
+def etapa1_filtro_highway(gdf, config):
     """
     ETAPA 1: Excluir tipos de highway que são claramente não-municipais ou urbanas
     
-    Excluir:
+    Excluir (config['excluir']):
     - motorway, motorway_link: Autoestradas (sempre estaduais/federais)
     - trunk, trunk_link: Rodovias principais (estaduais/federais)
     - residential: Ruas residenciais (urbanas - prefeitura)
     - living_street: Zonas de tráfego calmo (urbanas)
     - service: Vias de serviço (urbanas/privadas)
-    """
     
-    excluir_highway = [
-        'motorway', 'motorway_link',
-        'trunk', 'trunk_link',
-        'residential', 'living_street',
-        'service'
-    ]
-    
-    # Filtrar
-    mask = ~gdf['highway'].isin(excluir_highway)
-    resultado = gdf[mask].copy()
-    
-    print(f"\nTipos excluídos: {excluir_highway}")
-    print(f"Registros removidos: {len(gdf) - len(resultado):,}")
-    
-    return resultado
+    Retorna a máscara das linhas mantidas.
+    """
+    return ~gdf['highway'].isin(config['excluir']).to_numpy()
+
+# Rodovia federal (BR-xxx) ou estadual (SP-xxx), exceto quando a referência
+# também tem código municipal (SPA-, SPI-, SPM-); aplicado à ref em maiúsculas
+REGEX_REF_FEDERAL_ESTADUAL = re.compile(r'\bBR-\d+|^(?!.*\bSP[AIM]-).*\bSP-\d+', re.DOTALL)
+
+# Prefixos de nomes tipicamente urbanos (uma única alternação, sem diferenciar maiúsculas)
+PREFIXOS_URBANOS = [
+    'Rua', 'Avenida', r'Av\.', 'Travessa', 'Alameda', 'Praça', 'Viela',
+    'Largo', 'Beco', 'Passagem', 'Ladeira', 'Passeio',
+]
+
+
+def regex_nome_urbano(prefixos):
+    """Regex de nome urbano: um dos prefixos no início, seguido de espaço"""
+    return re.compile(r'^(?:' + '|'.join(prefixos) + r')\s', re.IGNORECASE)
+
+
+REGEX_NOME_URBANO = regex_nome_urbano(PREFIXOS_URBANOS)
+
+
+def contem_por_categoria(serie, regex, maiusculas=False):
+    """
+    str.contains avaliado uma vez por valor distinto
+
+    A coluna vira categórica e a regex roda só sobre as categorias (poucos
+    milhares de refs/nomes distintos em milhões de linhas); o resultado
+    volta para as linhas pelos códigos. Nulos dão False.
+    """
+    categorica = serie.astype('category')
+    categorias = pd.Series(categorica.cat.categories.astype(str))
+    if maiusculas:
+        categorias = categorias.str.upper()
+    por_categoria = np.append(categorias.str.contains(regex).to_numpy(dtype=bool), False)
+    return pd.Series(por_categoria[categorica.cat.codes.to_numpy()], index=serie.index)
+
 
-def etapa2_filtro_referencia(gdf):
+def etapa2_filtro_referencia(gdf, config):
     """
     ETAPA 2: Excluir vias com referência de rodovia federal (BR-) ou estadual (SP-)
     
@@ -65,125 +114,146 @@ def etapa2_filtro_referencia(gdf):
     - SPA-xxx (Estrada Vicinal Acesso)
     - SPI-xxx (Estrada Vicinal Interna)
     - SPM-xxx (Estrada Municipal)
-    """
-    
-    def is_federal_ou_estadual(ref):
-        """Verifica se a referência é de rodovia federal ou estadual"""
-        if pd.isna(ref):
-            return False
-        
-        ref_upper = str(ref).upper()
-        
-        # Padrão de rodovia federal: BR-xxx
-        if re.search(r'\bBR-\d+', ref_upper):
-            return True
-        
-        # Padrão de rodovia estadual: SP-xxx (mas não SPA, SPI, SPM que são municipais)
-        # SP-xxx onde xxx são números
-        if re.search(r'\bSP-\d+', ref_upper):
-            # Verificar se NÃO é código municipal
-            if not re.search(r'\bSP[AIM]-', ref_upper):
-                return True
-        
-        return False
-    
-    # Aplicar filtro
-    mask_federal_estadual = gdf['ref'].apply(is_federal_ou_estadual)
-    resultado = gdf[~mask_federal_estadual].copy()
-    
-    print(f"\nRegistros com ref BR/SP removidos: {mask_federal_estadual.sum():,}")
     
-    # Mostrar exemplos de refs mantidas
-    refs_mantidas = resultado[resultado['ref'].notna()]['ref'].value_counts().head(10)
-    print(f"\nTop 10 refs MANTIDAS (municipais):")
-    print(refs_mantidas.to_string())
-    
-    return resultado
+    Retorna a máscara das linhas mantidas.
+    """
+    regex = re.compile(config['regex'], config['flags'])
+    return ~contem_por_categoria(gdf['ref'], regex, maiusculas=True).to_numpy()
 
-def etapa3_filtro_nomes_urbanos(gdf):
+def etapa3_filtro_nomes_urbanos(gdf, config):
     """
     ETAPA 3: Excluir vias com nomes tipicamente urbanos
     
-    Excluir:
+    Excluir (config['prefixos']):
     - Rua, Avenida, Travessa, Alameda, Praça, Viela, Largo, Beco, Passagem
     
     Manter:
     - Estrada, Rodovia, Vicinal, Acesso, Caminho
-    """
-    
-    padroes_urbanos = [
-        r'^Rua\s',
-        r'^Avenida\s',
-        r'^Av\.\s',
-        r'^Travessa\s',
-        r'^Alameda\s',
-        r'^Praça\s',
-        r'^Viela\s',
-        r'^Largo\s',
-        r'^Beco\s',
-        r'^Passagem\s',
-        r'^Ladeira\s',
-        r'^Passeio\s',
-    ]
-    
-    def is_nome_urbano(nome):
-        """Verifica se o nome indica via urbana"""
-        if pd.isna(nome):
-            return False
-        
-        nome_str = str(nome)
-        for padrao in padroes_urbanos:
-            if re.search(padrao, nome_str, re.IGNORECASE):
-                return True
-        return False
-    
-    # Aplicar filtro
-    mask_urbano = gdf['name'].apply(is_nome_urbano)
-    resultado = gdf[~mask_urbano].copy()
     
-    print(f"\nRegistros com nomes urbanos removidos: {mask_urbano.sum():,}")
-    
-    # Mostrar exemplos de nomes mantidos
-    nomes_mantidos = resultado[resultado['name'].notna()]['name'].value_counts().head(15)
-    print(f"\nTop 15 nomes MANTIDOS:")
-    print(nomes_mantidos.to_string())
-    
-    return resultado
+    Retorna a máscara das linhas mantidas.
+    """
+    return ~contem_por_categoria(gdf['name'], regex_nome_urbano(config['prefixos'])).to_numpy()
 
-def etapa4_filtro_espacial_au(gdf, au_file):
+def etapa4_filtro_espacial_au(gdf, config):
     """
     ETAPA 4 (OPCIONAL): Excluir vias dentro de áreas urbanas IBGE
     
-    Usa o arquivo au_ibge.gpkg para remover vias que estão
-    completamente dentro de áreas urbanas.
+    Usa o arquivo config['arquivo'] (au_ibge.gpkg). No modo 'fracao' os
+    polígonos AU individuais vão para uma STRtree (sem dissolve) e saem as
+    vias com fração do comprimento em AU acima de config['fracao_maxima'];
+    no modo 'within' saem as vias completamente dentro da AU dissolvida.
+    Retorna a máscara das linhas mantidas.
     """
-    
-    print("\nCarregando áreas urbanas IBGE...")
-    au = gpd.read_file(au_file)
+    au = gpd.read_file(config['arquivo'])
     
     # Garantir mesmo CRS
     if gdf.crs != au.crs:
         au = au.to_crs(gdf.crs)
     
-    print(f"Total de polígonos AU: {len(au):,}")
+    if config['modo'] == 'fracao':
+        return fracao_em_area_urbana(gdf, au) <= config['fracao_maxima']
     
-    # Dissolver todas as áreas urbanas em um único polígono (mais eficiente)
-    print("Dissolvendo áreas urbanas...")
+    # Dissolver todas as áreas urbanas em um único polígono
     au_dissolved = au.dissolve()
     
-    # Verificar quais vias estão DENTRO de áreas urbanas
-    print("Identificando vias dentro de AU...")
-    
-    # Usar sjoin para eficiência
-    vias_em_au = gpd.sjoin(gdf, au_dissolved, predicate='within', how='inner')
-    indices_em_au = set(vias_em_au.index)
-    
-    # Filtrar vias que NÃO estão em AU
-    resultado = gdf[~gdf.index.isin(indices_em_au)].copy()
-    
-    print(f"\nVias dentro de AU removidas: {len(indices_em_au):,}")
-    
-    return resultado
+    # Vias DENTRO de áreas urbanas (sjoin para eficiência)
+    vias_em_au = gpd.sjoin(gdf[['geometry']], au_dissolved[['geometry']], predicate='within', how='inner')
+    return ~gdf.index.isin(vias_em_au.index)
+
+# Pipeline de filtros: cada etapa declara a função, as colunas que lê e a
+# configuração (que entra na chave do cache)
+ETAPAS = [
+    {
+        'nome': 'highway',
+        'descricao': 'Filtro Highway',
+        'funcao': etapa1_filtro_highway,
+        'colunas': ['highway'],
+        'config': {'excluir': EXCLUIR_HIGHWAY},
+    },
+    {
+        'nome': 'referencia',
+        'descricao': 'Filtro Referência BR/SP',
+        'funcao': etapa2_filtro_referencia,
+        'colunas': ['ref'],
+        'config': {'regex': REGEX_REF_FEDERAL_ESTADUAL.pattern, 'flags': int(REGEX_REF_FEDERAL_ESTADUAL.flags)},
+    },
+    {
+        'nome': 'nomes_urbanos',
+        'descricao': 'Filtro Nomes Urbanos',
+        'funcao': etapa3_filtro_nomes_urbanos,
+        'colunas': ['name'],
+        'config': {'prefixos': PREFIXOS_URBANOS},
+    },
+]
+
+ETAPA_AU = {
+    'nome': 'area_urbana',
+    'descricao': 'Filtro Áreas Urbanas IBGE',
+    'funcao': etapa4_filtro_espacial_au,
+    'colunas': ['geometry'],
+    'config': {'arquivo': AU_IBGE_FILE, 'modo': 'fracao', 'fracao_maxima': FRACAO_MAXIMA_AU},
+}
+
+
+def chave_etapa(chave_anterior, etapa):
+    """
+    Chave do cache de uma etapa
+
+    Encadeia a chave da etapa anterior com o nome e a configuração desta;
+    arquivos citados na configuração entram pelo hash do conteúdo.
+    """
+    config = dict(etapa['config'])
+    if 'arquivo' in config:
+        config['arquivo'] = hash_arquivo(config['arquivo'])
+    chave = {'anterior': chave_anterior, 'etapa': etapa['nome'], 'config': config, 'versao': VERSAO_CACHE}
+    return hashlib.sha256(json.dumps(chave, sort_keys=True).encode()).hexdigest()[:20]
+
+
+def executar_etapas(gdf, chave_entrada, etapas=ETAPAS, cache_dir=CACHE_DIR):
+    """
+    Aplica as etapas de filtro como máscaras, com cache em disco
+
+    Cada etapa só avalia as linhas mantidas pelas anteriores (e só as
+    colunas que declara). A máscara acumulada é gravada em
+    cache_dir/mascara_<etapa>_<chave>.npy (bits empacotados) e reaproveitada
+    enquanto a entrada e as configurações até ela não mudarem.
+
+    Retorna (mascara, execucao): máscara final e, por etapa, registros
+    mantidos, removidos, tempo e se veio do cache.
+    """
+    cache_dir = Path(cache_dir)
+    cache_dir.mkdir(parents=True, exist_ok=True)
+
+    mascara = np.ones(len(gdf), dtype=bool)
+    chave = chave_entrada
+    execucao = []
+    for numero, etapa in enumerate(etapas, 1):
+        inicio = time.perf_counter()
+        chave = chave_etapa(chave, etapa)
+        arquivo_cache = cache_dir / f"mascara_{etapa['nome']}_{chave}.npy"
+        antes = int(mascara.sum())
+
+        if arquivo_cache.exists():
+            mascara = np.unpackbits(np.load(arquivo_cache), count=len(gdf)).astype(bool)
+            origem = 'cache'
+        else:
+            ativos = np.flatnonzero(mascara)
+            mantidas = np.asarray(etapa['funcao'](gdf.iloc[ativos][etapa['colunas']], etapa['config']), dtype=bool)
+            mascara = mascara.copy()
+            mascara[ativos[~mantidas]] = False
+            np.save(arquivo_cache, np.packbits(mascara))
+            origem = 'calculada'
+
+        tempo = time.perf_counter() - inicio
+        registros = int(mascara.sum())
+        execucao.append({
+            'etapa': numero, 'descricao': etapa['descricao'], 'registros': registros,
+            'removidos': antes - registros, 'tempo_s': tempo, 'origem': origem,
+        })
+        print(f"\n[{etapa['descricao']}] máscara {origem} em {tempo:.2f}s - removidos: {antes - registros:,}")
+        log_stats(gdf, numero, f"Após {etapa['descricao']}", mascara)
+
+    return mascara, execucao
 
 def calcular_comprimento(gdf):
     """Calcula comprimento em metros (reprojetando para UTM)"""
@@ -192,43 +262,45 @@ def calcular_comprimento(gdf):
     gdf['comprimento_m'] = gdf_utm.geometry.length
     return gdf
 
-def main():
+def main(usar_au=False):
     print("="*60)
     print("EXTRAÇÃO DA MALHA VIÁRIA MUNICIPAL - ESTADO DE SÃO PAULO")
     print("="*60)
     
     # Carregar dados
     print(f"\nCarregando base de dados: {INPUT_FILE}")
-    gdf = gpd.read_file(INPUT_FILE)
+    gdf = ler_malha(INPUT_FILE)
     total_inicial = log_stats(gdf, 0, "Base Original")
     
-    # ETAPA 1: Filtro por Highway
-    gdf_e1 = etapa1_filtro_highway(gdf)
-    total_e1 = log_stats(gdf_e1, 1, "Após Filtro Highway")
+    # Etapas de filtro (máscaras em cache, chave a partir do conteúdo da base)
+    etapas = ETAPAS + ([ETAPA_AU] if usar_au else [])
+    mascara, execucao = executar_etapas(gdf, hash_arquivo(INPUT_FILE), etapas)
     
-    # ETAPA 2: Filtro por Referência
-    gdf_e2 = etapa2_filtro_referencia(gdf_e1)
-    total_e2 = log_stats(gdf_e2, 2, "Após Filtro Referência BR/SP")
+    # Única cópia: as linhas mantidas ao final
+    gdf_final = aplicar_esquema(gdf[mascara].copy())
     
-    # ETAPA 3: Filtro por Nomes Urbanos
-    gdf_e3 = etapa3_filtro_nomes_urbanos(gdf_e2)
-    total_e3 = log_stats(gdf_e3, 3, "Após Filtro Nomes Urbanos")
+    refs_mantidas = gdf_final['ref'].dropna().value_counts().head(10)
+    print(f"\nTop 10 refs MANTIDAS (municipais):")
+    print(refs_mantidas.to_string())
+    nomes_mantidos = gdf_final['name'].dropna().value_counts().head(15)
+    print(f"\nTop 15 nomes MANTIDOS:")
+    print(nomes_mantidos.to_string())
     
     # Calcular comprimentos
     print("\n" + "="*60)
     print("Calculando comprimentos...")
-    gdf_final = calcular_comprimento(gdf_e3)
+    gdf_final = calcular_comprimento(gdf_final)
     
     # Estatísticas finais
     print("\n" + "="*60)
     print("RESUMO FINAL")
     print("="*60)
-    print(f"\n{'Etapa':<40} {'Registros':>15} {'% do Total':>12}")
-    print("-"*67)
+    print(f"\n{'Etapa':<40} {'Registros':>15} {'% do Total':>12} {'Tempo':>9}")
+    print("-"*77)
     print(f"{'Base Original':<40} {total_inicial:>15,} {100:>11.1f}%")
-    print(f"{'Após Filtro Highway':<40} {total_e1:>15,} {100*total_e1/total_inicial:>11.1f}%")
-    print(f"{'Após Filtro Referência':<40} {total_e2:>15,} {100*total_e2/total_inicial:>11.1f}%")
-    print(f"{'Após Filtro Nomes Urbanos (FINAL)':<40} {total_e3:>15,} {100*total_e3/total_inicial:>11.1f}%")
+    for e in execucao:
+        rotulo = f"Após {e['descricao']}" + (" (FINAL)" if e is execucao[-1] else "")
+        print(f"{rotulo:<40} {e['registros']:>15,} {100*e['registros']/total_inicial:>11.1f}% {e['tempo_s']:>8.2f}s")
     
     # Comprimento total
     comp_total_km = gdf_final['comprimento_m'].sum() / 1000
@@ -239,9 +311,9 @@ def main():
     print(f"\nSalvando intermediário em: {intermediario_file}")
     
     # Selecionar colunas relevantes
-    colunas_saida = ['name', 'highway', 'ref', 'other_tags', 'comprimento_m', 'geometry']
+    colunas_saida = ['osm_id', 'name', 'highway', 'ref', 'other_tags', 'comprimento_m', 'geometry']
     gdf_saida = gdf_final[[c for c in colunas_saida if c in gdf_final.columns]]
-    gdf_saida.to_file(intermediario_file, driver='GPKG')
+    gravar_malha(gdf_saida, intermediario_file, driver='GPKG')
     
     # Gerar relatório
     relatorio_file = RELATORIO_DIR / 'relatorio_extracao.txt'
@@ -250,9 +322,9 @@ def main():
         f.write("="*60 + "\n\n")
         f.write(f"Data: {pd.Timestamp.now().strftime('%Y-%m-%d %H:%M:%S')}\n\n")
         f.write(f"Base Original: {total_inicial:,} registros\n")
-        f.write(f"Após Filtro Highway: {total_e1:,} registros\n")
-        f.write(f"Após Filtro Referência: {total_e2:,} registros\n")
-        f.write(f"Após Filtro Nomes Urbanos: {total_e3:,} registros\n")
+        for e in execucao:
+            f.write(f"Após {e['descricao']}: {e['registros']:,} registros "
+                    f"(removidos {e['removidos']:,}; {e['tempo_s']:.2f}s, máscara {e['origem']})\n")
         f.write(f"\nExtensão total: {comp_total_km:,.1f} km\n")
         f.write(f"\nDistribuição por highway:\n")
         f.write(gdf_final['highway'].value_counts().to_string())
@@ -267,4 +339,9 @@ def main():
     return gdf_final
 
 if __name__ == "__main__":
-    resultado = main()
+    parser = argparse.ArgumentParser(description="Extração da malha viária municipal")
+    parser.add_argument('--au', action='store_true',
+                        help="Aplica também a etapa 4 (vias dentro de áreas urbanas IBGE)")
+    args = parser.parse_args()
+
+    resultado = main(usar_au=args.au)
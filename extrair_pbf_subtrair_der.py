@@ -6,13 +6,22 @@ Autor: Análise automatizada
 Data: Janeiro/2026
 """
 
-import osmium
+import argparse
 import geopandas as gpd
 import pandas as pd
-from shapely.geometry import LineString, Point
-from shapely.ops import unary_union
+from shapely import STRtree
 from pathlib import Path
 from datetime import datetime
+from extracao_pbf import (
+    SP_BOUNDS, HighwayHandler, filtros_highway, carregar_limite_sp,
+    extrair_highways_streaming, salvar_estado, chave_extracao, salvar_cache_extracao,
+    restaurar_cache_extracao
+)
+from esquema_malha import ler_malha, gravar_malha
+from sobreposicao_der import (
+    JURISDICOES_SRE, carregar_buffer_der, calcular_proporcao_sobreposta,
+    calcular_proporcao_sobreposta_paralela
+)
 import warnings
 warnings.filterwarnings('ignore')
 
@@ -23,68 +32,10 @@ OUTPUT_DIR = Path(r'D:\ESTUDO_VICINAIS_V2\resultados\dados_processados')
 INTERMEDIARIO_DIR = Path(r'D:\ESTUDO_VICINAIS_V2\resultados\intermediarios')
 RELATORIO_DIR = Path(r'D:\ESTUDO_VICINAIS_V2\resultados\relatorios')
 
-# Bounds aproximados do Estado de São Paulo
-# minx, miny, maxx, maxy
-SP_BOUNDS = (-53.1, -25.3, -44.1, -19.8)
-
-
-class HighwayHandler(osmium.SimpleHandler):
-    """Handler para extrair vias (highways) do arquivo PBF"""
-    
-    def __init__(self):
-        super().__init__()
-        self.ways = []
-        self.count = 0
-        self.sp_count = 0
-        
-    def way(self, w):
-        """Processa cada way do arquivo"""
-        self.count += 1
-        
-        if self.count % 500000 == 0:
-            print(f"  Processadas {self.count:,} ways, {self.sp_count:,} em SP...")
-        
-        # Verificar se é uma highway
-        if 'highway' not in w.tags:
-            return
-            
-        # Extrair coordenadas
-        try:
-            coords = [(n.lon, n.lat) for n in w.nodes]
-            
-            # Verificar se pelo menos um ponto está dentro de SP
-            in_sp = False
-            for lon, lat in coords:
-                if (SP_BOUNDS[0] <= lon <= SP_BOUNDS[2] and 
-                    SP_BOUNDS[1] <= lat <= SP_BOUNDS[3]):
-                    in_sp = True
-                    break
-            
-            if not in_sp:
-                return
-                
-            if len(coords) < 2:
-                return
-                
-            self.sp_count += 1
-            
-            # Extrair atributos
-            way_data = {
-                'osm_id': w.id,
-                'name': w.tags.get('name', ''),
-                'highway': w.tags.get('highway', ''),
-                'ref': w.tags.get('ref', ''),
-                'surface': w.tags.get('surface', ''),
-                'lanes': w.tags.get('lanes', ''),
-                'maxspeed': w.tags.get('maxspeed', ''),
-                'oneway': w.tags.get('oneway', ''),
-                'coords': coords
-            }
-            
-            self.ways.append(way_data)
-            
-        except Exception as e:
-            pass  # Ignorar ways com problemas de geometria
+# Base extraída (GPKG + GeoParquet) e estado da atualização incremental (.osc)
+BASE_OSM = INTERMEDIARIO_DIR / 'osm_sp_highways.gpkg'
+BASE_OSM_PARQUET = INTERMEDIARIO_DIR / 'osm_sp_highways.parquet'
+ESTADO_OSM = INTERMEDIARIO_DIR / 'osm_sp_highways_estado.npz'
 
 
 def extrair_highways_pbf():
@@ -96,49 +47,80 @@ def extrair_highways_pbf():
     print(f"\nArquivo PBF: {PBF_FILE}")
     print(f"Bounds SP: {SP_BOUNDS}")
     
+    # Polígono do estado para o recorte exato
+    limite = carregar_limite_sp()
+    
     # Criar handler
     print("\nProcessando arquivo PBF (pode demorar vários minutos)...")
-    handler = HighwayHandler()
+    handler = HighwayHandler(limite, guardar_refs=True)
     
-    # Processar arquivo
-    handler.apply_file(PBF_FILE, locations=True)
+    # Processar arquivo (ways sem highway são descartadas pelo osmium)
+    handler.apply_file(PBF_FILE, locations=True, filters=filtros_highway())
     
-    print(f"\nTotal de ways processadas: {handler.count:,}")
-    print(f"Highways em SP: {handler.sp_count:,}")
+    print(f"\nHighways lidas: {handler.highway_count:,}")
+    print(f"Highways no retângulo SP: {handler.sp_count:,}")
     
-    # Converter para GeoDataFrame
+    # Converter para GeoDataFrame (com recorte pelo limite estadual)
     print("\nConvertendo para GeoDataFrame...")
+    gdf = handler.para_geodataframe()
+    print(f"Fora do limite estadual (descartadas): {handler.fora_limite:,}")
+    
+    print(f"GeoDataFrame criado: {len(gdf):,} features")
+    
+    # Estado para atualizar_osm_incremental.py
+    salvar_estado(handler.estado_incremental(), ESTADO_OSM)
+    print(f"Estado incremental: {ESTADO_OSM}")
+    
+    return gdf
+
+
+def extrair_highways_pbf_streaming():
+    """
+    Extrai highways do PBF em streaming, gravando a base intermediária em lotes
+
+    O índice de nós fica em disco e apenas um lote de ways fica em memória.
+    Retorna o caminho do GeoPackage gravado.
+    """
+    print("="*60)
+    print("EXTRAÇÃO DE HIGHWAYS DO ARQUIVO PBF (STREAMING)")
+    print("="*60)
     
-    geometries = []
-    data = []
+    print(f"\nArquivo PBF: {PBF_FILE}")
+    print(f"Bounds SP: {SP_BOUNDS}")
     
-    for way in handler.ways:
-        try:
-            coords = way.pop('coords')
-            if len(coords) >= 2:
-                geom = LineString(coords)
-                geometries.append(geom)
-                data.append(way)
-        except:
-            continue
+    limite = carregar_limite_sp()
     
-    gdf = gpd.GeoDataFrame(data, geometry=geometries, crs='EPSG:4326')
+    output_file = BASE_OSM
+    print(f"\nProcessando e gravando em lotes: {output_file}")
+    handler = extrair_highways_streaming(PBF_FILE, output_file, comprimento=False,
+                                         dir_indice=INTERMEDIARIO_DIR, limite=limite)
     
-    print(f"GeoDataFrame criado: {len(gdf):,} features")
+    print(f"\nHighways lidas: {handler.highway_count:,}")
+    print(f"Highways no retângulo SP: {handler.sp_count:,}")
+    print(f"Fora do limite estadual (descartadas): {handler.fora_limite:,}")
+    print(f"Gravadas: {handler.n_gravadas:,} em {handler.n_lotes} lotes")
+    print("⚠ O modo streaming não grava o estado incremental (.osc)")
     
-    return gdf
+    return output_file
 
 
 def salvar_base_osm(gdf):
-    """Salva a base OSM extraída"""
-    output_file = INTERMEDIARIO_DIR / 'osm_sp_highways.gpkg'
+    """Salva a base OSM extraída (GPKG e GeoParquet)"""
+    output_file = BASE_OSM
     print(f"\nSalvando: {output_file}")
-    gdf.to_file(output_file, driver='GPKG')
+    gravar_malha(gdf, output_file, driver='GPKG')
+    print(f"Salvando: {BASE_OSM_PARQUET}")
+    gravar_malha(gdf, BASE_OSM_PARQUET)
     return output_file
 
 
-def subtrair_der(osm_gdf):
-    """Subtrai a malha do DER da base OSM"""
+def subtrair_der(osm_gdf, workers=1):
+    """
+    Subtrai a malha do DER da base OSM
+
+    workers > 1 ativa o modo particionado (tiles de 50 km em um
+    ProcessPoolExecutor); workers=None usa todos os núcleos.
+    """
     print("\n" + "="*60)
     print("SUBTRAÇÃO DA MALHA DER")
     print("="*60)
@@ -155,38 +137,20 @@ def subtrair_der(osm_gdf):
     osm_utm = osm_gdf.to_crs(epsg=31983)
     der_utm = der.to_crs(epsg=31983)
     
-    # Filtrar estaduais e federais
-    der_ef = der_utm[der_utm['Jurisdicao'].isin(['Estadual', 'Federal'])]
-    print(f"  DER estadual/federal: {len(der_ef):,}")
-    
-    # Buffer
-    print(f"\nCriando buffer de {BUFFER_SUBTRACAO}m...")
-    der_buffer = unary_union(der_ef.geometry.buffer(BUFFER_SUBTRACAO))
+    # Buffer (cache em disco indexado pelo hash do shapefile)
+    print(f"\nObtendo buffer de {BUFFER_SUBTRACAO}m...")
+    _, buffers = carregar_buffer_der(der_utm, MALHA_DER, BUFFER_SUBTRACAO, jurisdicoes=JURISDICOES_SRE)
+    arvore = STRtree(buffers)
     
     # Calcular sobreposição
     print("Calculando sobreposições...")
     osm_utm = osm_utm.reset_index(drop=True)
-    
-    prop_sobreposta = []
-    total = len(osm_utm)
-    
-    for idx, row in osm_utm.iterrows():
-        if idx % 100000 == 0:
-            print(f"  {idx:,}/{total:,} ({100*idx/total:.1f}%)...")
-        
-        try:
-            if row.geometry.intersects(der_buffer):
-                intersecao = row.geometry.intersection(der_buffer)
-                if not intersecao.is_empty and row.geometry.length > 0:
-                    prop = intersecao.length / row.geometry.length
-                else:
-                    prop = 0
-            else:
-                prop = 0
-        except:
-            prop = 0
-        
-        prop_sobreposta.append(prop)
+    if workers == 1:
+        prop_sobreposta = calcular_proporcao_sobreposta(osm_utm.geometry, buffers, arvore)
+    else:
+        prop_sobreposta = calcular_proporcao_sobreposta_paralela(
+            osm_utm.geometry, buffers, arvore, workers=workers
+        )
     
     osm_utm['prop_sobreposta'] = prop_sobreposta
     
@@ -204,17 +168,35 @@ def subtrair_der(osm_gdf):
     return osm_filtrado, removidos
 
 
-def main():
+def main(workers=1, streaming=False):
     print("="*60)
     print("EXTRAÇÃO OSM PBF E SUBTRAÇÃO DER")
     print("="*60)
     print(f"Início: {datetime.now().strftime('%Y-%m-%d %H:%M:%S')}")
     
-    # 1. Extrair highways do PBF
-    osm_gdf = extrair_highways_pbf()
-    
-    # 2. Salvar base intermediária
-    osm_file = salvar_base_osm(osm_gdf)
+    if streaming:
+        # 1-2. Extrair em lotes direto para a base intermediária
+        osm_file = extrair_highways_pbf_streaming()
+        osm_gdf = ler_malha(osm_file)
+    else:
+        # Cache indexado pelo conteúdo do PBF e pelos parâmetros da extração
+        print("\nCalculando chave do cache da extração...")
+        chave = chave_extracao(PBF_FILE)
+        
+        if restaurar_cache_extracao(chave, BASE_OSM_PARQUET, ESTADO_OSM):
+            # 1-2. PBF já extraído com os mesmos parâmetros
+            print(f"  Extração encontrada no cache, usando: {BASE_OSM_PARQUET}")
+            if not ESTADO_OSM.exists():
+                print("  ⚠ Entrada sem estado incremental: rode sem cache para usar atualizar_osm_incremental.py")
+            osm_gdf = ler_malha(BASE_OSM_PARQUET)
+        else:
+            # 1. Extrair highways do PBF
+            osm_gdf = extrair_highways_pbf()
+            
+            # 2. Salvar base intermediária e registrar no cache
+            salvar_base_osm(osm_gdf)
+            arquivo_cache = salvar_cache_extracao(BASE_OSM_PARQUET, ESTADO_OSM, chave)
+            print(f"Cache da extração: {arquivo_cache}")
     
     # 3. Estatísticas
     print("\n" + "="*60)
@@ -224,12 +206,12 @@ def main():
     print(osm_gdf['highway'].value_counts().head(15).to_string())
     
     # 4. Subtrair DER
-    osm_menos_der, removidos = subtrair_der(osm_gdf)
+    osm_menos_der, removidos = subtrair_der(osm_gdf, workers=workers)
     
     # 5. Salvar resultado final
     output_file = OUTPUT_DIR / 'osm_sp_menos_der.gpkg'
     print(f"\nSalvando resultado final: {output_file}")
-    osm_menos_der.to_file(output_file, driver='GPKG')
+    osm_menos_der = gravar_malha(osm_menos_der, output_file, driver='GPKG')
     
     # Relatório
     relatorio_file = RELATORIO_DIR / 'relatorio_extracao_pbf.txt'
@@ -262,4 +244,11 @@ def main():
 
 
 if __name__ == "__main__":
-    resultado = main()
+    parser = argparse.ArgumentParser(description="Extração OSM PBF e subtração DER")
+    parser.add_argument('--workers', type=int, default=1,
+                        help="Processos para a subtração DER (0 = todos os núcleos)")
+    parser.add_argument('--streaming', action='store_true',
+                        help="Extrair o PBF em lotes com índice de nós em disco (memória constante)")
+    args = parser.parse_args()
+    
+    resultado = main(workers=args.workers or None, streaming=args.streaming)
@@ -4,12 +4,22 @@ Remove vias que estão DENTRO de áreas urbanas do IBGE
 
 Este é um refinamento adicional que pode ser aplicado
 após o processamento principal.
+
+Modos:
+- fracao (padrão): os polígonos AU individuais são indexados em uma STRtree
+  (sem dissolve) e cada via recebe a fração do seu comprimento dentro de
+  áreas urbanas; saem as vias com fração acima de FRACAO_MAXIMA_AU
+- within: comportamento original (dissolve + sjoin within, tudo ou nada)
 """
 
+import argparse
 import geopandas as gpd
+import numpy as np
 import pandas as pd
 from pathlib import Path
 from datetime import datetime
+from esquema_malha import aplicar_esquema, ler_malha, gravar_malha
+from sobreposicao_der import preparar_poligonos, calcular_proporcao_em_poligonos
 
 # Configurações
 INPUT_FILE = r'D:\ESTUDO_VICINAIS_V2\resultados\intermediarios\malha_municipal_sp_sem_filtro_au.gpkg'
@@ -17,14 +27,40 @@ AU_IBGE_FILE = r'D:\ESTUDO_VICINAIS_V2\dados\au_ibge.gpkg'
 OUTPUT_FILE = r'D:\ESTUDO_VICINAIS_V2\resultados\dados_processados\malha_municipal_sp.gpkg'
 RELATORIO_DIR = r'D:\ESTUDO_VICINAIS_V2\resultados\relatorios'
 
-def main():
+# Vias com fração do comprimento em AU acima deste valor são removidas (modo fracao)
+FRACAO_MAXIMA_AU = 0.5
+
+
+def fracao_em_area_urbana(gdf, au):
+    """
+    Fração (0-1) do comprimento de cada via dentro de áreas urbanas
+
+    Calculada em UTM 23S (EPSG:31983), sobre os polígonos AU individuais
+    (preparados e subdivididos), sem dissolve.
+    """
+    linhas = np.asarray(gdf.geometry.to_crs(epsg=31983), dtype=object)
+    partes, arvore = preparar_poligonos(au.geometry.to_crs(epsg=31983))
+    print(f"Partes AU indexadas: {len(partes):,}")
+    return calcular_proporcao_em_poligonos(linhas, partes, arvore)
+
+
+def dentro_area_urbana_dissolve(gdf, au):
+    """Vias completamente dentro da AU dissolvida (modo within)"""
+    print("Dissolvendo áreas urbanas (pode demorar)...")
+    au_dissolved = au.dissolve()
+    print("Dissolução concluída!")
+    vias_em_au = gpd.sjoin(gdf, au_dissolved, predicate='within', how='inner')
+    return gdf.index.isin(vias_em_au.index)
+
+
+def main(modo='fracao', fracao_maxima=FRACAO_MAXIMA_AU):
     print("="*60)
     print("FILTRO ESPACIAL POR ÁREA URBANA IBGE")
     print("="*60)
     
     # Carregar malha municipal já processada
     print(f"\nCarregando malha municipal: {INPUT_FILE}")
-    gdf = gpd.read_file(INPUT_FILE)
+    gdf = ler_malha(INPUT_FILE)
     print(f"Total de registros: {len(gdf):,}")
     print(f"Extensão: {gdf['comprimento_m'].sum()/1000:,.1f} km")
     
@@ -41,41 +77,44 @@ def main():
         print("Reprojetando AU para o mesmo CRS...")
         au = au.to_crs(gdf.crs)
     
-    # Dissolver áreas urbanas - filtrar apenas SP
+    # Filtrar AU que intersectam a área de SP
     print("\nFiltrando AU apenas para SP (bounds da malha)...")
     bounds = gdf.total_bounds  # [minx, miny, maxx, maxy]
-    
-    # Filtrar AU que intersectam a área de SP
     au_sp = au.cx[bounds[0]:bounds[2], bounds[1]:bounds[3]]
     print(f"AU dentro dos bounds de SP: {len(au_sp):,}")
     
-    # Dissolver
-    print("Dissolvendo áreas urbanas (pode demorar)...")
-    au_dissolved = au_sp.dissolve()
-    print("Dissolução concluída!")
-    
-    # Identificar vias DENTRO de áreas urbanas
-    print("\nIdentificando vias dentro de AU (sjoin)...")
-    
     # Reset index para garantir unicidade
     gdf = gdf.reset_index(drop=True)
     
-    # Spatial join - vias que estão DENTRO de AU
-    vias_em_au = gpd.sjoin(gdf, au_dissolved, predicate='within', how='inner')
-    indices_em_au = set(vias_em_au.index)
-    
-    print(f"Vias completamente dentro de AU: {len(indices_em_au):,}")
+    inicio = datetime.now()
+    if modo == 'fracao':
+        print(f"\nCalculando fração de cada via dentro de AU (STRtree, sem dissolve)...")
+        gdf['fracao_au'] = fracao_em_area_urbana(gdf, au_sp)
+        em_au = gdf['fracao_au'].to_numpy() > fracao_maxima
+        criterio = f"fração em AU > {fracao_maxima:.0%}"
+        print(f"Vias com alguma extensão em AU: {(gdf['fracao_au'] > 0).sum():,}")
+        print(f"Vias completamente dentro de AU: {(gdf['fracao_au'] >= 1).sum():,}")
+    else:
+        print("\nIdentificando vias dentro de AU (sjoin)...")
+        em_au = dentro_area_urbana_dissolve(gdf, au_sp)
+        criterio = "completamente dentro de AU"
+    tempo = (datetime.now() - inicio).total_seconds()
+    
+    print(f"Vias removidas ({criterio}): {em_au.sum():,} em {tempo:.1f}s")
     
     # Filtrar vias FORA de AU
-    gdf_fora_au = gdf[~gdf.index.isin(indices_em_au)].copy()
+    gdf_fora_au = aplicar_esquema(gdf[~em_au].copy())
     
     print(f"\n{'='*60}")
     print("RESULTADO DO FILTRO ESPACIAL")
     print(f"{'='*60}")
     print(f"Vias antes do filtro AU: {len(gdf):,}")
-    print(f"Vias removidas (dentro AU): {len(indices_em_au):,}")
+    print(f"Vias removidas ({criterio}): {em_au.sum():,}")
     print(f"Vias restantes (fora AU): {len(gdf_fora_au):,}")
     print(f"Extensão final: {gdf_fora_au['comprimento_m'].sum()/1000:,.1f} km")
+    if modo == 'fracao':
+        extensao_au = (gdf['comprimento_m'] * gdf['fracao_au']).sum() / 1000
+        print(f"Extensão em AU (todas as vias, proporcional): {extensao_au:,.1f} km")
     
     # Distribuição por highway
     print(f"\nDistribuição por highway:")
@@ -83,7 +122,7 @@ def main():
     
     # Salvar resultado final
     print(f"\nSalvando resultado em: {OUTPUT_FILE}")
-    gdf_fora_au.to_file(OUTPUT_FILE, driver='GPKG')
+    gravar_malha(gdf_fora_au, OUTPUT_FILE, driver='GPKG')
     
     # Gerar relatório do filtro AU
     relatorio_file = Path(RELATORIO_DIR) / 'relatorio_filtro_au.txt'
@@ -91,9 +130,10 @@ def main():
         f.write("RELATÓRIO DE FILTRO POR ÁREA URBANA IBGE\n")
         f.write("="*60 + "\n\n")
         f.write(f"Data: {datetime.now().strftime('%Y-%m-%d %H:%M:%S')}\n\n")
+        f.write(f"Modo: {modo} ({criterio}; {tempo:.1f}s)\n")
         f.write(f"Vias antes do filtro AU: {len(gdf):,}\n")
         f.write(f"Polígonos AU (SP): {len(au_sp):,}\n")
-        f.write(f"Vias removidas (dentro AU): {len(indices_em_au):,}\n")
+        f.write(f"Vias removidas ({criterio}): {em_au.sum():,}\n")
         f.write(f"Vias restantes (fora AU): {len(gdf_fora_au):,}\n")
         f.write(f"\nExtensão final: {gdf_fora_au['comprimento_m'].sum()/1000:,.1f} km\n")
         f.write(f"\nDistribuição por highway:\n")
@@ -106,4 +146,11 @@ def main():
     return gdf_fora_au
 
 if __name__ == "__main__":
-    resultado = main()
+    parser = argparse.ArgumentParser(description="Filtro espacial por área urbana IBGE")
+    parser.add_argument('--modo', choices=['fracao', 'within'], default='fracao',
+                        help="fracao: fração do comprimento em AU (padrão); within: dissolve + within")
+    parser.add_argument('--fracao-maxima', type=float, default=FRACAO_MAXIMA_AU,
+                        help=f"Fração máxima em AU para manter a via (padrão: {FRACAO_MAXIMA_AU})")
+    args = parser.parse_args()
+
+    resultado = main(modo=args.modo, fracao_maxima=args.fracao_maxima)
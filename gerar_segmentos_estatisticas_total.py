@@ -3,10 +3,10 @@ Script para gerar estatísticas de segmentos da malha total (OSM + DER)
 Similar ao segmentos_estatisticas.json mas para a malha total
 """
 import json
-import geopandas as gpd
 import pandas as pd
 import numpy as np
 from pathlib import Path
+from esquema_malha import ler_malha
 
 def calcular_distribuicao_faixas(gdf):
     """Calcula distribuição de segmentos por faixas de comprimento"""
@@ -90,7 +90,7 @@ def main():
     
     # Carregar malha total
     print("1️⃣ Carregando malha total...")
-    malha_total = gpd.read_file(base_path / 'malha_total_estadual.geojson')
+    malha_total = ler_malha(base_path / 'malha_total_estadual.geojson')
     print(f"   ✓ {len(malha_total):,} segmentos carregados")
     
     # Calcular estatísticas
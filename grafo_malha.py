@@ -0,0 +1,789 @@
+"""
+Topologia da malha viária: grafo de extremidades e componentes conexos
+
+Cada segmento (LineString ou MultiLineString) vira uma ou mais arestas
+ligando as suas extremidades. As extremidades são extraídas de forma
+vetorizada (shapely.get_coordinates), agrupadas dentro de uma tolerância
+com uma cKDTree e deduplicadas em nós. Os componentes conexos saem de
+scipy.sparse.csgraph.
+
+Para a rede roteável (nodar=True) as partes lineares são antes divididas
+nas junções interiores: vértices compartilhados com outra linha (os nós
+comuns das vias do OSM) e pontos onde a extremidade de uma linha encosta no
+meio de outra (ex.: vicinal que termina sobre uma rodovia do DER). Linhas
+que só se cruzam, sem vértice comum, não são ligadas (viadutos).
+
+A rede viária completa (vicinal + DER) pode ser gravada uma vez em .npz
+(nós, arestas com atributos e adjacência CSR) e relida mapeada em memória
+pelas etapas de conectividade, acessibilidade e controle de qualidade.
+
+Autor: Análise automatizada
+Data: Janeiro/2026
+"""
+
+import struct
+import zipfile
+
+import numpy as np
+import pandas as pd
+import shapely
+from shapely import STRtree
+from scipy.sparse import coo_matrix, csr_matrix
+from scipy.sparse.csgraph import connected_components, dijkstra
+from scipy.spatial import cKDTree
+
+# Distância máxima (metros) para unir extremidades em um mesmo nó
+TOLERANCIA_SNAP_M = 1.0
+
+# Origem dos segmentos da rede (códigos gravados em 'segmento_origem')
+ORIGEM_VICINAL, ORIGEM_DER = 0, 1
+ORIGENS = ['Vicinal', 'DER']
+
+
+def renumerar_por_ordem(rotulos):
+    """Renumera rótulos 0..k-1 na ordem da primeira ocorrência (ids determinísticos)"""
+    if len(rotulos) == 0:
+        return np.zeros(0, dtype=np.int64)
+    _, primeira, inverso = np.unique(rotulos, return_index=True, return_inverse=True)
+    novo = np.empty(len(primeira), dtype=np.int64)
+    novo[np.argsort(primeira, kind='stable')] = np.arange(len(primeira))
+    return novo[inverso.ravel()]
+
+
+def agrupar_pontos(xy, tolerancia):
+    """
+    Agrupa pontos a até `tolerancia` uns dos outros (fecho transitivo)
+
+    Pontos idênticos são deduplicados antes; os pares próximos vêm de uma
+    consulta de raio da cKDTree e os grupos de connected_components (o
+    mesmo que union-find). Retorna o rótulo do grupo de cada ponto, com ids
+    na ordem da primeira ocorrência.
+    """
+    xy = np.asarray(xy, dtype=np.float64).reshape(-1, 2)
+    if len(xy) == 0:
+        return np.zeros(0, dtype=np.int64)
+
+    # Deduplicação exata (lexsort é bem mais rápido que np.unique(axis=0))
+    ordem = np.lexsort((xy[:, 1], xy[:, 0]))
+    ordenados = xy[ordem]
+    novo = np.ones(len(xy), dtype=bool)
+    novo[1:] = np.any(ordenados[1:] != ordenados[:-1], axis=1)
+    unicos = ordenados[novo]
+    inverso = np.empty(len(xy), dtype=np.int64)
+    inverso[ordem] = np.cumsum(novo) - 1
+    n = len(unicos)
+
+    if tolerancia > 0 and n > 1:
+        pares = cKDTree(unicos).query_pairs(tolerancia, output_type='ndarray')
+        grafo = coo_matrix((np.ones(len(pares), dtype=np.int8), (pares[:, 0], pares[:, 1])), shape=(n, n))
+        _, rotulo_unico = connected_components(grafo, directed=False)
+    else:
+        rotulo_unico = np.arange(n)
+
+    return renumerar_por_ordem(rotulo_unico[inverso])
+
+
+def _partes_lineares(geoms):
+    """Partes lineares dos segmentos com o segmento de origem e as extremidades"""
+    partes, segmento = shapely.get_parts(np.asarray(geoms, dtype=object), return_index=True)
+    coords, idx = shapely.get_coordinates(partes, return_index=True)
+
+    n_vertices = np.bincount(idx, minlength=len(partes))
+    validas = n_vertices > 0
+    fim = np.cumsum(n_vertices) - 1
+    inicio = fim - n_vertices + 1
+
+    return partes[validas], segmento[validas], coords[inicio[validas]], coords[fim[validas]]
+
+
+def extrair_extremidades(geoms):
+    """
+    Extremidades de cada parte linear dos segmentos
+
+    Retorna (inicio, fim, segmento): coordenadas (n_partes, 2) do primeiro e
+    do último vértice de cada parte e o índice posicional do segmento de
+    origem. Geometrias vazias ou nulas não geram partes.
+    """
+    _, segmento, inicio, fim = _partes_lineares(geoms)
+    return inicio, fim, segmento
+
+
+def _nodar(partes, tolerancia_juncao):
+    """
+    Divide as partes lineares nas junções interiores
+
+    Pontos de divisão:
+    - vértices interiores com a mesma coordenada de algum outro vértice
+      (nó compartilhado entre vias)
+    - projeção de uma extremidade solta (sem vértice coincidente) sobre o
+      interior da linha mais próxima a até `tolerancia_juncao`; a
+      extremidade é levada até o ponto projetado (ou até a ponta da linha,
+      se a projeção cair a até `tolerancia_juncao` dela)
+
+    Retorna (pecas, parte_da_peca): LineStrings entre junções consecutivas e
+    o índice da parte de origem de cada uma.
+    """
+    coords, parte = shapely.get_coordinates(partes, return_index=True)
+    n = len(coords)
+    n_vertices = np.bincount(parte, minlength=len(partes))
+    fim = np.cumsum(n_vertices) - 1
+    inicio = fim - n_vertices + 1
+    extremo = np.zeros(n, dtype=bool)
+    extremo[inicio] = True
+    extremo[fim] = True
+
+    # Vértices com coordenada repetida (lexsort, como em agrupar_pontos)
+    ordem = np.lexsort((coords[:, 1], coords[:, 0]))
+    ordenados = coords[ordem]
+    novo = np.ones(n, dtype=bool)
+    novo[1:] = np.any(ordenados[1:] != ordenados[:-1], axis=1)
+    grupo = np.cumsum(novo) - 1
+    compartilhado = np.empty(n, dtype=bool)
+    compartilhado[ordem] = np.bincount(grupo)[grupo] > 1
+    corte = compartilhado & ~extremo
+
+    # Posição de cada vértice ao longo da sua parte (mesma medida de line_locate_point)
+    passo = np.zeros(n)
+    passo[1:] = np.hypot(*np.diff(coords, axis=0).T)
+    passo[inicio] = 0
+    posicao = np.cumsum(passo)
+    posicao -= posicao[inicio][parte]
+
+    # Extremidades soltas encostadas em outra linha: a linha mais próxima
+    soltas = np.flatnonzero(extremo & ~compartilhado)
+    pontos = shapely.points(coords[soltas])
+    idx_ponta, idx_linha = STRtree(partes).query(pontos, predicate='dwithin', distance=tolerancia_juncao)
+    outra = parte[soltas[idx_ponta]] != idx_linha
+    idx_ponta, idx_linha = idx_ponta[outra], idx_linha[outra]
+    distancia = shapely.distance(pontos[idx_ponta], partes[idx_linha])
+    ordem = np.lexsort((distancia, idx_ponta))
+    primeira = np.ones(len(ordem), dtype=bool)
+    primeira[1:] = idx_ponta[ordem][1:] != idx_ponta[ordem][:-1]
+    idx_ponta, idx_linha = idx_ponta[ordem][primeira], idx_linha[ordem][primeira]
+
+    vertice = soltas[idx_ponta]
+    linhas = partes[idx_linha]
+    medida = shapely.line_locate_point(linhas, pontos[idx_ponta])
+    comprimento = shapely.length(linhas)
+    interior = (medida > tolerancia_juncao) & (medida < comprimento - tolerancia_juncao)
+    alvo = shapely.get_coordinates(shapely.line_interpolate_point(linhas[interior], medida[interior]))
+    coords = coords.copy()
+    coords[vertice[interior]] = alvo
+
+    # Perto da ponta da outra linha: vai para a posição final dessa ponta
+    # (que também pode se mover); em pares mútuos fica a de menor índice
+    destino = np.arange(n)
+    ponta_linha = np.where(medida > comprimento / 2, fim[idx_linha], inicio[idx_linha])
+    destino[vertice[~interior]] = ponta_linha[~interior]
+    mutuo = (destino[destino] == np.arange(n)) & (destino > np.arange(n))
+    destino[mutuo] = np.flatnonzero(mutuo)
+    for _ in range(32):
+        proximo = destino[destino]
+        if np.array_equal(proximo, destino):
+            break
+        destino = proximo
+    coords = coords[destino]
+
+    # Pontos inseridos, ordenados junto com os vértices de cada parte
+    n_inseridos = interior.sum()
+    parte_todos = np.concatenate([parte, idx_linha[interior]])
+    posicao_todos = np.concatenate([posicao, medida[interior]])
+    ordem = np.lexsort((np.arange(n + n_inseridos), posicao_todos, parte_todos))
+    xy = np.vstack([coords, alvo])[ordem]
+    parte_todos = parte_todos[ordem]
+    corte = np.concatenate([corte, np.ones(n_inseridos, dtype=bool)])[ordem]
+
+    # Cada ponto de corte é fim de uma peça e início da seguinte
+    repeticao = 1 + corte
+    xy = np.repeat(xy, repeticao, axis=0)
+    parte_rep = np.repeat(parte_todos, repeticao)
+    nova_peca = np.ones(len(xy), dtype=bool)
+    nova_peca[1:] = parte_rep[1:] != parte_rep[:-1]
+    nova_peca[(np.cumsum(repeticao) - 1)[corte]] = True
+    peca = np.cumsum(nova_peca) - 1
+    pecas = shapely.linestrings(xy, indices=peca)
+    parte_da_peca = parte_rep[nova_peca]
+
+    # Peças de comprimento zero entre pontos de corte coincidentes
+    dividida = np.bincount(parte_da_peca, minlength=len(partes)) > 1
+    manter = (shapely.length(pecas) > 0) | ~dividida[parte_da_peca]
+    return pecas[manter], parte_da_peca[manter]
+
+
+def construir_grafo(geoms, tolerancia=TOLERANCIA_SNAP_M, nodar=False, tolerancia_juncao=None):
+    """
+    Grafo de extremidades da malha
+
+    Retorna (origem, destino, segmento, nos_xy, comprimento): para cada parte
+    linear, os nós das suas extremidades, o segmento de origem e o
+    comprimento; nos_xy traz a coordenada representativa (primeira
+    ocorrência) de cada nó. Com nodar=True as partes são antes divididas nas
+    junções interiores (ver _nodar; `tolerancia_juncao` padrão =
+    `tolerancia`) e cada peça vira uma aresta.
+    """
+    partes, segmento, inicio, fim = _partes_lineares(geoms)
+    if nodar and len(partes):
+        pecas, parte_da_peca = _nodar(partes, tolerancia if tolerancia_juncao is None else tolerancia_juncao)
+        partes, peca, inicio, fim = _partes_lineares(pecas)
+        segmento = segmento[parte_da_peca[peca]]
+    n_partes = len(segmento)
+
+    pontos = np.vstack([inicio, fim])
+    no = agrupar_pontos(pontos, tolerancia)
+
+    nos_xy = np.zeros((no.max() + 1 if len(no) else 0, 2))
+    nos_xy[no[::-1]] = pontos[::-1]
+
+    return no[:n_partes], no[n_partes:], segmento, nos_xy, shapely.length(partes)
+
+
+def componentes_segmentos(geoms, tolerancia=TOLERANCIA_SNAP_M):
+    """
+    Componente conexo de cada segmento, direto das geometrias
+
+    Retorna (componente, tamanho_componente, n_nos): id do componente por
+    segmento (ordem da primeira ocorrência), número de segmentos do
+    componente e número de nós do grafo. Ver componentes_rede.
+    """
+    rede = construir_rede(geoms, tolerancia)
+    componente = componentes_rede(rede)
+    tamanho = np.bincount(componente)[componente] if len(componente) else np.zeros(0, dtype=np.int64)
+    return componente, tamanho, len(rede['nos_xy'])
+
+
+def componentes_com(componente, mascara):
+    """Por segmento: o seu componente contém algum segmento marcado em `mascara`"""
+    if len(componente) == 0:
+        return np.zeros(0, dtype=bool)
+    marcado = np.bincount(componente, weights=np.asarray(mascara, dtype=np.float64)) > 0
+    return marcado[componente]
+
+
+# ---------------------------------------------------------------------------
+# Rede viária persistida (CSR em .npz)
+# ---------------------------------------------------------------------------
+
+def _adjacencia_csr(origem_no, destino_no, n_nos):
+    """Adjacência não dirigida em CSR: (indptr, vizinho, aresta) por nó"""
+    n_arestas = len(origem_no)
+    de = np.concatenate([origem_no, destino_no])
+    para = np.concatenate([destino_no, origem_no])
+    aresta = np.concatenate([np.arange(n_arestas), np.arange(n_arestas)])
+
+    ordem = np.lexsort((para, de))
+    indptr = np.zeros(n_nos + 1, dtype=np.int64)
+    np.cumsum(np.bincount(de, minlength=n_nos), out=indptr[1:])
+    return indptr, para[ordem].astype(np.int32), aresta[ordem].astype(np.int32)
+
+
+def construir_rede(geoms, tolerancia=TOLERANCIA_SNAP_M, origem=None, classe=None,
+                   segmento_id=None, crs=None, nodar=False, tolerancia_juncao=None):
+    """
+    Monta a rede viária em arrays compactos
+
+    Cada parte linear vira uma aresta entre os nós das suas extremidades
+    (grafo de extremidades); com nodar=True, cada peça entre junções
+    interiores (rede roteável, ver construir_grafo).
+    Atributos por aresta: comprimento, segmento, origem (código em ORIGENS)
+    e classe (código em 'classes', ex.: highway). Os segmentos guardam o id
+    de origem (`segmento_id`, ex.: posição na camada de entrada) para
+    mapear resultados de volta às geometrias. A adjacência fica em CSR
+    (indptr / indices / csr_aresta) e 'no_sre' marca os nós ligados ao SRE
+    (ver marcar_nos_sre).
+    """
+    n_seg = len(geoms)
+    origem_no, destino_no, segmento, nos_xy, comprimento = construir_grafo(geoms, tolerancia, nodar,
+                                                                          tolerancia_juncao)
+    n_nos = len(nos_xy)
+
+    segmento_origem = np.zeros(n_seg, dtype=np.int8) if origem is None else np.asarray(origem, dtype=np.int8)
+    if classe is None:
+        segmento_classe, classes = np.zeros(n_seg, dtype=np.int16), np.array([''])
+    else:
+        codigos, classes = pd.factorize(pd.Series(classe).astype(object).fillna('').astype(str), sort=True)
+        segmento_classe, classes = codigos.astype(np.int16), np.asarray(classes, dtype=str)
+    if segmento_id is None:
+        segmento_id = np.arange(n_seg)
+
+    indptr, indices, csr_aresta = _adjacencia_csr(origem_no, destino_no, n_nos)
+
+    return {
+        'nos_xy': nos_xy,
+        'no_sre': np.zeros(n_nos, dtype=bool),
+        'aresta_origem_no': origem_no.astype(np.int32),
+        'aresta_destino_no': destino_no.astype(np.int32),
+        'aresta_segmento': segmento.astype(np.int32),
+        'aresta_comprimento': comprimento,
+        'aresta_origem': segmento_origem[segmento],
+        'aresta_classe': segmento_classe[segmento],
+        'indptr': indptr,
+        'indices': indices,
+        'csr_aresta': csr_aresta,
+        'segmento_id': np.asarray(segmento_id, dtype=np.int64),
+        'segmento_origem': segmento_origem,
+        'segmento_classe': segmento_classe,
+        'classes': classes,
+        'origens': np.array(ORIGENS),
+        'crs': np.array('' if crs is None else str(crs)),
+    }
+
+
+def marcar_nos_sre(rede, sre_geoms, tolerancia):
+    """Marca em rede['no_sre'] os nós a até `tolerancia` de um segmento do SRE"""
+    pontos = shapely.points(rede['nos_xy'])
+    idx_no, _ = STRtree(np.asarray(sre_geoms, dtype=object)).query(
+        pontos, predicate='dwithin', distance=tolerancia
+    )
+    rede['no_sre'] = np.zeros(len(pontos), dtype=bool)
+    rede['no_sre'][idx_no] = True
+    return rede
+
+
+def salvar_rede(rede, arquivo):
+    """Grava a rede em .npz sem compressão (cada array pode ser mapeado em memória)"""
+    np.savez(arquivo, **rede)
+
+
+def carregar_rede(arquivo, mmap=True):
+    """
+    Lê a rede gravada por salvar_rede
+
+    Com mmap=True os arrays são np.memmap direto sobre os membros (sem
+    compressão) do .npz: nada é copiado para a memória até ser acessado, e
+    vários processos compartilham as mesmas páginas do arquivo.
+    """
+    if not mmap:
+        with np.load(arquivo) as dados:
+            return {chave: dados[chave] for chave in dados.files}
+
+    rede = {}
+    with zipfile.ZipFile(arquivo) as zf, open(arquivo, 'rb') as f:
+        for info in zf.infolist():
+            # Cabeçalho local do membro: 30 bytes + nome + campo extra
+            f.seek(info.header_offset)
+            cabecalho = f.read(30)
+            n_nome, n_extra = struct.unpack('<HH', cabecalho[26:30])
+            f.seek(info.header_offset + 30 + n_nome + n_extra)
+
+            versao = np.lib.format.read_magic(f)
+            if versao == (1, 0):
+                shape, fortran, dtype = np.lib.format.read_array_header_1_0(f)
+            else:
+                shape, fortran, dtype = np.lib.format.read_array_header_2_0(f)
+            chave = info.filename[:-len('.npy')]
+            if shape == () or 0 in shape:
+                # Escalares e arrays vazios não podem ser mapeados
+                with zf.open(info.filename) as membro:
+                    rede[chave] = np.lib.format.read_array(membro)
+            else:
+                rede[chave] = np.memmap(arquivo, dtype=dtype, mode='r', offset=f.tell(),
+                                        shape=shape, order='F' if fortran else 'C')
+    return rede
+
+
+def hashes_divergentes(rede, hashes):
+    """Chaves de `hashes` (ex.: hash_municipal) ausentes na rede ou com valor diferente do gravado"""
+    return [chave for chave, valor in hashes.items() if chave not in rede or str(rede[chave]) != valor]
+
+
+def matriz_rede(rede, mascara_arestas=None, comprimento_minimo=1e-6):
+    """
+    Matriz esparsa (csr_matrix) de pesos = comprimento das arestas em metros
+
+    Usa indptr/indices da rede sem copiar quando não há máscara. Arestas de
+    comprimento zero recebem `comprimento_minimo` (zeros explícitos não são
+    arestas para o scipy.sparse.csgraph).
+    """
+    n_nos = len(rede['nos_xy'])
+    indptr, indices, csr_aresta = rede['indptr'], rede['indices'], rede['csr_aresta']
+    if mascara_arestas is not None:
+        manter = np.asarray(mascara_arestas)[csr_aresta]
+        linha = np.repeat(np.arange(n_nos), np.diff(indptr))[manter]
+        indptr = np.zeros(n_nos + 1, dtype=np.int64)
+        np.cumsum(np.bincount(linha, minlength=n_nos), out=indptr[1:])
+        indices, csr_aresta = indices[manter], csr_aresta[manter]
+    pesos = np.maximum(rede['aresta_comprimento'][csr_aresta], comprimento_minimo)
+    return csr_matrix((pesos, indices, indptr), shape=(n_nos, n_nos))
+
+
+def componentes_rede(rede, mascara_segmentos=None):
+    """
+    Componente conexo de cada segmento da rede
+
+    Monta um grafo bipartido nós x segmentos (cada aresta liga o segmento às
+    suas duas extremidades), de modo que as partes de um MultiLineString
+    ficam no mesmo componente e segmentos sem geometria ficam isolados.
+    Só os segmentos em `mascara_segmentos` entram; os demais recebem -1.
+    Ids dos componentes na ordem da primeira ocorrência.
+    """
+    n_nos = len(rede['nos_xy'])
+    n_seg = len(rede['segmento_id'])
+    segmento = np.asarray(rede['aresta_segmento'])
+    ativos = np.ones(n_seg, dtype=bool) if mascara_segmentos is None else np.asarray(mascara_segmentos, dtype=bool)
+    ativa = ativos[segmento]
+
+    linhas = np.concatenate([rede['aresta_origem_no'][ativa], rede['aresta_destino_no'][ativa]])
+    colunas = n_nos + np.concatenate([segmento[ativa], segmento[ativa]])
+    n = n_nos + n_seg
+    grafo = coo_matrix((np.ones(len(linhas), dtype=np.int8), (linhas, colunas)), shape=(n, n))
+    _, rotulo = connected_components(grafo, directed=False)
+
+    componente = np.full(n_seg, -1, dtype=np.int64)
+    componente[ativos] = renumerar_por_ordem(rotulo[n_nos:][ativos])
+    return componente
+
+
+def distancia_multiorigem(rede, origens, mascara_arestas=None, limite=np.inf):
+    """
+    Distância de rede (metros) de cada nó até o nó de origem mais próximo
+
+    Um único Dijkstra multi-origem (scipy.sparse.csgraph, min_only=True):
+    O(E log V) independentemente do número de origens. Nós inalcançáveis
+    (ou além de `limite`) ficam com inf.
+    """
+    origens = np.asarray(origens, dtype=np.int64)
+    if len(origens) == 0:
+        return np.full(len(rede['nos_xy']), np.inf)
+    matriz = matriz_rede(rede, mascara_arestas)
+    return dijkstra(matriz, directed=True, indices=origens, min_only=True, limit=limite)
+
+
+def distancia_segmentos(rede, dist_nos):
+    """Por segmento: menor distância entre as extremidades das suas arestas (inf sem arestas)"""
+    distancia = np.full(len(rede['segmento_id']), np.inf)
+    por_aresta = np.minimum(dist_nos[rede['aresta_origem_no']], dist_nos[rede['aresta_destino_no']])
+    np.minimum.at(distancia, rede['aresta_segmento'], por_aresta)
+    return distancia
+
+
+def arestas_dos_nos(rede, nos):
+    """Arestas incidentes a um conjunto de nós (sem repetição), pela adjacência CSR"""
+    nos = np.asarray(nos, dtype=np.int64)
+    indptr = rede['indptr']
+    inicio, fim = indptr[nos], indptr[nos + 1]
+    contagem = fim - inicio
+    if contagem.sum() == 0:
+        return np.zeros(0, dtype=np.int64)
+    deslocamento = np.repeat(inicio - np.cumsum(contagem) + contagem, contagem)
+    posicoes = np.arange(contagem.sum()) + deslocamento
+    return np.unique(rede['csr_aresta'][posicoes])
+
+
+def extensao_alcancada(rede, dist_nos, raios, mascara_arestas=None):
+    """
+    Extensão de rede (metros) alcançável a até cada raio (metros)
+
+    Um ponto de uma aresta (u, v) de comprimento L é alcançado se estiver a
+    até r de u ou de v pela rede, então a extensão coberta da aresta é
+    min(L, max(0, r - d_u) + max(0, r - d_v)). Só as arestas incidentes aos
+    nós alcançados são visitadas.
+    """
+    alcancados = np.flatnonzero(np.isfinite(dist_nos))
+    arestas = arestas_dos_nos(rede, alcancados)
+    if mascara_arestas is not None:
+        arestas = arestas[np.asarray(mascara_arestas)[arestas]]
+    du = dist_nos[rede['aresta_origem_no'][arestas]]
+    dv = dist_nos[rede['aresta_destino_no'][arestas]]
+    comprimento = rede['aresta_comprimento'][arestas]
+    return np.array([
+        np.minimum(comprimento, np.maximum(0, r - du) + np.maximum(0, r - dv)).sum()
+        for r in raios
+    ])
+
+
+def pontes_rede(rede, mascara_arestas=None):
+    """
+    Pontes da rede (arestas cuja remoção desconecta o grafo) e a extensão
+    que cada uma isola do SRE
+
+    Tarjan iterativo (sem recursão) sobre a adjacência CSR, O(V + E). Usa o
+    id da aresta de chegada em vez do nó pai, então arestas paralelas nunca
+    são pontes. A subárvore de cada nó ocupa um intervalo contíguo da ordem
+    de descoberta, então extensão e nós SRE de cada lado da ponte saem de
+    somas acumuladas.
+
+    Retorna (ponte, extensao_isolada): máscaras/valores por aresta; a
+    extensão isolada (metros) é a do lado que perde o acesso ao SRE (0 se os
+    dois lados continuam com SRE ou se o componente não tem SRE).
+    """
+    n_nos = len(rede['nos_xy'])
+    n_arestas = len(rede['aresta_comprimento'])
+    ativa = np.ones(n_arestas, dtype=bool) if mascara_arestas is None else np.asarray(mascara_arestas, dtype=bool)
+
+    indptr = np.asarray(rede['indptr']).tolist()
+    vizinho = np.asarray(rede['indices']).tolist()
+    aresta = np.asarray(rede['csr_aresta']).tolist()
+    ativa_l = ativa.tolist()
+
+    disc = [-1] * n_nos
+    low = [0] * n_nos
+    tamanho = [0] * n_nos
+    aresta_pai = [-1] * n_nos
+    proximo = indptr[:-1]
+    ponte = np.zeros(n_arestas, dtype=bool)
+    raizes = []
+    t = 0
+
+    for raiz in range(n_nos):
+        if disc[raiz] >= 0:
+            continue
+        raizes.append(raiz)
+        disc[raiz] = low[raiz] = t
+        t += 1
+        pilha = [raiz]
+        while pilha:
+            v = pilha[-1]
+            i = proximo[v]
+            if i < indptr[v + 1]:
+                proximo[v] = i + 1
+                e = aresta[i]
+                if e == aresta_pai[v] or not ativa_l[e]:
+                    continue
+                w = vizinho[i]
+                if disc[w] < 0:
+                    disc[w] = low[w] = t
+                    t += 1
+                    aresta_pai[w] = e
+                    pilha.append(w)
+                elif disc[w] < low[v]:
+                    low[v] = disc[w]
+            else:
+                pilha.pop()
+                tamanho[v] = t - disc[v]
+                if pilha:
+                    u = pilha[-1]
+                    if low[v] < low[u]:
+                        low[u] = low[v]
+                    if low[v] > disc[u]:
+                        ponte[aresta_pai[v]] = True
+
+    disc = np.array(disc, dtype=np.int64)
+    tamanho = np.array(tamanho, dtype=np.int64)
+    aresta_pai = np.array(aresta_pai, dtype=np.int64)
+
+    # Comprimento de cada aresta atribuído à extremidade descoberta por último
+    # (o filho nas arestas da árvore, o descendente nas de retorno)
+    origem_no = np.asarray(rede['aresta_origem_no'])
+    destino_no = np.asarray(rede['aresta_destino_no'])
+    comprimento = np.where(ativa, rede['aresta_comprimento'], 0.0)
+    profundo = np.where(disc[origem_no] >= disc[destino_no], origem_no, destino_no)
+    acumulado = np.zeros(n_nos + 1)
+    np.add.at(acumulado, disc[profundo] + 1, comprimento)
+    acumulado = np.cumsum(acumulado)
+    sre = np.zeros(n_nos + 1, dtype=np.int64)
+    sre[disc[np.flatnonzero(rede['no_sre'])] + 1] = 1
+    sre = np.cumsum(sre)
+
+    # Totais do componente de cada nó (árvore da raiz que o descobriu)
+    raizes = np.array(raizes, dtype=np.int64)
+    componente = np.repeat(np.arange(len(raizes)), tamanho[raizes])[disc]
+    inicio_comp, fim_comp = disc[raizes], disc[raizes] + tamanho[raizes]
+    ext_comp = (acumulado[fim_comp] - acumulado[inicio_comp])[componente]
+    sre_comp = (sre[fim_comp] - sre[inicio_comp])[componente]
+
+    extensao_isolada = np.zeros(n_arestas)
+    filho = np.flatnonzero(aresta_pai >= 0)
+    filho = filho[ponte[aresta_pai[filho]]]
+    e = aresta_pai[filho]
+    inicio, fim = disc[filho], disc[filho] + tamanho[filho]
+    ext_abaixo = acumulado[fim] - acumulado[inicio] - comprimento[e]
+    sre_abaixo = sre[fim] - sre[inicio]
+    total_ext, total_sre = ext_comp[filho], sre_comp[filho]
+    extensao_isolada[e] = np.where(
+        (total_sre > 0) & (sre_abaixo == 0), ext_abaixo,
+        np.where((total_sre > 0) & (sre_abaixo == total_sre), total_ext - ext_abaixo - comprimento[e], 0.0)
+    )
+    return ponte, extensao_isolada
+
+
+def _rotular_bipartido(origem_no, destino_no, segmento, n_nos):
+    """
+    Componente de cada nó, com as partes de um mesmo segmento unidas
+
+    Grafo bipartido nós x segmentos (segmentos compactados), como em
+    componentes_rede.
+    """
+    _, seg_local = np.unique(segmento, return_inverse=True)
+    n_seg = seg_local.max() + 1 if len(seg_local) else 0
+    linhas = np.concatenate([origem_no, destino_no])
+    colunas = n_nos + np.concatenate([seg_local, seg_local])
+    n = n_nos + n_seg
+    grafo = coo_matrix((np.ones(len(linhas), dtype=np.int8), (linhas, colunas)), shape=(n, n))
+    _, rotulo = connected_components(grafo, directed=False)
+    return renumerar_por_ordem(rotulo[:n_nos])
+
+
+def componentes_nos(rede):
+    """Componente conexo de cada nó da rede (persistido para atualizar_componentes)"""
+    return _rotular_bipartido(np.asarray(rede['aresta_origem_no']), np.asarray(rede['aresta_destino_no']),
+                              np.asarray(rede['aresta_segmento']), len(rede['nos_xy']))
+
+
+def componente_dos_segmentos(rede, rotulo_no):
+    """Componente de cada segmento (o do nó inicial da sua primeira aresta; -1 sem arestas)"""
+    componente = np.full(len(rede['segmento_id']), -1, dtype=np.int64)
+    segmento = np.asarray(rede['aresta_segmento'])
+    componente[segmento[::-1]] = rotulo_no[np.asarray(rede['aresta_origem_no'])[::-1]]
+    return componente
+
+
+def atualizar_rede(rede, ids_removidos, geoms_novas, ids_novos, tolerancia=TOLERANCIA_SNAP_M,
+                   sre_geoms=None, tolerancia_sre=None, origem=ORIGEM_VICINAL, classe=None):
+    """
+    Aplica uma edição de segmentos à rede sem reconstruí-la
+
+    As arestas dos segmentos em `ids_removidos` (removidos ou alterados) saem
+    da rede e as partes de `geoms_novas` (adicionados ou alterados, com ids
+    `ids_novos`) entram. Ids já existentes reaproveitam o slot do segmento;
+    ids novos são acrescentados ao final, e os removidos ficam com
+    'segmento_ativo' = False. Cada extremidade nova é ligada ao nó existente
+    mais próximo a até `tolerancia`; as demais viram nós novos (agrupados
+    entre si), marcados em 'no_sre' se estiverem a até `tolerancia_sre` de
+    `sre_geoms`. Os ids dos nós existentes não mudam.
+
+    Retorna (rede_nova, nos_perdidos, arestas_novas): extremidades das
+    arestas removidas e índices das arestas acrescentadas (para
+    atualizar_componentes).
+    """
+    segmento_id = np.asarray(rede['segmento_id'])
+    n_seg = len(segmento_id)
+    ativo = np.asarray(rede['segmento_ativo']) if 'segmento_ativo' in rede else np.ones(n_seg, dtype=bool)
+    indice = pd.Index(segmento_id)
+
+    pos_removidos = indice.get_indexer(np.asarray(ids_removidos, dtype=np.int64))
+    pos_removidos = pos_removidos[pos_removidos >= 0]
+    pos_novos = indice.get_indexer(np.asarray(ids_novos, dtype=np.int64))
+    faltam = pos_novos < 0
+    pos_novos[faltam] = n_seg + np.arange(faltam.sum())
+
+    # Segmentos
+    classes = np.asarray(rede['classes'])
+    segmento_classe = np.asarray(rede['segmento_classe']).copy()
+    segmento_classe = np.concatenate([segmento_classe, np.zeros(faltam.sum(), dtype=np.int16)])
+    if classe is not None:
+        classe = pd.Series(classe).astype(object).fillna('').astype(str).to_numpy()
+        novas = np.setdiff1d(classe, classes)
+        classes = np.concatenate([classes, novas]).astype(str)
+        segmento_classe[pos_novos] = pd.Index(classes).get_indexer(classe)
+    segmento_origem = np.concatenate([np.asarray(rede['segmento_origem']),
+                                      np.full(faltam.sum(), origem, dtype=np.int8)])
+    segmento_origem[pos_novos] = origem
+    ativo = np.concatenate([ativo, np.zeros(faltam.sum(), dtype=bool)])
+    ativo[pos_removidos] = False
+    ativo[pos_novos] = True
+
+    # Arestas mantidas
+    aresta_segmento = np.asarray(rede['aresta_segmento'])
+    origem_no = np.asarray(rede['aresta_origem_no'])
+    destino_no = np.asarray(rede['aresta_destino_no'])
+    manter = ~np.isin(aresta_segmento, pos_removidos)
+    nos_perdidos = np.unique(np.concatenate([origem_no[~manter], destino_no[~manter]]))
+
+    # Arestas novas: extremidades ligadas aos nós existentes
+    nos_xy = np.asarray(rede['nos_xy'])
+    partes, seg_local, inicio, fim = _partes_lineares(geoms_novas)
+    pontos = np.vstack([inicio, fim])
+    no = np.empty(len(pontos), dtype=np.int64)
+    novos_xy = np.zeros((0, 2))
+    if len(pontos):
+        distancia, vizinho = cKDTree(nos_xy).query(pontos, distance_upper_bound=tolerancia)
+        casado = np.isfinite(distancia)
+        no[casado] = vizinho[casado]
+        if (~casado).any():
+            grupo = agrupar_pontos(pontos[~casado], tolerancia)
+            no[~casado] = len(nos_xy) + grupo
+            novos_xy = np.zeros((grupo.max() + 1, 2))
+            novos_xy[grupo[::-1]] = pontos[~casado][::-1]
+    n_partes = len(partes)
+    segmento_novo = pos_novos[seg_local]
+
+    no_sre = np.concatenate([np.asarray(rede['no_sre']), np.zeros(len(novos_xy), dtype=bool)])
+    if sre_geoms is not None and len(novos_xy):
+        idx_no, _ = STRtree(np.asarray(sre_geoms, dtype=object)).query(
+            shapely.points(novos_xy), predicate='dwithin', distance=tolerancia_sre
+        )
+        no_sre[len(nos_xy) + idx_no] = True
+
+    nos_xy = np.vstack([nos_xy, novos_xy])
+    origem_no = np.concatenate([origem_no[manter], no[:n_partes]]).astype(np.int32)
+    destino_no = np.concatenate([destino_no[manter], no[n_partes:]]).astype(np.int32)
+    aresta_segmento = np.concatenate([aresta_segmento[manter], segmento_novo]).astype(np.int32)
+    indptr, indices, csr_aresta = _adjacencia_csr(origem_no, destino_no, len(nos_xy))
+
+    rede_nova = dict(rede)
+    rede_nova.update({
+        'nos_xy': nos_xy,
+        'no_sre': no_sre,
+        'aresta_origem_no': origem_no,
+        'aresta_destino_no': destino_no,
+        'aresta_segmento': aresta_segmento,
+        'aresta_comprimento': np.concatenate([np.asarray(rede['aresta_comprimento'])[manter], shapely.length(partes)]),
+        'aresta_origem': segmento_origem[aresta_segmento],
+        'aresta_classe': segmento_classe[aresta_segmento],
+        'indptr': indptr,
+        'indices': indices,
+        'csr_aresta': csr_aresta,
+        'segmento_id': np.concatenate([segmento_id, np.asarray(ids_novos, dtype=np.int64)[faltam]]),
+        'segmento_origem': segmento_origem,
+        'segmento_classe': segmento_classe,
+        'segmento_ativo': ativo,
+        'classes': classes,
+    })
+    arestas_novas = np.arange(manter.sum(), manter.sum() + n_partes)
+    return rede_nova, nos_perdidos, arestas_novas
+
+
+def atualizar_componentes(rede, rotulo_no, nos_perdidos, arestas_novas):
+    """
+    Atualiza os componentes dos nós depois de atualizar_rede
+
+    - nós novos recebem rótulos próprios
+    - remoções: os componentes que perderam arestas são recalculados só
+      sobre os seus nós (os demais não mudam)
+    - inserções: união dos rótulos ligados pelas arestas novas (union-find
+      sobre os rótulos, via connected_components), mantendo o menor rótulo
+
+    Rótulos de componentes não afetados ficam iguais. Retorna o novo rótulo
+    de cada nó.
+    """
+    n_nos = len(rede['nos_xy'])
+    origem_no = np.asarray(rede['aresta_origem_no'])
+    destino_no = np.asarray(rede['aresta_destino_no'])
+    segmento = np.asarray(rede['aresta_segmento'])
+
+    rotulo = np.concatenate([np.asarray(rotulo_no, dtype=np.int64),
+                             np.full(n_nos - len(rotulo_no), -1, dtype=np.int64)])
+    proximo = int(rotulo.max()) + 1 if len(rotulo) else 0
+    novos = np.flatnonzero(rotulo < 0)
+    rotulo[novos] = proximo + np.arange(len(novos))
+    proximo += len(novos)
+
+    # Remoções: recálculo local dos componentes afetados
+    if len(nos_perdidos):
+        afetado = np.isin(rotulo, np.unique(rotulo[nos_perdidos]))
+        nos_locais = np.flatnonzero(afetado)
+        local = np.full(n_nos, -1, dtype=np.int64)
+        local[nos_locais] = np.arange(len(nos_locais))
+        internas = afetado[origem_no] & afetado[destino_no]
+        rotulo_local = _rotular_bipartido(local[origem_no[internas]], local[destino_no[internas]],
+                                          segmento[internas], len(nos_locais))
+        rotulo[nos_locais] = proximo + rotulo_local
+        proximo += int(rotulo_local.max()) + 1 if len(rotulo_local) else 0
+
+    # Inserções: união dos rótulos ligados pelas arestas novas
+    if len(arestas_novas):
+        u, v = origem_no[arestas_novas], destino_no[arestas_novas]
+        primeiro = pd.Series(u).groupby(segmento[arestas_novas]).transform('first').to_numpy()
+        a = rotulo[np.concatenate([u, u])]
+        b = rotulo[np.concatenate([v, primeiro])]
+        envolvidos, inverso = np.unique(np.concatenate([a, b]), return_inverse=True)
+        n = len(envolvidos)
+        grafo = coo_matrix((np.ones(len(a), dtype=np.int8), (inverso[:len(a)], inverso[len(a):])), shape=(n, n))
+        _, grupo = connected_components(grafo, directed=False)
+        representante = np.full(grupo.max() + 1, np.iinfo(np.int64).max)
+        np.minimum.at(representante, grupo, envolvidos)
+        mapa = np.arange(proximo)
+        mapa[envolvidos] = representante[grupo]
+        rotulo = mapa[rotulo]
+
+    return rotulo
@@ -0,0 +1,219 @@
+"""
+Indicadores de topologia da rede viária por município e Região Administrativa
+
+Complementa as densidades por extensão (densidade_area_10k, densidade_pop_10k)
+com indicadores da estrutura do grafo da rede combinada municipal + DER
+(rede_viaria.npz, gerada por construir_rede_viaria.py, nodada nas junções:
+um T entre duas vias é um nó de grau 3, não três pontas soltas):
+
+- distribuição do grau dos nós, interseções (grau >= 3) e pontas soltas (grau 1)
+- densidade de interseções (por 100 km²)
+- índices alfa, beta e gama de conectividade
+
+Os nós de grau 2 só dividem uma via em duas arestas, então os índices usam o
+grafo reduzido: v = nós de grau != 2 e e = metade da soma dos graus desses
+nós. Arestas que cruzam a divisa contam meia para cada lado. Tudo sai de um
+único groupby sobre o array de nós (rótulo do município ou da RA de cada nó);
+o número de componentes (p) vem de um connected_components sobre as arestas
+internas a cada unidade e conta só os componentes com algum nó do grafo
+reduzido (anéis feitos só de nós de grau 2 não entram em v, e nem p).
+
+Os indicadores são gravados nos mesmos JSONs dos indicadores de densidade.
+
+Autor: Análise automatizada
+Data: Janeiro/2026
+"""
+
+import json
+import geopandas as gpd
+import numpy as np
+import pandas as pd
+import shapely
+from pathlib import Path
+from datetime import datetime
+from scipy.sparse import coo_matrix
+from scipy.sparse.csgraph import connected_components
+from construir_rede_viaria import REDE_VIARIA, carregar_rede_viaria
+import warnings
+warnings.filterwarnings('ignore')
+
+# Configurações
+BASE_DIR = Path(__file__).parent
+DATA_DIR = BASE_DIR / 'docs' / 'data'
+MUNICIPIOS_SP = DATA_DIR / 'municipios_sp.geojson'
+
+# JSONs de indicadores atualizados (os que existirem)
+JSON_MUNICIPIOS = [DATA_DIR / 'municipios_indicadores.json', DATA_DIR / 'municipios_indicadores_total.json']
+JSON_REGIOES = [DATA_DIR / 'regioes_indicadores.json', DATA_DIR / 'regioes_indicadores_total.json']
+
+
+def log_section(titulo):
+    """Imprime seção formatada"""
+    print(f"\n{'='*60}")
+    print(f"{titulo}")
+    print(f"{'='*60}")
+
+
+def rotular_nos(rede, poligonos):
+    """
+    Índice do polígono que contém cada nó (-1 fora de todos)
+
+    Uma única consulta em lote no STRtree dos polígonos.
+    """
+    pontos = shapely.points(np.asarray(rede['nos_xy']))
+    arvore = shapely.STRtree(np.asarray(poligonos, dtype=object))
+    idx_no, idx_poligono = arvore.query(pontos, predicate='within')
+    rotulo = np.full(len(pontos), -1, dtype=np.int64)
+    rotulo[idx_no] = idx_poligono
+    return rotulo
+
+
+def componentes_por_rotulo(rede, rotulo, reduzido):
+    """
+    Número de componentes conexos do grafo reduzido de cada unidade
+
+    Só as arestas com as duas extremidades na mesma unidade entram no
+    grafo; cada componente pertence à unidade dos seus nós e só conta se
+    tiver algum nó de `reduzido` (grau != 2). Eliminar os nós de grau 2 não
+    muda a conectividade entre os demais.
+    """
+    origem_no = np.asarray(rede['aresta_origem_no'])
+    destino_no = np.asarray(rede['aresta_destino_no'])
+    interna = rotulo[origem_no] == rotulo[destino_no]
+
+    n_nos = len(rotulo)
+    grafo = coo_matrix(
+        (np.ones(interna.sum(), dtype=np.int8), (origem_no[interna], destino_no[interna])),
+        shape=(n_nos, n_nos),
+    )
+    _, componente = connected_components(grafo, directed=False)
+
+    pares = pd.DataFrame({'rotulo': rotulo, 'componente': componente})
+    pares = pares[(pares['rotulo'] >= 0) & reduzido].drop_duplicates()
+    return pares.groupby('rotulo').size()
+
+
+def indicadores_topologia(rede, rotulo, area_km2):
+    """
+    Indicadores de topologia por unidade (rótulo de cada nó, -1 = fora)
+
+    Retorna um DataFrame indexado pelo rótulo, com area_km2 indexada da mesma
+    forma.
+    """
+    grau = np.diff(np.asarray(rede['indptr']))
+    reduzido = grau != 2
+    nos = pd.DataFrame({'rotulo': rotulo, 'grau': grau})
+    nos = nos[nos['rotulo'] >= 0]
+    nos['reduzido'] = nos['grau'] != 2
+    nos['grau_reduzido'] = np.where(nos['reduzido'], nos['grau'], 0)
+    nos['ponta'] = nos['grau'] == 1
+    nos['intersecao'] = nos['grau'] >= 3
+    nos['grau_4mais'] = nos['grau'] >= 4
+
+    topo = nos.groupby('rotulo').agg(
+        nos=('grau', 'size'),
+        v=('reduzido', 'sum'),
+        soma_grau=('grau_reduzido', 'sum'),
+        pontas_soltas=('ponta', 'sum'),
+        intersecoes=('intersecao', 'sum'),
+        nos_grau_4mais=('grau_4mais', 'sum'),
+    )
+    topo['e'] = topo['soma_grau'] / 2
+    topo['p'] = componentes_por_rotulo(rede, rotulo, reduzido).reindex(topo.index).fillna(0)
+    topo['area_km2'] = area_km2.reindex(topo.index)
+
+    v, e, p = topo['v'], topo['e'], topo['p']
+    topo['grau_medio'] = (2 * e / v).where(v > 0)
+    topo['prop_pontas_soltas'] = (topo['pontas_soltas'] / v).where(v > 0)
+    topo['prop_grau_4mais'] = (topo['nos_grau_4mais'] / topo['intersecoes']).where(topo['intersecoes'] > 0)
+    topo['densidade_intersecoes_100km2'] = topo['intersecoes'] / topo['area_km2'] * 100
+    topo['indice_alfa'] = ((e - v + p) / (2 * v - 5)).where(v > 2).clip(lower=0)
+    topo['indice_beta'] = (e / v).where(v > 0)
+    topo['indice_gama'] = (e / (3 * (v - 2))).where(v > 2)
+    return topo.drop(columns=['soma_grau', 'v', 'e', 'p', 'area_km2'])
+
+
+def _registros(topo):
+    """Indicadores de uma unidade no formato dos JSONs (tipos nativos, arredondados)"""
+    registros = {}
+    for chave, row in topo.iterrows():
+        registros[chave] = {
+            'topo_nos': int(row['nos']),
+            'topo_intersecoes': int(row['intersecoes']),
+            'topo_pontas_soltas': int(row['pontas_soltas']),
+            'topo_nos_grau_4mais': int(row['nos_grau_4mais']),
+            'topo_grau_medio': None if pd.isna(row['grau_medio']) else round(float(row['grau_medio']), 4),
+            'topo_prop_pontas_soltas': None if pd.isna(row['prop_pontas_soltas']) else round(float(row['prop_pontas_soltas']), 4),
+            'topo_prop_grau_4mais': None if pd.isna(row['prop_grau_4mais']) else round(float(row['prop_grau_4mais']), 4),
+            'topo_densidade_intersecoes_100km2': round(float(row['densidade_intersecoes_100km2']), 4),
+            'indice_alfa': None if pd.isna(row['indice_alfa']) else round(float(row['indice_alfa']), 4),
+            'indice_beta': None if pd.isna(row['indice_beta']) else round(float(row['indice_beta']), 4),
+            'indice_gama': None if pd.isna(row['indice_gama']) else round(float(row['indice_gama']), 4),
+        }
+    return registros
+
+
+def atualizar_json(arquivos, chave, registros):
+    """Acrescenta os indicadores aos itens de cada JSON existente (casados por `chave`)"""
+    for arquivo in arquivos:
+        if not arquivo.exists():
+            continue
+        with open(arquivo, 'r', encoding='utf-8') as f:
+            itens = json.load(f)
+        atualizados = 0
+        for item in itens:
+            valores = registros.get(str(item[chave]))
+            if valores is not None:
+                item.update(valores)
+                atualizados += 1
+        with open(arquivo, 'w', encoding='utf-8') as f:
+            json.dump(itens, f, ensure_ascii=False, indent=2)
+        print(f"  ✓ {arquivo.name}: {atualizados}/{len(itens)} atualizados")
+
+
+def main():
+    log_section("INDICADORES DE TOPOLOGIA DA REDE")
+    print(f"Início: {datetime.now().strftime('%Y-%m-%d %H:%M:%S')}")
+
+    print(f"\nMapeando rede: {REDE_VIARIA}")
+    rede = carregar_rede_viaria(mmap=True)
+    print(f"  Nós: {len(rede['nos_xy']):,} | arestas: {len(rede['aresta_comprimento']):,}")
+
+    print(f"\nCarregando municípios: {MUNICIPIOS_SP}")
+    municipios = gpd.read_file(MUNICIPIOS_SP)[['CD_MUN', 'NM_MUN', 'geometry']].to_crs(rede['crs'].item())
+    municipios['CD_MUN'] = municipios['CD_MUN'].astype(str)
+    municipios['area_km2'] = municipios.geometry.area / 1_000_000
+
+    # RA de cada município (mesma associação dos indicadores de densidade)
+    with open(JSON_MUNICIPIOS[0], 'r', encoding='utf-8') as f:
+        ra_dict = {str(m['Cod_ibge']): m['RA'] for m in json.load(f)}
+    municipios['RA'] = municipios['CD_MUN'].map(ra_dict)
+    print(f"  Total: {len(municipios)} municípios ({municipios['RA'].nunique()} RAs)")
+
+    log_section("MUNICÍPIOS")
+    rotulo_mun = rotular_nos(rede, municipios.geometry)
+    print(f"  Nós fora dos municípios: {(rotulo_mun < 0).sum():,}")
+    topo_mun = indicadores_topologia(rede, rotulo_mun, municipios['area_km2'])
+    topo_mun.index = municipios['CD_MUN'].to_numpy()[topo_mun.index]
+    print(topo_mun[['intersecoes', 'pontas_soltas', 'indice_alfa', 'indice_beta', 'indice_gama']].describe().round(3).to_string())
+
+    log_section("REGIÕES ADMINISTRATIVAS")
+    codigo_ra, nomes_ra = pd.factorize(municipios['RA'])
+    rotulo_ra = np.where(rotulo_mun >= 0, codigo_ra[rotulo_mun], -1)
+    area_ra = municipios.groupby(codigo_ra)['area_km2'].sum()
+    topo_ra = indicadores_topologia(rede, rotulo_ra, area_ra)
+    topo_ra.index = nomes_ra[topo_ra.index]
+    print(topo_ra[['intersecoes', 'indice_alfa', 'indice_beta', 'indice_gama']].round(3).to_string())
+
+    log_section("GRAVANDO INDICADORES")
+    atualizar_json(JSON_MUNICIPIOS, 'Cod_ibge', _registros(topo_mun))
+    atualizar_json(JSON_REGIOES, 'RA', _registros(topo_ra))
+
+    print(f"\nFim: {datetime.now().strftime('%Y-%m-%d %H:%M:%S')}")
+    print("\n✅ Indicadores de topologia calculados!")
+
+    return topo_mun, topo_ra
+
+
+if __name__ == "__main__":
+    resultado = main()
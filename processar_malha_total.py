@@ -13,6 +13,7 @@ import json
 from pathlib import Path
 from shapely.ops import unary_union
 import numpy as np
+from rateio_municipal import ratear_extensao, extensao_por_poligono
 
 print("=" * 80)
 print("PROCESSAMENTO DA MALHA TOTAL ESTADUAL")
@@ -125,24 +126,16 @@ print(f"  ✓ Carregado: {len(municipios)} municípios")
 # ============================================================================
 print("\n[5/7] Calculando extensão por município (malha total)...")
 
-# Fazer interseção espacial
-malha_mun_total = gpd.sjoin(malha_total, municipios[['geometry', 'Cod_ibge', 'Municipio']], 
-                              how='left', predicate='intersects')
-
-# Calcular extensão por município
-extensoes_total = []
-for cod_mun in municipios['Cod_ibge'].unique():
-    segmentos_mun = malha_mun_total[malha_mun_total['Cod_ibge'] == cod_mun]
-    
-    if len(segmentos_mun) > 0:
-        ext_km = segmentos_mun.geometry.length.sum() / 1000
-        extensoes_total.append({
-            'Cod_ibge': str(cod_mun),
-            'extensao_total_km': round(ext_km, 2)
-        })
-
-df_ext_total = pd.DataFrame(extensoes_total)
+# Rateio exato: segmentos na divisa são recortados entre os municípios
+rateio = ratear_extensao(malha_total.geometry, municipios.geometry)
+ext_km = extensao_por_poligono(rateio, municipios['Cod_ibge'].astype(str)) / 1000
+
+df_ext_total = pd.DataFrame({
+    'Cod_ibge': ext_km.index.astype(str),
+    'extensao_total_km': ext_km.round(2).to_numpy()
+})
 print(f"  ✓ Extensão calculada para {len(df_ext_total)} municípios")
+print(f"  ✓ Total rateado: {ext_km.sum():,.2f} km (fora dos municípios: {extensao_total_km - ext_km.sum():,.2f} km)")
 
 # ============================================================================
 # 6. ATUALIZAR INDICADORES MUNICIPAIS
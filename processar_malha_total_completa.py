@@ -12,6 +12,7 @@ import json
 from pathlib import Path
 import numpy as np
 from shapely.ops import unary_union
+from rateio_municipal import ratear_extensao, extensao_por_poligono
 
 print("=" * 80)
 print("PROCESSAMENTO COMPLETO DA MALHA ESTADUAL TOTAL")
@@ -134,32 +135,18 @@ print(f"  ✓ Indicadores vicinal: {len(indicadores_vicinal)} municípios")
 # ============================================================================
 print("\n[5/7] Calculando extensão da malha TOTAL por município...")
 
-# Fazer spatial join para saber qual segmento está em qual município
-malha_total_com_mun = gpd.sjoin(malha_total, municipios_sp[['CD_MUN', 'NM_MUN', 'geometry']], 
-                                 how='left', predicate='intersects')
-
-# Calcular extensão por município
-extensoes_municipios = []
-for cod_mun in municipios_sp['CD_MUN'].unique():
-    segmentos_mun = malha_total_com_mun[malha_total_com_mun['CD_MUN'] == cod_mun]
-    
-    if len(segmentos_mun) > 0:
-        extensao_km = segmentos_mun.geometry.length.sum() / 1000
-        extensao_vicinal = segmentos_mun[segmentos_mun['origem'] == 'Vicinal'].geometry.length.sum() / 1000
-        extensao_der = segmentos_mun[segmentos_mun['origem'] == 'DER'].geometry.length.sum() / 1000
-    else:
-        extensao_km = 0
-        extensao_vicinal = 0
-        extensao_der = 0
-    
-    extensoes_municipios.append({
-        'Cod_ibge': str(cod_mun),
-        'extensao_total_km': extensao_km,
-        'extensao_vicinal_km': extensao_vicinal,
-        'extensao_der_km': extensao_der
-    })
-
-df_extensoes = pd.DataFrame(extensoes_municipios)
+# Rateio exato: segmentos na divisa são recortados entre os municípios
+rateio = ratear_extensao(malha_total.geometry, municipios_sp.geometry)
+por_origem = extensao_por_poligono(rateio, municipios_sp['CD_MUN'].astype(str), grupos=malha_total['origem'])
+por_origem = por_origem.reindex(index=municipios_sp['CD_MUN'].astype(str).unique(),
+                                columns=['Vicinal', 'DER'], fill_value=0.0) / 1000
+
+df_extensoes = pd.DataFrame({
+    'Cod_ibge': por_origem.index,
+    'extensao_total_km': por_origem.sum(axis=1).to_numpy(),
+    'extensao_vicinal_km': por_origem['Vicinal'].to_numpy(),
+    'extensao_der_km': por_origem['DER'].to_numpy()
+})
 print(f"  ✓ Extensões calculadas para {len(df_extensoes)} municípios")
 print(f"  ✓ Total geral: {df_extensoes['extensao_total_km'].sum():,.2f} km")
 
@@ -0,0 +1,115 @@
+"""
+Rateio exato da extensão da malha entre municípios
+
+Substitui as duas atribuições aproximadas usadas até aqui:
+- sjoin(predicate='intersects'): um segmento na divisa conta inteiro nos dois
+  municípios (a soma por município passa do total estadual)
+- ponto médio + within: o segmento inteiro vai para um único município
+
+Os polígonos municipais são decompostos em partes disjuntas pequenas
+(subdividir_poligono) e indexados em uma STRtree. Os segmentos cobertos por
+uma única parte (a grande maioria, covers sobre as partes preparadas) levam
+o comprimento inteiro sem recorte; só os candidatos que cruzam alguma borda
+são recortados com shapely.intersection vetorizado. A soma por município
+fecha com a extensão dentro do estado.
+
+Autor: Análise automatizada
+Data: Janeiro/2026
+"""
+
+import numpy as np
+import pandas as pd
+import shapely
+from shapely import STRtree
+from sobreposicao_der import subdividir_poligono
+
+# Máximo de vértices por parte dos polígonos municipais
+MAX_VERTICES_PARTE = 1000
+
+
+def particionar_poligonos(poligonos, max_vertices=MAX_VERTICES_PARTE):
+    """
+    Partes disjuntas de cada polígono, com o índice (posição) do polígono
+
+    Retorna (partes, poligono_da_parte); as partes já vêm preparadas para
+    predicados.
+    """
+    geoms = shapely.make_valid(np.asarray(poligonos, dtype=object))
+    partes, origem = [], []
+    for i, geom in enumerate(geoms):
+        if geom is None or geom.is_empty:
+            continue
+        p = subdividir_poligono(geom, max_vertices)
+        p = p[shapely.get_type_id(p) == shapely.GeometryType.POLYGON]
+        partes.append(p)
+        origem.append(np.full(len(p), i, dtype=np.int64))
+
+    partes = np.concatenate(partes) if partes else np.array([], dtype=object)
+    origem = np.concatenate(origem) if origem else np.zeros(0, dtype=np.int64)
+    shapely.prepare(partes)
+    return partes, origem
+
+
+def ratear_extensao(linhas, poligonos, max_vertices=MAX_VERTICES_PARTE):
+    """
+    Extensão de cada linha dentro de cada polígono
+
+    `linhas` e `poligonos` no mesmo CRS métrico. Retorna um DataFrame com
+    linha (posição em `linhas`), poligono (posição em `poligonos`) e
+    extensao (unidade do CRS), um registro por par com extensão > 0. A soma
+    de uma linha nunca passa do seu comprimento: trechos sobre a divisa
+    (que as duas partes vizinhas contêm) são reescalados.
+    """
+    linhas = np.asarray(linhas, dtype=object)
+    partes, poligono_da_parte = particionar_poligonos(poligonos, max_vertices)
+    vazio = pd.DataFrame({'linha': np.zeros(0, dtype=np.int64),
+                          'poligono': np.zeros(0, dtype=np.int64),
+                          'extensao': np.zeros(0)})
+    if len(linhas) == 0 or len(partes) == 0:
+        return vazio
+
+    comprimento = shapely.length(linhas)
+    idx_linha, idx_parte = STRtree(partes).query(linhas, predicate='intersects')
+
+    # Caminho rápido: linha inteira dentro de uma parte (primeira que a cobre)
+    coberta = shapely.covers(partes[idx_parte], linhas[idx_linha])
+    primeira = np.zeros(len(idx_linha), dtype=bool)
+    _, pos = np.unique(idx_linha[coberta], return_index=True)
+    primeira[np.flatnonzero(coberta)[pos]] = True
+    interna = np.zeros(len(linhas), dtype=bool)
+    interna[idx_linha[primeira]] = True
+
+    # Recorte só dos pares de linhas que cruzam alguma borda
+    borda = ~interna[idx_linha]
+    recorte = shapely.length(shapely.intersection(linhas[idx_linha[borda]], partes[idx_parte[borda]]))
+
+    pares = pd.DataFrame({
+        'linha': np.concatenate([idx_linha[primeira], idx_linha[borda]]),
+        'poligono': poligono_da_parte[np.concatenate([idx_parte[primeira], idx_parte[borda]])],
+        'extensao': np.concatenate([comprimento[idx_linha[primeira]], recorte]),
+    })
+    pares = pares[pares['extensao'] > 0]
+    if len(pares) == 0:
+        return vazio
+    pares = pares.groupby(['linha', 'poligono'], as_index=False, sort=True)['extensao'].sum()
+
+    # Divisa compartilhada contada pelos dois lados: limitar ao comprimento
+    soma = pares.groupby('linha')['extensao'].transform('sum').to_numpy()
+    total = comprimento[pares['linha'].to_numpy()]
+    pares['extensao'] *= np.where(soma > total, total / np.maximum(soma, 1e-300), 1.0)
+    return pares
+
+
+def extensao_por_poligono(rateio, chaves, grupos=None):
+    """
+    Soma do rateio por chave do polígono (e, opcionalmente, por grupo da linha)
+
+    `chaves` é indexável pela posição do polígono (ex.: CD_MUN ou RA de cada
+    município); `grupos`, pela posição da linha (ex.: origem). Retorna uma
+    Series (ou um DataFrame com uma coluna por grupo) na unidade do rateio.
+    """
+    chave = np.asarray(chaves)[rateio['poligono'].to_numpy()]
+    if grupos is None:
+        return rateio['extensao'].groupby(chave).sum()
+    grupo = np.asarray(grupos)[rateio['linha'].to_numpy()]
+    return rateio['extensao'].groupby([chave, grupo]).sum().unstack(fill_value=0.0)
@@ -11,6 +11,7 @@ import json
 from pathlib import Path
 from collections import defaultdict
 import geopandas as gpd
+from rateio_municipal import ratear_extensao, extensao_por_poligono
 
 DATA_DIR = Path("docs/data")
 
@@ -77,20 +78,14 @@ print(f"  ✓ GeoJSON de municípios carregado ({len(municipios_gdf)} polígonos
 # ============================================================================
 print("\n[3/4] Calculando extensão por RA (via município)...")
 
-# Pegar ponto médio de cada segmento para join
-osm_points = osm_gdf.copy()
-osm_points['geometry'] = osm_points.geometry.interpolate(0.5, normalized=True)
-
-total_points = total_gdf.copy()
-total_points['geometry'] = total_points.geometry.interpolate(0.5, normalized=True)
-
-# Spatial join com MUNICÍPIOS (que têm a RA correta)
-osm_mun = gpd.sjoin(osm_points, municipios_gdf[['Cod_ibge', 'RA', 'geometry']], how='left', predicate='within')
-total_mun = gpd.sjoin(total_points, municipios_gdf[['Cod_ibge', 'RA', 'geometry']], how='left', predicate='within')
+# Rateio exato entre MUNICÍPIOS (que têm a RA correta): segmentos na divisa
+# são recortados, em vez de ir inteiros para o município do ponto médio
+osm_rateio = ratear_extensao(osm_gdf.geometry, municipios_gdf.geometry)
+total_rateio = ratear_extensao(total_gdf.geometry, municipios_gdf.geometry)
 
 # Agregar por RA
-osm_por_ra = osm_mun.groupby('RA')['length_km'].sum().to_dict()
-total_por_ra = total_mun.groupby('RA')['length_km'].sum().to_dict()
+osm_por_ra = (extensao_por_poligono(osm_rateio, municipios_gdf['RA']) / 1000).to_dict()
+total_por_ra = (extensao_por_poligono(total_rateio, municipios_gdf['RA']) / 1000).to_dict()
 
 osm_alocado = sum(osm_por_ra.values())
 total_alocado = sum(total_por_ra.values())
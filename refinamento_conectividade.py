@@ -15,22 +15,31 @@ import pandas as pd
 import numpy as np
 from pathlib import Path
 from datetime import datetime
-from shapely.ops import unary_union
-from shapely.geometry import Point, LineString, MultiLineString
+import shapely
+from shapely import STRtree
+from esquema_malha import ler_malha, gravar_malha
+from sobreposicao_der import JURISDICOES_SRE, filtrar_sre, carregar_buffer_der, calcular_proporcao_sobreposta
+from construir_rede_viaria import MALHA_MUNICIPAL, REDE_VIARIA, hashes_camadas, montar_rede_viaria
+from grafo_malha import (
+    ORIGEM_VICINAL, componentes_com, componentes_rede, carregar_rede, hashes_divergentes,
+    renumerar_por_ordem, distancia_multiorigem, distancia_segmentos
+)
 import warnings
 warnings.filterwarnings('ignore')
 
 # Configurações
-MALHA_MUNICIPAL = r'D:\ESTUDO_VICINAIS_V2\resultados\dados_processados\malha_municipal_sp.gpkg'
 MALHA_DER = r'D:\ESTUDO_VICINAIS_V2\dados\Sistema Rodoviário Estadual\MALHA_RODOVIARIA\MALHA_OUT.shp'
 OUTPUT_DIR = Path(r'D:\ESTUDO_VICINAIS_V2\resultados\dados_processados')
 INTERMEDIARIO_DIR = Path(r'D:\ESTUDO_VICINAIS_V2\resultados\intermediarios')
 RELATORIO_DIR = Path(r'D:\ESTUDO_VICINAIS_V2\resultados\relatorios')
+MUNICIPIOS_SP = Path(__file__).parent / 'docs' / 'data' / 'municipios_sp.geojson'
 
 # Tolerância para buffer de subtração (em metros)
 BUFFER_SUBTRACAO = 15  # metros
 # Tolerância para conectividade (em metros)
 TOLERANCIA_CONEXAO = 50  # metros
+# Tolerância para unir extremidades no grafo da rede (em metros)
+TOLERANCIA_SNAP = 1  # metros
 
 
 def log_section(titulo):
@@ -45,7 +54,8 @@ def carregar_dados():
     log_section("CARREGANDO DADOS")
     
     print(f"Carregando malha municipal: {MALHA_MUNICIPAL}")
-    municipal = gpd.read_file(MALHA_MUNICIPAL)
+    municipal = ler_malha(MALHA_MUNICIPAL)
+    municipal['id_segmento'] = np.arange(len(municipal))  # posição na camada (mapeia para a rede)
     print(f"  Total: {len(municipal):,} segmentos")
     print(f"  CRS: {municipal.crs}")
     
@@ -84,39 +94,19 @@ def subtrair_malha_der(municipal, der):
     
     # Filtrar apenas rodovias estaduais e federais do DER
     print("\nFiltrando rodovias estaduais e federais do DER...")
-    der_estadual_federal = der_utm[der_utm['Jurisdicao'].isin(['Estadual', 'Federal'])]
+    der_estadual_federal = filtrar_sre(der_utm)
     print(f"  Segmentos estaduais/federais: {len(der_estadual_federal):,}")
     
-    # Criar buffer ao redor da malha DER
-    print(f"\nCriando buffer de {BUFFER_SUBTRACAO}m ao redor da malha DER...")
-    der_buffer = der_estadual_federal.geometry.buffer(BUFFER_SUBTRACAO)
-    der_union = unary_union(der_buffer)
-    print("  Buffer criado!")
-    
-    # Identificar segmentos municipais que interceptam o buffer do DER
-    print("\nIdentificando sobreposições...")
-    municipal_utm = municipal_utm.reset_index(drop=True)
-    
-    # Verificar interseção
-    intersecta_der = municipal_utm.geometry.intersects(der_union)
+    # Buffer ao redor da malha DER (cache em disco)
+    print(f"\nObtendo buffer de {BUFFER_SUBTRACAO}m ao redor da malha DER...")
+    _, buffers = carregar_buffer_der(der_utm, MALHA_DER, BUFFER_SUBTRACAO, jurisdicoes=JURISDICOES_SRE)
+    arvore = STRtree(buffers)
+    print("  Buffer pronto!")
     
     # Calcular proporção de sobreposição para cada segmento
-    print("Calculando proporção de sobreposição...")
-    proporcao_sobreposta = []
-    
-    for idx, row in municipal_utm.iterrows():
-        if intersecta_der[idx]:
-            try:
-                intersecao = row.geometry.intersection(der_union)
-                if not intersecao.is_empty:
-                    prop = intersecao.length / row.geometry.length
-                else:
-                    prop = 0
-            except:
-                prop = 0
-        else:
-            prop = 0
-        proporcao_sobreposta.append(prop)
+    print("\nCalculando proporção de sobreposição...")
+    municipal_utm = municipal_utm.reset_index(drop=True)
+    proporcao_sobreposta = calcular_proporcao_sobreposta(municipal_utm.geometry, buffers, arvore)
     
     municipal_utm['prop_sobreposta'] = proporcao_sobreposta
     
@@ -146,13 +136,102 @@ def subtrair_malha_der(municipal, der):
     return municipal_filtrado, removidos
 
 
-def analisar_conectividade(municipal, der):
+def rede_persistida_atual(arquivo_municipal):
+    """
+    Rede persistida, se foi gerada a partir do conteúdo atual das camadas
+
+    Compara o hash da camada municipal e do shapefile DER gravados por
+    construir_rede_viaria.py com os arquivos atuais (edições de geometria
+    não mudam o número de segmentos). Retorna a rede ou None.
+    """
+    if not REDE_VIARIA.exists():
+        return None
+    rede = carregar_rede(REDE_VIARIA)
+    divergentes = hashes_divergentes(rede, hashes_camadas(arquivo_municipal, MALHA_DER))
+    if divergentes:
+        print(f"  ⚠ Rede desatualizada ({', '.join(divergentes)} não confere com {REDE_VIARIA.name})")
+        return None
+    return rede
+
+
+def obter_rede(municipal_utm, der_utm, arquivo_municipal=None):
+    """
+    Rede municipal + DER para a análise de conectividade
+
+    Usa a rede persistida (rede_viaria.npz, mapeada em memória) quando ela
+    foi gerada a partir do conteúdo atual de arquivo_municipal (ver
+    rede_persistida_atual); senão monta a mesma rede (montar_rede_viaria,
+    sobre a camada inteira de arquivo_municipal, ou sobre municipal_utm sem
+    arquivo). Nos dois caminhos as arestas do DER podem ser percorridas, os
+    nós a até TOLERANCIA_CONEXAO do SRE ficam marcados e só os segmentos de
+    municipal_utm entram como vicinais.
+
+    Retorna (rede, posicao, vicinal, transitavel): posição de cada linha de
+    municipal_utm nos segmentos da rede, máscara dos segmentos vicinais
+    presentes e máscara dos segmentos que podem ser percorridos (vicinais
+    presentes + DER).
+    """
+    if arquivo_municipal and 'id_segmento' in municipal_utm.columns:
+        ids = municipal_utm['id_segmento'].to_numpy()
+        rede = rede_persistida_atual(arquivo_municipal)
+        if rede is not None:
+            print(f"Usando rede persistida: {REDE_VIARIA}")
+        else:
+            print(f"Construindo rede municipal + DER a partir de {arquivo_municipal} (snap de {TOLERANCIA_SNAP}m)...")
+            base = ler_malha(arquivo_municipal).to_crs(municipal_utm.crs)
+            rede = montar_rede_viaria(base, der_utm, TOLERANCIA_SNAP, TOLERANCIA_CONEXAO)
+    else:
+        ids = np.arange(len(municipal_utm))
+        print(f"Construindo rede municipal + DER (snap de {TOLERANCIA_SNAP}m)...")
+        rede = montar_rede_viaria(municipal_utm, der_utm, TOLERANCIA_SNAP, TOLERANCIA_CONEXAO)
+    
+    origem = np.asarray(rede['segmento_origem'])
+    vicinais = np.flatnonzero(origem == ORIGEM_VICINAL)
+    ids_rede = np.asarray(rede['segmento_id'])[vicinais]
+    posicao = vicinais[np.searchsorted(ids_rede, ids)]
+    vicinal = np.zeros(len(origem), dtype=bool)
+    vicinal[posicao] = True
+    return rede, posicao, vicinal, vicinal | (origem != ORIGEM_VICINAL)
+
+
+def distancias_por_municipio(municipal_utm):
+    """
+    Percentis da distância de rede ao SRE por município
+
+    Cada segmento é atribuído ao município que contém o seu ponto médio.
+    """
+    municipios = gpd.read_file(MUNICIPIOS_SP)[['CD_MUN', 'NM_MUN', 'geometry']].to_crs(municipal_utm.crs)
+    pontos = gpd.GeoDataFrame(
+        {'distancia_sre_km': municipal_utm['distancia_sre_km'].to_numpy()},
+        geometry=shapely.line_interpolate_point(np.asarray(municipal_utm.geometry, dtype=object), 0.5, normalized=True),
+        crs=municipal_utm.crs,
+    )
+    pontos = gpd.sjoin(pontos, municipios, predicate='within', how='inner')
+    pontos = pontos[~pontos.index.duplicated()]
+    
+    grupos = pontos.groupby(['CD_MUN', 'NM_MUN'])['distancia_sre_km']
+    percentis = grupos.quantile([0.5, 0.75, 0.9]).unstack()
+    percentis.columns = ['p50_km', 'p75_km', 'p90_km']
+    resumo = pd.concat([
+        grupos.size().rename('segmentos'),
+        grupos.count().rename('alcancaveis'),
+        percentis,
+        grupos.max().rename('max_km'),
+    ], axis=1).reset_index()
+    return resumo
+
+
+def analisar_conectividade(municipal, der, arquivo_municipal=None):
     """
     Analisa a conectividade entre a malha municipal e o SRE
     
     Identifica:
     1. Pontos de conexão entre municipal e SRE
     2. Segmentos municipais desconectados
+    
+    Os componentes e a distância de rede ao SRE vêm da rede persistida
+    (rede_viaria.npz) quando ela foi gerada a partir do conteúdo atual de
+    arquivo_municipal; senão o grafo é montado a partir das geometrias.
     """
     log_section("ETAPA 2: ANÁLISE DE CONECTIVIDADE")
     
@@ -165,9 +244,9 @@ def analisar_conectividade(municipal, der):
     sre = der_utm[der_utm['Jurisdicao'].isin(['Estadual', 'Federal'])].copy()
     print(f"Segmentos SRE: {len(sre):,}")
     
-    # Criar buffer ao redor do SRE para detectar conexões
-    print(f"\nCriando buffer de conexão ({TOLERANCIA_CONEXAO}m)...")
-    sre_buffer = unary_union(sre.geometry.buffer(TOLERANCIA_CONEXAO))
+    # Buffer ao redor do SRE para detectar conexões (cache em disco)
+    print(f"\nObtendo buffer de conexão ({TOLERANCIA_CONEXAO}m)...")
+    sre_buffer, _ = carregar_buffer_der(der_utm, MALHA_DER, TOLERANCIA_CONEXAO, jurisdicoes=JURISDICOES_SRE)
     
     # Identificar segmentos municipais que tocam o SRE
     print("Identificando segmentos conectados ao SRE...")
@@ -187,35 +266,43 @@ def analisar_conectividade(municipal, der):
     # Análise de componentes conexos (rede)
     print("\nAnalisando componentes da rede...")
     
-    # Extrair endpoints de cada linha
-    def get_endpoints(geom):
-        if isinstance(geom, LineString):
-            coords = list(geom.coords)
-            return [Point(coords[0]), Point(coords[-1])]
-        elif isinstance(geom, MultiLineString):
-            endpoints = []
-            for line in geom.geoms:
-                coords = list(line.coords)
-                endpoints.extend([Point(coords[0]), Point(coords[-1])])
-            return endpoints
-        return []
-    
-    # Criar grafo simplificado baseado em proximidade de endpoints
-    print("Construindo grafo de conectividade...")
-    
-    # Coletar todos os endpoints
-    all_endpoints = []
-    for idx, row in municipal_utm.iterrows():
-        eps = get_endpoints(row.geometry)
-        for ep in eps:
-            all_endpoints.append({
-                'geometry': ep,
-                'segment_idx': idx,
-                'conectado_sre': row['conectado_sre']
-            })
-    
-    endpoints_gdf = gpd.GeoDataFrame(all_endpoints, crs=municipal_utm.crs)
-    print(f"  Total de endpoints: {len(endpoints_gdf):,}")
+    # Rede nodada municipal + DER; componentes só sobre os segmentos vicinais
+    rede, posicao, vicinal, transitavel = obter_rede(municipal_utm, der_utm, arquivo_municipal)
+    componente = renumerar_por_ordem(componentes_rede(rede, vicinal)[posicao])
+    tamanho_componente = np.bincount(componente)[componente] if len(componente) else np.zeros(0, dtype=np.int64)
+    ativa = vicinal[rede['aresta_segmento']]
+    n_nos = len(np.unique(np.concatenate([
+        np.asarray(rede['aresta_origem_no'])[ativa], np.asarray(rede['aresta_destino_no'])[ativa]
+    ])))
+    
+    municipal_utm['componente'] = componente
+    municipal_utm['tamanho_componente'] = tamanho_componente
+    municipal_utm['componente_sre'] = componentes_com(componente, conectado_sre.to_numpy())
+    
+    n_componentes = int(componente.max()) + 1 if len(componente) else 0
+    n_componentes_sre = municipal_utm.loc[municipal_utm['componente_sre'], 'componente'].nunique()
+    n_conectados_rede = int(municipal_utm['componente_sre'].sum())
+    ext_conectada_rede = municipal_utm[municipal_utm['componente_sre']]['comprimento_m'].sum() / 1000
+    
+    print(f"  Nós do grafo: {n_nos:,}")
+    print(f"  Componentes conexos: {n_componentes:,} ({n_componentes_sre:,} tocam o SRE)")
+    print(f"  Maior componente: {int(tamanho_componente.max()) if len(componente) else 0:,} segmentos")
+    print(f"  Segmentos ligados ao SRE pela rede: {n_conectados_rede:,}")
+    print(f"  Extensão ligada ao SRE pela rede: {ext_conectada_rede:,.1f} km")
+    
+    # Distância de rede ao SRE: um Dijkstra multi-origem a partir dos nós ligados ao SRE
+    print("\nCalculando distância de rede até o SRE (Dijkstra multi-origem)...")
+    origens = np.flatnonzero(np.asarray(rede['no_sre']))
+    dist_nos = distancia_multiorigem(rede, origens, transitavel[rede['aresta_segmento']])
+    distancia_km = distancia_segmentos(rede, dist_nos)[posicao] / 1000
+    municipal_utm['distancia_sre_km'] = np.where(np.isfinite(distancia_km), distancia_km, np.nan)
+    
+    alcancaveis = municipal_utm['distancia_sre_km'].notna()
+    print(f"  Nós de origem (ligados ao SRE): {len(origens):,}")
+    print(f"  Segmentos que alcançam o SRE pela rede: {alcancaveis.sum():,}")
+    if alcancaveis.any():
+        p50, p90 = municipal_utm.loc[alcancaveis, 'distancia_sre_km'].quantile([0.5, 0.9])
+        print(f"  Distância mediana: {p50:,.2f} km | p90: {p90:,.2f} km")
     
     # Contar segmentos conectados vs desconectados por highway
     print("\n  Conectividade por tipo de highway:")
@@ -240,13 +327,38 @@ def analisar_conectividade(municipal, der):
         'conectados': n_conectados,
         'desconectados': n_desconectados,
         'ext_conectada_km': ext_conectada,
-        'ext_desconectada_km': ext_desconectada
+        'ext_desconectada_km': ext_desconectada,
+        'componentes': n_componentes,
+        'componentes_sre': n_componentes_sre,
+        'conectados_rede': n_conectados_rede,
+        'ext_conectada_rede_km': ext_conectada_rede,
+        'alcancam_sre': int(alcancaveis.sum()),
+        'distancias_municipio': distancias_por_municipio(municipal_utm) if MUNICIPIOS_SP.exists() else None
     }
 
 
+def _intersecoes_pares(geoms_a, geoms_b):
+    """Interseção par a par em lote; pares com erro de topologia ficam vazios"""
+    try:
+        return shapely.intersection(geoms_a, geoms_b)
+    except shapely.errors.GEOSException:
+        intersecoes = np.empty(len(geoms_a), dtype=object)
+        for k, (a, b) in enumerate(zip(geoms_a, geoms_b)):
+            try:
+                intersecoes[k] = a.intersection(b)
+            except Exception:
+                intersecoes[k] = shapely.Point()
+        return intersecoes
+
+
 def extrair_pontos_conexao(municipal, der):
     """
     Extrai os pontos onde a malha municipal se conecta ao SRE
+
+    Os pares candidatos (segmento municipal conectado x segmento SRE) saem de
+    uma consulta em lote na STRtree do SRE; as interseções de todos os pares
+    são calculadas de uma vez e explodidas em pontos, na mesma ordem
+    (municipal, SRE) e com os mesmos atributos do laço original.
     """
     log_section("ETAPA 3: EXTRAÇÃO DE PONTOS DE CONEXÃO")
     
@@ -260,38 +372,32 @@ def extrair_pontos_conexao(municipal, der):
     # Encontrar interseções
     print("Identificando pontos de conexão...")
     
-    pontos_conexao = []
-    
-    # Para cada segmento municipal conectado
+    # Segmentos municipais conectados
     municipais_conectados = municipal_utm[municipal_utm['conectado_sre'] == True]
-    
-    for idx, mun_row in municipais_conectados.iterrows():
-        for _, sre_row in sre.iterrows():
-            try:
-                intersecao = mun_row.geometry.intersection(sre_row.geometry)
-                if not intersecao.is_empty:
-                    # Extrair centroide da interseção como ponto de conexão
-                    if intersecao.geom_type == 'Point':
-                        pontos_conexao.append({
-                            'geometry': intersecao,
-                            'rodovia_sre': sre_row.get('Rodovia', 'N/A'),
-                            'highway_municipal': mun_row['highway']
-                        })
-                    elif intersecao.geom_type in ['MultiPoint', 'GeometryCollection']:
-                        for geom in intersecao.geoms:
-                            if geom.geom_type == 'Point':
-                                pontos_conexao.append({
-                                    'geometry': geom,
-                                    'rodovia_sre': sre_row.get('Rodovia', 'N/A'),
-                                    'highway_municipal': mun_row['highway']
-                                })
-            except:
-                continue
-    
-    print(f"  Pontos de conexão encontrados: {len(pontos_conexao):,}")
-    
-    if pontos_conexao:
-        pontos_gdf = gpd.GeoDataFrame(pontos_conexao, crs=municipal_utm.crs)
+    geoms_mun = np.asarray(municipais_conectados.geometry, dtype=object)
+    geoms_sre = np.asarray(sre.geometry, dtype=object)
+    
+    # Pares candidatos pela STRtree, ordenados como no laço (municipal, SRE)
+    idx_mun, idx_sre = STRtree(geoms_sre).query(geoms_mun, predicate='intersects')
+    ordem = np.lexsort((idx_sre, idx_mun))
+    idx_mun, idx_sre = idx_mun[ordem], idx_sre[ordem]
+    print(f"  Pares candidatos: {len(idx_mun):,}")
+    
+    # Interseções em lote, explodidas em pontos (Point, MultiPoint e GeometryCollection)
+    intersecoes = _intersecoes_pares(geoms_mun[idx_mun], geoms_sre[idx_sre])
+    partes, idx_par = shapely.get_parts(intersecoes, return_index=True)
+    eh_ponto = shapely.get_type_id(partes) == shapely.GeometryType.POINT
+    partes, idx_par = partes[eh_ponto], idx_par[eh_ponto]
+    
+    print(f"  Pontos de conexão encontrados: {len(partes):,}")
+    
+    if len(partes):
+        rodovias = sre['Rodovia'].to_numpy() if 'Rodovia' in sre.columns else np.full(len(sre), 'N/A', dtype=object)
+        pontos_gdf = gpd.GeoDataFrame({
+            'geometry': partes,
+            'rodovia_sre': rodovias[idx_sre[idx_par]],
+            'highway_municipal': municipais_conectados['highway'].to_numpy()[idx_mun[idx_par]],
+        }, crs=municipal_utm.crs)
         pontos_gdf = pontos_gdf.to_crs(epsg=4326)
         return pontos_gdf
     
@@ -305,7 +411,7 @@ def salvar_resultados(municipal_final, stats_conectividade, removidos):
     # Arquivo principal
     output_file = OUTPUT_DIR / 'malha_municipal_sp_refinada.gpkg'
     print(f"Salvando malha refinada: {output_file}")
-    municipal_final.to_file(output_file, driver='GPKG')
+    gravar_malha(municipal_final, output_file, driver='GPKG')
     
     # Separar conectados e desconectados
     conectados = municipal_final[municipal_final['conectado_sre'] == True]
@@ -316,10 +422,10 @@ def salvar_resultados(municipal_final, stats_conectividade, removidos):
     output_desconectados = INTERMEDIARIO_DIR / 'malha_municipal_desconectada_sre.gpkg'
     
     print(f"Salvando conectados: {output_conectados}")
-    conectados.to_file(output_conectados, driver='GPKG')
+    gravar_malha(conectados, output_conectados, driver='GPKG')
     
     print(f"Salvando desconectados: {output_desconectados}")
-    desconectados.to_file(output_desconectados, driver='GPKG')
+    gravar_malha(desconectados, output_desconectados, driver='GPKG')
     
     # Relatório
     relatorio_file = RELATORIO_DIR / 'relatorio_refinamento_conectividade.txt'
@@ -340,6 +446,14 @@ def salvar_resultados(municipal_final, stats_conectividade, removidos):
         f.write(f"Extensão conectada: {stats_conectividade['ext_conectada_km']:,.1f} km\n")
         f.write(f"Extensão desconectada: {stats_conectividade['ext_desconectada_km']:,.1f} km\n\n")
         
+        f.write("COMPONENTES DA REDE (snap de extremidades)\n")
+        f.write("-"*40 + "\n")
+        f.write(f"Componentes conexos: {stats_conectividade['componentes']:,}\n")
+        f.write(f"Componentes que tocam o SRE: {stats_conectividade['componentes_sre']:,}\n")
+        f.write(f"Segmentos ligados ao SRE pela rede: {stats_conectividade['conectados_rede']:,}\n")
+        f.write(f"Extensão ligada ao SRE pela rede: {stats_conectividade['ext_conectada_rede_km']:,.1f} km\n")
+        f.write(f"Segmentos que alcançam o SRE pela rede: {stats_conectividade['alcancam_sre']:,}\n\n")
+        
         f.write("DISTRIBUIÇÃO POR HIGHWAY\n")
         f.write("-"*40 + "\n")
         f.write(municipal_final['highway'].value_counts().to_string())
@@ -348,6 +462,13 @@ def salvar_resultados(municipal_final, stats_conectividade, removidos):
     
     print(f"Relatório salvo: {relatorio_file}")
     
+    # Distância de rede ao SRE por município
+    distancias = stats_conectividade['distancias_municipio']
+    if distancias is not None:
+        distancias_file = RELATORIO_DIR / 'distancia_sre_municipios.csv'
+        distancias.to_csv(distancias_file, index=False, encoding='utf-8')
+        print(f"Distâncias por município: {distancias_file}")
+    
     return output_file
 
 
@@ -367,7 +488,7 @@ def main():
     print(f"  Extensão: {municipal_subtraido['comprimento_m'].sum()/1000:,.1f} km")
     
     # 3. Analisar conectividade
-    municipal_conectividade, stats = analisar_conectividade(municipal_subtraido, der)
+    municipal_conectividade, stats = analisar_conectividade(municipal_subtraido, der, arquivo_municipal=MALHA_MUNICIPAL)
     
     # 4. Salvar resultados
     output = salvar_resultados(municipal_conectividade, stats, removidos)
@@ -5,17 +5,30 @@ Este script:
 1. Subtrai a malha do DER (Sistema Rodoviário Estadual) da base municipal
 2. Analisa a conectividade entre a malha municipal e o SRE
 
+Com --incremental DIFF.json reaproveita o resultado anterior e reprocessa só
+os segmentos adicionados, removidos e alterados (ver atualizar_incremental).
+
 Autor: Análise automatizada
 Data: Janeiro/2026
 """
 
+import argparse
+import json
 import geopandas as gpd
 import pandas as pd
 import numpy as np
 from pathlib import Path
 from datetime import datetime
-from shapely.geometry import Point, LineString, MultiLineString
-from shapely.ops import unary_union, nearest_points
+import shapely
+from shapely import STRtree
+from scipy.spatial import cKDTree
+from esquema_malha import ler_malha, gravar_malha, atualizar_gpkg
+from sobreposicao_der import carregar_buffer_der, calcular_proporcao_sobreposta
+from grafo_malha import (
+    TOLERANCIA_SNAP_M, extrair_extremidades, agrupar_pontos, construir_rede, marcar_nos_sre,
+    salvar_rede, carregar_rede, componentes_nos, componente_dos_segmentos, atualizar_rede,
+    atualizar_componentes
+)
 import warnings
 warnings.filterwarnings('ignore')
 
@@ -32,6 +45,19 @@ BUFFER_SUBTRACAO_M = 15  # 15 metros para capturar sobreposições
 # Tolerância para conectividade (em metros)
 TOLERANCIA_CONEXAO_M = 50  # 50 metros para considerar conectado
 
+# Raio para agrupar pontos de conexão duplicados (em metros)
+RAIO_CLUSTER_M = 10
+
+# Limiar de remoção por sobreposição com o DER (%)
+LIMIAR_REMOCAO = 70
+
+# Grafo da malha refinada e componentes por nó (para o modo incremental)
+ESTADO_CONECTIVIDADE = INTERMEDIARIO_DIR / 'conectividade_refinada.npz'
+
+# Extremidades de conexão antes do agrupamento, com o cluster de cada uma
+# (para o modo incremental reagrupar só em volta dos segmentos editados)
+ESTADO_PONTOS_CONEXAO = INTERMEDIARIO_DIR / 'extremidades_conexao_sre.parquet'
+
 
 def carregar_dados():
     """Carrega as duas bases de dados"""
@@ -40,7 +66,10 @@ def carregar_dados():
     print("=" * 60)
     
     print(f"\nCarregando malha municipal: {INPUT_MALHA_MUNICIPAL}")
-    municipal = gpd.read_file(INPUT_MALHA_MUNICIPAL)
+    municipal = ler_malha(INPUT_MALHA_MUNICIPAL, fid_as_index=True)
+    # fid do GeoPackage: id estável do segmento entre edições
+    municipal['id_segmento'] = municipal.index.to_numpy()
+    municipal = municipal.reset_index(drop=True)
     print(f"  Registros: {len(municipal):,}")
     print(f"  CRS: {municipal.crs}")
     
@@ -77,29 +106,17 @@ def subtrair_malha_der(municipal, der):
     
     print(f"\nMalha municipal inicial: {total_inicial:,} segmentos ({ext_inicial:,.1f} km)")
     
-    # Criar buffer ao redor da malha DER
-    print(f"\nCriando buffer de {BUFFER_SUBTRACAO_M}m ao redor da malha DER...")
-    der_buffer = der.geometry.buffer(BUFFER_SUBTRACAO_M)
-    der_union = unary_union(der_buffer)
-    print("  Buffer criado!")
+    # Buffer ao redor da malha DER (cache em disco)
+    print(f"\nObtendo buffer de {BUFFER_SUBTRACAO_M}m ao redor da malha DER...")
+    _, buffers = carregar_buffer_der(der, INPUT_MALHA_DER, BUFFER_SUBTRACAO_M)
+    arvore = STRtree(buffers)
+    print("  Buffer pronto!")
     
-    # Identificar segmentos municipais que intersectam o buffer do DER
+    # Calcular quanto de cada segmento está dentro do buffer DER (%)
     print("\nIdentificando sobreposições...")
-    
-    # Calcular quanto de cada segmento está dentro do buffer
-    def calcular_sobreposicao(geom):
-        """Calcula a porcentagem do segmento dentro do buffer DER"""
-        try:
-            if geom is None or geom.is_empty:
-                return 0.0
-            intersecao = geom.intersection(der_union)
-            if intersecao.is_empty:
-                return 0.0
-            return intersecao.length / geom.length * 100
-        except:
-            return 0.0
-    
-    municipal['pct_sobreposicao_der'] = municipal.geometry.apply(calcular_sobreposicao)
+    municipal['pct_sobreposicao_der'] = 100 * calcular_proporcao_sobreposta(
+        municipal.geometry, buffers, arvore
+    )
     
     # Estatísticas de sobreposição
     print(f"\nDistribuição de sobreposição com DER:")
@@ -108,9 +125,7 @@ def subtrair_malha_der(municipal, der):
     print(f"  51-99%: {((municipal['pct_sobreposicao_der'] > 50) & (municipal['pct_sobreposicao_der'] < 100)).sum():,} segmentos")
     print(f"  100%: {(municipal['pct_sobreposicao_der'] == 100).sum():,} segmentos")
     
-    # Remover segmentos com mais de 70% de sobreposição
-    LIMIAR_REMOCAO = 70  # Remover se mais de 70% está sobreposto ao DER
-    
+    # Remover segmentos com mais de LIMIAR_REMOCAO% de sobreposição
     mask_manter = municipal['pct_sobreposicao_der'] < LIMIAR_REMOCAO
     municipal_filtrado = municipal[mask_manter].copy()
     
@@ -131,6 +146,20 @@ def subtrair_malha_der(municipal, der):
     return municipal_filtrado, removidos
 
 
+def extremidades_conectadas(geoms, der_union):
+    """Segmentos com algum ponto extremo (de qualquer parte) dentro do buffer do SRE"""
+    inicio, fim, segmento = extrair_extremidades(geoms)
+    dentro = shapely.within(shapely.points(np.vstack([inicio, fim])), der_union)
+    conectado = np.zeros(len(geoms), dtype=bool)
+    conectado[np.concatenate([segmento, segmento])[dentro]] = True
+    return conectado
+
+
+def classificar_status(conectado):
+    """Coluna status_conexao a partir da conexão pelos pontos extremos"""
+    return pd.Series(conectado).map({True: 'conectado_sre', False: 'nao_conectado'}).to_numpy()
+
+
 def analisar_conectividade(municipal, der):
     """
     Analisa a conectividade entre a malha municipal e o SRE (DER).
@@ -144,37 +173,13 @@ def analisar_conectividade(municipal, der):
     print("ETAPA 2: ANÁLISE DE CONECTIVIDADE COM SRE")
     print("=" * 60)
     
-    # Criar buffer de conexão ao redor do DER
-    print(f"\nCriando buffer de conexão ({TOLERANCIA_CONEXAO_M}m) ao redor do SRE...")
-    der_buffer_conexao = der.geometry.buffer(TOLERANCIA_CONEXAO_M)
-    der_union_conexao = unary_union(der_buffer_conexao)
-    
-    # Extrair pontos extremos (início e fim) de cada segmento municipal
-    print("Extraindo pontos extremos dos segmentos municipais...")
-    
-    def get_endpoints(geom):
-        """Retorna os pontos de início e fim de uma linha"""
-        if isinstance(geom, LineString):
-            return [Point(geom.coords[0]), Point(geom.coords[-1])]
-        elif isinstance(geom, MultiLineString):
-            points = []
-            for line in geom.geoms:
-                points.append(Point(line.coords[0]))
-                points.append(Point(line.coords[-1]))
-            return points
-        return []
-    
-    # Verificar conexão de cada segmento
-    def verifica_conexao_sre(geom):
-        """Verifica se algum ponto extremo toca o buffer do SRE"""
-        endpoints = get_endpoints(geom)
-        for pt in endpoints:
-            if pt.within(der_union_conexao):
-                return True
-        return False
-    
-    print("Verificando conexões...")
-    municipal['conectado_sre'] = municipal.geometry.apply(verifica_conexao_sre)
+    # Buffer de conexão ao redor do DER (cache em disco)
+    print(f"\nObtendo buffer de conexão ({TOLERANCIA_CONEXAO_M}m) ao redor do SRE...")
+    der_union_conexao, _ = carregar_buffer_der(der, INPUT_MALHA_DER, TOLERANCIA_CONEXAO_M)
+    
+    # Pontos extremos (início e fim) de cada segmento dentro do buffer
+    print("Verificando conexões pelos pontos extremos...")
+    municipal['conectado_sre'] = extremidades_conectadas(municipal.geometry, der_union_conexao)
     
     # Estatísticas de conectividade
     conectados = municipal['conectado_sre'].sum()
@@ -187,10 +192,7 @@ def analisar_conectividade(municipal, der):
     print(f"Segmentos não conectados: {nao_conectados:,} ({100*nao_conectados/len(municipal):.1f}%)")
     
     # Criar coluna de classificação
-    municipal['status_conexao'] = municipal['conectado_sre'].map({
-        True: 'conectado_sre',
-        False: 'nao_conectado'
-    })
+    municipal['status_conexao'] = classificar_status(municipal['conectado_sre'].to_numpy())
     
     # Análise por tipo de highway
     print(f"\nConectividade por tipo de highway:")
@@ -202,10 +204,74 @@ def analisar_conectividade(municipal, der):
     return municipal
 
 
+def rotular_componentes(municipal, rede, rotulo_no):
+    """Colunas componente e componente_sre (componente com nó a até TOLERANCIA_CONEXAO_M do DER)"""
+    componente = componente_dos_segmentos(rede, rotulo_no)
+    posicao = pd.Index(rede['segmento_id']).get_indexer(municipal['id_segmento'])
+    municipal['componente'] = componente[posicao]
+    componentes_sre = np.unique(rotulo_no[np.asarray(rede['no_sre'])])
+    municipal['componente_sre'] = np.isin(municipal['componente'], componentes_sre)
+    return municipal
+
+
+def analisar_componentes(municipal, der):
+    """
+    Componentes conexos da malha refinada
+
+    Grava o grafo e o componente de cada nó em ESTADO_CONECTIVIDADE, para o
+    modo incremental atualizar só o que muda.
+    """
+    print("\n" + "=" * 60)
+    print("ETAPA 2b: COMPONENTES DA MALHA REFINADA")
+    print("=" * 60)
+    
+    rede = construir_rede(municipal.geometry, TOLERANCIA_SNAP_M, classe=municipal['highway'],
+                          segmento_id=municipal['id_segmento'], crs=str(municipal.crs))
+    marcar_nos_sre(rede, der.geometry, TOLERANCIA_CONEXAO_M)
+    rede['no_componente'] = componentes_nos(rede)
+    municipal = rotular_componentes(municipal, rede, rede['no_componente'])
+    
+    print(f"Componentes: {municipal['componente'].nunique():,} "
+          f"({municipal.loc[municipal['componente_sre'], 'componente'].nunique():,} tocam o DER)")
+    print(f"Segmentos em componentes ligados ao DER: {municipal['componente_sre'].sum():,}")
+    
+    salvar_rede(rede, ESTADO_CONECTIVIDADE)
+    print(f"Estado: {ESTADO_CONECTIVIDADE}")
+    
+    return municipal
+
+
+def extremidades_conexao(conectados, der_union):
+    """Extremidades (início e fim de cada parte) dos segmentos dentro do buffer do SRE"""
+    inicio, fim, segmento = extrair_extremidades(conectados.geometry)
+    xy = np.stack([inicio, fim], axis=1).reshape(-1, 2)
+    segmento = np.repeat(segmento, 2)
+    
+    dentro = shapely.within(shapely.points(xy), der_union)
+    xy, segmento = xy[dentro], segmento[dentro]
+    
+    nomes = conectados['name'].to_numpy() if 'name' in conectados.columns else np.full(len(conectados), '', dtype=object)
+    return gpd.GeoDataFrame({
+        'geometry': shapely.points(xy),
+        'highway_origem': conectados['highway'].to_numpy()[segmento],
+        'nome_origem': nomes[segmento],
+        'id_segmento': conectados['id_segmento'].to_numpy()[segmento],
+    }, crs=conectados.crs)
+
+
+def pontos_por_cluster(extremidades):
+    """Um ponto por cluster (a primeira extremidade de cada um)"""
+    pontos = extremidades.groupby('cluster', sort=False).first().reset_index()
+    return gpd.GeoDataFrame(pontos, geometry='geometry', crs=extremidades.crs)
+
+
 def identificar_pontos_conexao(municipal, der):
     """
     Identifica os pontos de conexão entre a malha municipal e o SRE.
     Gera um arquivo de pontos para visualização.
+    
+    As extremidades antes do agrupamento (com o cluster de cada uma) são
+    gravadas em ESTADO_PONTOS_CONEXAO para o modo incremental.
     """
     print("\n" + "=" * 60)
     print("ETAPA 3: IDENTIFICAÇÃO DE PONTOS DE CONEXÃO")
@@ -216,59 +282,22 @@ def identificar_pontos_conexao(municipal, der):
     
     print(f"Analisando {len(conectados):,} segmentos conectados...")
     
-    # Buffer do DER
-    der_buffer = der.geometry.buffer(TOLERANCIA_CONEXAO_M)
-    der_union = unary_union(der_buffer)
-    
-    # Extrair pontos de conexão
-    pontos_conexao = []
-    
-    def get_endpoints(geom):
-        if isinstance(geom, LineString):
-            return [Point(geom.coords[0]), Point(geom.coords[-1])]
-        elif isinstance(geom, MultiLineString):
-            points = []
-            for line in geom.geoms:
-                points.append(Point(line.coords[0]))
-                points.append(Point(line.coords[-1]))
-            return points
-        return []
-    
-    for idx, row in conectados.iterrows():
-        endpoints = get_endpoints(row.geometry)
-        for pt in endpoints:
-            if pt.within(der_union):
-                pontos_conexao.append({
-                    'geometry': pt,
-                    'highway_origem': row['highway'],
-                    'nome_origem': row.get('name', '')
-                })
-    
-    # Criar GeoDataFrame de pontos
-    if pontos_conexao:
-        gdf_pontos = gpd.GeoDataFrame(pontos_conexao, crs=municipal.crs)
-        
-        # Remover pontos duplicados (muito próximos)
-        print(f"Pontos de conexão brutos: {len(gdf_pontos):,}")
-        
-        # Agrupar pontos muito próximos (buffer de 10m)
-        gdf_pontos['cluster'] = -1
-        cluster_id = 0
-        
-        for i, row in gdf_pontos.iterrows():
-            if gdf_pontos.loc[i, 'cluster'] == -1:
-                # Encontrar pontos próximos
-                buffer_pt = row.geometry.buffer(10)
-                proximos = gdf_pontos[gdf_pontos.geometry.within(buffer_pt)].index
-                gdf_pontos.loc[proximos, 'cluster'] = cluster_id
-                cluster_id += 1
-        
+    # Buffer do DER (cache em disco)
+    der_union, _ = carregar_buffer_der(der, INPUT_MALHA_DER, TOLERANCIA_CONEXAO_M)
+    
+    # Extremidades de cada parte dentro do buffer do SRE
+    extremidades = extremidades_conexao(conectados, der_union)
+    print(f"Pontos de conexão brutos: {len(extremidades):,}")
+    
+    # Agrupar pontos a até RAIO_CLUSTER_M (cKDTree + componentes conexos);
+    # ids de cluster na ordem do primeiro ponto de cada grupo
+    extremidades['cluster'] = agrupar_pontos(shapely.get_coordinates(extremidades.geometry), RAIO_CLUSTER_M)
+    gravar_malha(extremidades, ESTADO_PONTOS_CONEXAO)
+    
+    if len(extremidades):
         # Pegar um ponto por cluster
-        gdf_pontos_unicos = gdf_pontos.groupby('cluster').first().reset_index()
-        gdf_pontos_unicos = gpd.GeoDataFrame(gdf_pontos_unicos, crs=municipal.crs)
-        
+        gdf_pontos_unicos = pontos_por_cluster(extremidades)
         print(f"Pontos de conexão únicos: {len(gdf_pontos_unicos):,}")
-        
         return gdf_pontos_unicos
     
     return gpd.GeoDataFrame(columns=['geometry'], crs=municipal.crs)
@@ -289,24 +318,22 @@ def salvar_resultados(municipal, pontos_conexao, der, removidos):
     arquivo_municipal = OUTPUT_DIR / 'malha_municipal_sp_refinada.gpkg'
     print(f"\nSalvando malha refinada: {arquivo_municipal}")
     # Remover colunas de análise para o arquivo final
-    colunas_saida = ['name', 'highway', 'ref', 'other_tags', 'comprimento_m', 'status_conexao', 'geometry']
-    municipal_saida[[c for c in colunas_saida if c in municipal_saida.columns]].to_file(
-        arquivo_municipal, driver='GPKG'
-    )
+    colunas_saida = ['id_segmento', 'name', 'highway', 'ref', 'other_tags', 'comprimento_m', 'status_conexao',
+                     'componente', 'componente_sre', 'geometry']
+    gravar_malha(municipal_saida[[c for c in colunas_saida if c in municipal_saida.columns]],
+                 arquivo_municipal, driver='GPKG')
     
     # 2. Segmentos conectados ao SRE
     arquivo_conectados = INTERMEDIARIO_DIR / 'segmentos_conectados_sre.gpkg'
     print(f"Salvando segmentos conectados: {arquivo_conectados}")
-    municipal_saida[municipal_saida['status_conexao'] == 'conectado_sre'].to_file(
-        arquivo_conectados, driver='GPKG'
-    )
+    gravar_malha(municipal_saida[municipal_saida['status_conexao'] == 'conectado_sre'],
+                 arquivo_conectados, driver='GPKG')
     
     # 3. Segmentos NÃO conectados (para análise)
     arquivo_nao_conectados = INTERMEDIARIO_DIR / 'segmentos_nao_conectados.gpkg'
     print(f"Salvando segmentos não conectados: {arquivo_nao_conectados}")
-    municipal_saida[municipal_saida['status_conexao'] == 'nao_conectado'].to_file(
-        arquivo_nao_conectados, driver='GPKG'
-    )
+    gravar_malha(municipal_saida[municipal_saida['status_conexao'] == 'nao_conectado'],
+                 arquivo_nao_conectados, driver='GPKG')
     
     # 4. Pontos de conexão
     if len(pontos_saida) > 0:
@@ -358,6 +385,189 @@ def salvar_resultados(municipal, pontos_conexao, der, removidos):
     print("\n✅ Resultados salvos!")
 
 
+def _atualizar_saida(arquivo, saem, componentes, novos):
+    """
+    Aplica a edição a uma camada de segmentos de saída
+
+    Lê só os atributos da camada para achar as linhas dos segmentos que saem
+    e as de componente alterado; estas são relidas por fid (com geometria),
+    trocadas, e as novas acrescentadas. Retorna o número de linhas com
+    componente alterado.
+    """
+    atual = gpd.read_file(arquivo, columns=['id_segmento', 'componente', 'componente_sre'],
+                          read_geometry=False, fid_as_index=True)
+    sai = atual['id_segmento'].isin(saem).to_numpy()
+    depois = componentes.reindex(atual['id_segmento'])
+    mudou = ~sai & ((atual['componente'].to_numpy() != depois['componente'].to_numpy()) |
+                    (atual['componente_sre'].to_numpy() != depois['componente_sre'].to_numpy()))
+    
+    trocadas = ler_malha(arquivo, fid_as_index=True, fids=atual.index[mudou].tolist()).reset_index(drop=True)
+    posicao = componentes.index.get_indexer(trocadas['id_segmento'])
+    trocadas['componente'] = componentes['componente'].to_numpy()[posicao]
+    trocadas['componente_sre'] = componentes['componente_sre'].to_numpy()[posicao]
+    
+    novas = pd.concat([trocadas, novos.to_crs(trocadas.crs)], ignore_index=True)
+    atualizar_gpkg(arquivo, atual.index[sai | mudou], gpd.GeoDataFrame(novas, geometry='geometry', crs=trocadas.crs))
+    return mudou.sum()
+
+
+def reagrupar_extremidades(extremidades, saem, entram):
+    """
+    Tira as extremidades dos segmentos que saem, inclui as novas e refaz só os clusters afetados
+
+    Afetados são os clusters das extremidades que saem e os com alguma
+    extremidade a até RAIO_CLUSTER_M de uma extremidade que sai ou entra
+    (só eles podem ser divididos ou unidos). Os demais mantêm id e ponto
+    representativo; os refeitos recebem ids novos, após o maior existente.
+    Retorna (extremidades, clusters_afetados, extremidades_reagrupadas).
+    """
+    sai = extremidades['id_segmento'].isin(saem).to_numpy()
+    cluster = extremidades['cluster'].to_numpy()
+    afetados = np.unique(cluster[sai])
+    
+    xy = shapely.get_coordinates(extremidades.geometry)
+    tocados = np.vstack([xy[sai], shapely.get_coordinates(entram.geometry)])
+    if len(tocados) and len(xy):
+        vizinhos = cKDTree(xy).query_ball_point(tocados, RAIO_CLUSTER_M)
+        vizinhos = np.concatenate([np.asarray(v, dtype=np.int64) for v in vizinhos])
+        afetados = np.union1d(afetados, cluster[vizinhos])
+    
+    refazer = np.isin(cluster, afetados)
+    locais = pd.concat([extremidades[refazer & ~sai], entram.to_crs(extremidades.crs)], ignore_index=True)
+    proximo = cluster.max() + 1 if len(cluster) else 0
+    locais['cluster'] = proximo + agrupar_pontos(shapely.get_coordinates(locais.geometry), RAIO_CLUSTER_M)
+    locais = gpd.GeoDataFrame(locais, geometry='geometry', crs=extremidades.crs)
+    
+    extremidades = gpd.GeoDataFrame(pd.concat([extremidades[~refazer], locais], ignore_index=True),
+                                    geometry='geometry', crs=extremidades.crs)
+    return extremidades, afetados, locais
+
+
+def atualizar_incremental(arquivo_diff):
+    """
+    Reprocessa só os segmentos editados na malha municipal
+
+    O diff é um JSON com listas de fids de malha_municipal_sp.gpkg:
+    'adicionados', 'removidos' e 'alterados'. Usa os buffers do DER em cache
+    (sem refazer uniões), o grafo e os componentes gravados em
+    ESTADO_CONECTIVIDADE, as extremidades de conexão em ESTADO_PONTOS_CONEXAO
+    e as saídas da última execução completa:
+
+    1. Subtração DER e status_conexao só dos segmentos adicionados/alterados
+    2. Grafo atualizado localmente (atualizar_rede) e componentes por
+       union-find nas inserções e recálculo local nas remoções
+    3. Nas saídas, só mudam as linhas editadas e as de componentes afetados
+       (atualizadas no lugar nos GeoPackages, sem lê-los nem regravá-los
+       inteiros); os pontos de conexão são reagrupados só a até
+       RAIO_CLUSTER_M das extremidades editadas
+    """
+    print("=" * 60)
+    print("REFINAMENTO DA MALHA MUNICIPAL (INCREMENTAL)")
+    print("=" * 60)
+    
+    with open(arquivo_diff, 'r', encoding='utf-8') as f:
+        diff = json.load(f)
+    adicionados = np.asarray(diff.get('adicionados', []), dtype=np.int64)
+    removidos = np.asarray(diff.get('removidos', []), dtype=np.int64)
+    alterados = np.asarray(diff.get('alterados', []), dtype=np.int64)
+    print(f"\nDiff: {arquivo_diff}")
+    print(f"  Adicionados: {len(adicionados):,} | removidos: {len(removidos):,} | alterados: {len(alterados):,}")
+    
+    for estado in (ESTADO_CONECTIVIDADE, ESTADO_PONTOS_CONEXAO):
+        if not estado.exists():
+            raise FileNotFoundError(
+                f"Estado não encontrado: {estado}\n"
+                "Rode refinar_subtrair_der.py sem --incremental uma vez antes."
+            )
+    
+    # Segmentos editados (só as linhas do diff) e malha DER
+    editados = np.concatenate([adicionados, alterados])
+    print(f"\nCarregando segmentos editados: {INPUT_MALHA_MUNICIPAL}")
+    novos = ler_malha(INPUT_MALHA_MUNICIPAL, fid_as_index=True, fids=editados.tolist())
+    novos['id_segmento'] = novos.index.to_numpy()
+    # comprimento_m vem da malha de entrada, como na execução completa
+    novos = novos.reset_index(drop=True).to_crs('EPSG:31983')
+    print(f"  Lidos: {len(novos):,}")
+    
+    der = gpd.read_file(INPUT_MALHA_DER).to_crs('EPSG:31983')
+    
+    # 1. Subtração DER e status dos editados (buffers em cache)
+    print("\nSubtração DER dos segmentos editados...")
+    _, buffers = carregar_buffer_der(der, INPUT_MALHA_DER, BUFFER_SUBTRACAO_M)
+    pct = 100 * calcular_proporcao_sobreposta(novos.geometry, buffers, STRtree(buffers))
+    sobrepostos = novos.loc[pct >= LIMIAR_REMOCAO, 'id_segmento'].to_numpy()
+    novos = novos[pct < LIMIAR_REMOCAO].reset_index(drop=True)
+    print(f"  Removidos por sobreposição: {len(sobrepostos):,} | mantidos: {len(novos):,}")
+    
+    der_union_conexao, _ = carregar_buffer_der(der, INPUT_MALHA_DER, TOLERANCIA_CONEXAO_M)
+    novos['conectado_sre'] = extremidades_conectadas(novos.geometry, der_union_conexao)
+    novos['status_conexao'] = classificar_status(novos['conectado_sre'].to_numpy())
+    
+    # 2. Grafo e componentes
+    print(f"\nAtualizando grafo: {ESTADO_CONECTIVIDADE}")
+    rede = carregar_rede(ESTADO_CONECTIVIDADE, mmap=False)
+    saem = np.concatenate([removidos, alterados])
+    rede, nos_perdidos, arestas_novas = atualizar_rede(
+        rede, saem, novos.geometry, novos['id_segmento'], TOLERANCIA_SNAP_M,
+        sre_geoms=der.geometry, tolerancia_sre=TOLERANCIA_CONEXAO_M, classe=novos['highway']
+    )
+    rotulo_antigo = rede['no_componente']
+    rede['no_componente'] = atualizar_componentes(rede, rotulo_antigo, nos_perdidos, arestas_novas)
+    n_mudaram = (rede['no_componente'][:len(rotulo_antigo)] != rotulo_antigo).sum()
+    print(f"  Arestas removidas/inseridas: {len(nos_perdidos):,} nós tocados / {len(arestas_novas):,} arestas")
+    print(f"  Nós com componente alterado: {n_mudaram:,}")
+    salvar_rede(rede, ESTADO_CONECTIVIDADE)
+    
+    # 3. Saídas: atualizadas no lugar (só as linhas editadas e as de componente alterado)
+    ativos = np.asarray(rede['segmento_ativo'])
+    componentes = rotular_componentes(
+        pd.DataFrame({'id_segmento': np.asarray(rede['segmento_id'])[ativos]}), rede, rede['no_componente']
+    ).set_index('id_segmento')
+    posicao = componentes.index.get_indexer(novos['id_segmento'])
+    novos['componente'] = componentes['componente'].to_numpy()[posicao]
+    novos['componente_sre'] = componentes['componente_sre'].to_numpy()[posicao]
+    
+    print()
+    arquivo_municipal = OUTPUT_DIR / 'malha_municipal_sp_refinada.gpkg'
+    afetadas = _atualizar_saida(arquivo_municipal, saem, componentes, novos)
+    print(f"  Linhas com componente atualizado: {afetadas:,}")
+    for status, arquivo in [('conectado_sre', INTERMEDIARIO_DIR / 'segmentos_conectados_sre.gpkg'),
+                            ('nao_conectado', INTERMEDIARIO_DIR / 'segmentos_nao_conectados.gpkg')]:
+        _atualizar_saida(arquivo, saem, componentes, novos[novos['status_conexao'] == status])
+    
+    # Pontos de conexão: reagrupar só em volta das extremidades que saem/entram
+    print(f"\nReagrupando pontos de conexão: {ESTADO_PONTOS_CONEXAO}")
+    extremidades = ler_malha(ESTADO_PONTOS_CONEXAO)
+    entram = extremidades_conexao(novos[novos['conectado_sre']], der_union_conexao)
+    extremidades, afetados, locais = reagrupar_extremidades(extremidades, saem, entram)
+    gravar_malha(extremidades, ESTADO_PONTOS_CONEXAO)
+    print(f"  Clusters refeitos: {len(afetados):,} -> {locais['cluster'].nunique():,}")
+    
+    arquivo_pontos = OUTPUT_DIR / 'pontos_conexao_sre.gpkg'
+    pontos_novos = pontos_por_cluster(locais).to_crs('EPSG:4326')
+    if arquivo_pontos.exists():
+        atual = gpd.read_file(arquivo_pontos, columns=['cluster'], read_geometry=False, fid_as_index=True)
+        atualizar_gpkg(arquivo_pontos, atual.index[atual['cluster'].isin(afetados)], pontos_novos)
+    elif len(pontos_novos):
+        pontos_novos.to_file(arquivo_pontos, driver='GPKG')
+    
+    # Resumo
+    print("\n" + "=" * 60)
+    print("RESUMO DA ATUALIZAÇÃO")
+    print("=" * 60)
+    municipal = gpd.read_file(arquivo_municipal, columns=['id_segmento', 'status_conexao', 'componente'],
+                              read_geometry=False)
+    conectados = (municipal['status_conexao'] == 'conectado_sre').sum()
+    print(f"Segmentos reprocessados: {len(editados):,} (removidos por sobreposição: {len(sobrepostos):,})")
+    print(f"Segmentos na malha refinada: {len(municipal):,}")
+    print(f"Conectados ao SRE: {conectados:,} ({100*conectados/max(len(municipal), 1):.1f}%)")
+    print(f"Componentes: {municipal['componente'].nunique():,}")
+    print(f"Pontos de conexão: {extremidades['cluster'].nunique():,}")
+    print("\n✅ Atualização incremental concluída!")
+    
+    return municipal, pontos_por_cluster(extremidades)
+
+
 def main():
     print("=" * 60)
     print("REFINAMENTO DA MALHA MUNICIPAL")
@@ -373,6 +583,9 @@ def main():
     # Etapa 2: Analisar conectividade
     municipal_conectividade = analisar_conectividade(municipal_refinado, der)
     
+    # Etapa 2b: Componentes conexos (estado para o modo incremental)
+    municipal_conectividade = analisar_componentes(municipal_conectividade, der)
+    
     # Etapa 3: Identificar pontos de conexão
     pontos_conexao = identificar_pontos_conexao(municipal_conectividade, der)
     
@@ -393,4 +606,12 @@ def main():
 
 
 if __name__ == "__main__":
-    resultado, pontos = main()
+    parser = argparse.ArgumentParser(description="Refinamento da malha municipal (subtração DER + conectividade)")
+    parser.add_argument('--incremental', metavar='DIFF_JSON',
+                        help="JSON com 'adicionados', 'removidos' e 'alterados' (fids da malha municipal)")
+    args = parser.parse_args()
+    
+    if args.incremental:
+        resultado, pontos = atualizar_incremental(args.incremental)
+    else:
+        resultado, pontos = main()
@@ -0,0 +1,390 @@
+"""
+Motor de sobreposição entre a malha OSM e a malha do DER
+
+Calcula, para cada via, a proporção do comprimento que fica dentro do
+buffer da malha DER. Em vez de uma única unary_union do buffer, indexa os
+buffers individuais em uma STRtree (Shapely 2) e calcula as interseções
+em lote, apenas para os pares candidatos.
+
+O buffer unido da malha DER (unary_union) também fica em cache em disco,
+indexado pelo hash do shapefile de origem e pelos parâmetros do buffer.
+
+O mesmo motor serve a outros polígonos (ex.: áreas urbanas IBGE) via
+preparar_poligonos + calcular_proporcao_em_poligonos.
+
+Autor: Análise automatizada
+Data: Janeiro/2026
+"""
+
+import hashlib
+import json
+import os
+from concurrent.futures import ProcessPoolExecutor
+from pathlib import Path
+
+import numpy as np
+import shapely
+from shapely import STRtree
+
+# Jurisdições consideradas como Sistema Rodoviário Estadual (SRE)
+JURISDICOES_SRE = ['Estadual', 'Federal']
+
+# Tamanho dos tiles do modo particionado (em metros, grade de 50 km)
+TAMANHO_TILE_M = 50_000
+
+# Cache do buffer unido da malha DER
+CACHE_DIR = Path(r'D:\ESTUDO_VICINAIS_V2\resultados\cache\buffer_der')
+VERSAO_CACHE = 1
+
+# Máximo de vértices por parte na decomposição do buffer unido
+MAX_VERTICES_PARTE = 2000
+
+# Arquivos que compõem o shapefile (entram no hash de conteúdo)
+EXTENSOES_SHAPEFILE = ['.shp', '.shx', '.dbf', '.prj', '.cpg']
+
+
+def filtrar_sre(der):
+    """Filtra apenas rodovias estaduais e federais do DER"""
+    return der[der['Jurisdicao'].isin(JURISDICOES_SRE)]
+
+
+def criar_buffers_der(der_geoms, buffer_m):
+    """
+    Cria os buffers individuais dos segmentos DER e a STRtree sobre eles
+
+    Retorna (buffers, arvore), onde buffers é um array de polígonos
+    na mesma ordem dos segmentos de entrada.
+    """
+    geoms = np.asarray(der_geoms, dtype=object)
+    geoms = geoms[~shapely.is_missing(geoms) & ~shapely.is_empty(geoms)]
+    buffers = shapely.buffer(geoms, buffer_m)
+    return buffers, STRtree(buffers)
+
+
+def calcular_proporcao_sobreposta(linhas, buffers, arvore=None):
+    """
+    Calcula a proporção (0-1) de cada linha dentro da união dos buffers
+
+    Equivale a linha.intersection(unary_union(buffers)).length / linha.length,
+    sem construir a união: os pares candidatos vêm de uma consulta em lote
+    na STRtree e cada linha é recortada pelos seus buffers com
+    shapely.difference vetorizado (uma rodada por candidato). O trecho
+    sobreposto é o comprimento original menos o que sobra fora dos buffers,
+    o que evita contar duas vezes onde buffers vizinhos se sobrepõem.
+
+    Retorna um np.ndarray de float na mesma ordem de `linhas`.
+    Linhas nulas, vazias ou de comprimento zero recebem 0.
+    """
+    linhas = np.asarray(linhas, dtype=object)
+    proporcao = np.zeros(len(linhas), dtype=float)
+
+    if len(linhas) == 0 or len(buffers) == 0:
+        return proporcao
+
+    if arvore is None:
+        arvore = STRtree(buffers)
+
+    # Pares (linha, buffer) que realmente se intersectam
+    idx_linha, idx_buffer = arvore.query(linhas, predicate='intersects')
+    return _proporcao_por_pares(linhas, buffers, idx_linha, idx_buffer)
+
+
+def _proporcao_por_pares(linhas, buffers, idx_linha, idx_buffer):
+    """
+    Recorta cada linha pelos buffers dos seus pares candidatos
+
+    Núcleo de calcular_proporcao_sobreposta: recebe os pares (linha, buffer)
+    já consultados e devolve a proporção sobreposta de cada linha.
+    """
+    proporcao = np.zeros(len(linhas), dtype=float)
+    if len(idx_linha) == 0:
+        return proporcao
+
+    # Agrupar os pares por linha, em ordem de buffer
+    ordem = np.lexsort((idx_buffer, idx_linha))
+    idx_linha = idx_linha[ordem]
+    idx_buffer = idx_buffer[ordem]
+
+    linhas_cand, inicio, contagem = np.unique(idx_linha, return_index=True, return_counts=True)
+    posicao = np.repeat(np.arange(len(linhas_cand)), contagem)
+    rodada = np.arange(len(idx_linha)) - np.repeat(inicio, contagem)
+
+    # Recortar cada linha pelos seus buffers, um candidato por rodada
+    restante = linhas[linhas_cand].copy()
+    for r in range(contagem.max()):
+        sel = rodada == r
+        restante[posicao[sel]] = shapely.difference(
+            restante[posicao[sel]], buffers[idx_buffer[sel]]
+        )
+
+    comprimento = shapely.length(linhas[linhas_cand])
+    sobreposto = comprimento - shapely.length(restante)
+    valido = comprimento > 0
+    proporcao[linhas_cand[valido]] = sobreposto[valido] / comprimento[valido]
+
+    return np.nan_to_num(proporcao, nan=0.0)
+
+
+def calcular_sobreposicao_multibuffer(linhas, der_geoms, buffers_m):
+    """
+    Calcula a proporção sobreposta para várias distâncias de buffer de uma vez
+
+    Uma única consulta na STRtree das linhas DER (predicado dwithin com a
+    maior distância) e um único cálculo vetorizado de distância servem a
+    todas as distâncias: para cada buffer, só os pares com distância <= d
+    são recortados.
+
+    Retorna um dict {buffer_m: np.ndarray de proporções}.
+    """
+    linhas = np.asarray(linhas, dtype=object)
+    geoms = np.asarray(der_geoms, dtype=object)
+    geoms = geoms[~shapely.is_missing(geoms) & ~shapely.is_empty(geoms)]
+    buffers_m = sorted(buffers_m)
+
+    arvore = STRtree(geoms)
+    idx_linha, idx_der = arvore.query(linhas, predicate='dwithin', distance=max(buffers_m))
+    distancia = shapely.distance(linhas[idx_linha], geoms[idx_der])
+    print(f"  Pares candidatos (até {max(buffers_m)}m): {len(idx_linha):,}")
+
+    resultado = {}
+    for buffer_m in buffers_m:
+        sel = distancia <= buffer_m
+        usados, idx_buffer = np.unique(idx_der[sel], return_inverse=True)
+        buffers = shapely.buffer(geoms[usados], buffer_m)
+        resultado[buffer_m] = _proporcao_por_pares(linhas, buffers, idx_linha[sel], idx_buffer)
+        print(f"  Buffer {buffer_m}m: {(resultado[buffer_m] > 0).sum():,} vias com sobreposição")
+
+    return resultado
+
+
+def _processar_tile(args):
+    """Worker: calcula a sobreposição de um tile com os buffers próximos"""
+    linhas_tile, buffers_tile = args
+    return calcular_proporcao_sobreposta(linhas_tile, buffers_tile)
+
+
+def particionar_em_tiles(linhas, tamanho_tile_m=TAMANHO_TILE_M):
+    """
+    Agrupa as linhas em tiles de uma grade regular pelo centro do bbox
+
+    Retorna uma lista de arrays de índices (um por tile não vazio),
+    em ordem crescente de índice dentro de cada tile.
+    """
+    linhas = np.asarray(linhas, dtype=object)
+    validas = np.flatnonzero(~shapely.is_missing(linhas) & ~shapely.is_empty(linhas))
+    if len(validas) == 0:
+        return []
+
+    limites = shapely.bounds(linhas[validas])
+    cx = (limites[:, 0] + limites[:, 2]) / 2
+    cy = (limites[:, 1] + limites[:, 3]) / 2
+    col = np.floor((cx - cx.min()) / tamanho_tile_m).astype(np.int64)
+    lin = np.floor((cy - cy.min()) / tamanho_tile_m).astype(np.int64)
+    tile = lin * (col.max() + 1) + col
+
+    ordem = np.argsort(tile, kind='stable')
+    _, inicio = np.unique(tile[ordem], return_index=True)
+    return np.split(validas[ordem], inicio[1:])
+
+
+def calcular_proporcao_sobreposta_paralela(linhas, buffers, arvore=None, workers=None,
+                                           tamanho_tile_m=TAMANHO_TILE_M):
+    """
+    Versão particionada de calcular_proporcao_sobreposta
+
+    Divide as linhas em tiles de `tamanho_tile_m` e envia para cada
+    processo apenas o tile e os buffers cujo bbox encosta no bbox do tile.
+    Os buffers de cada tile mantêm a ordem global, então o resultado é
+    idêntico ao da execução em um único processo.
+
+    workers=None usa todos os núcleos disponíveis.
+    """
+    linhas = np.asarray(linhas, dtype=object)
+    proporcao = np.zeros(len(linhas), dtype=float)
+
+    if len(linhas) == 0 or len(buffers) == 0:
+        return proporcao
+
+    if arvore is None:
+        arvore = STRtree(buffers)
+
+    tiles = particionar_em_tiles(linhas, tamanho_tile_m)
+
+    tarefas = []
+    for idx in tiles:
+        minx, miny, maxx, maxy = shapely.total_bounds(linhas[idx])
+        proximos = np.sort(arvore.query(shapely.box(minx, miny, maxx, maxy)))
+        tarefas.append((linhas[idx], buffers[proximos]))
+
+    print(f"  {len(tiles):,} tiles de {tamanho_tile_m/1000:.0f} km em {workers or os.cpu_count()} processos")
+
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        for n, (idx, resultado) in enumerate(zip(tiles, executor.map(_processar_tile, tarefas)), 1):
+            proporcao[idx] = resultado
+            if n % 50 == 0 or n == len(tiles):
+                print(f"  {n:,}/{len(tiles):,} tiles concluídos...")
+
+    return proporcao
+
+
+def hash_arquivo_der(arquivo_der):
+    """Hash SHA-256 do conteúdo do shapefile (todos os arquivos auxiliares)"""
+    arquivo_der = Path(arquivo_der)
+    h = hashlib.sha256()
+    for ext in EXTENSOES_SHAPEFILE:
+        componente = arquivo_der.with_suffix(ext)
+        if not componente.exists():
+            continue
+        h.update(ext.encode())
+        with open(componente, 'rb') as f:
+            for bloco in iter(lambda: f.read(1 << 20), b''):
+                h.update(bloco)
+    return h.hexdigest()
+
+
+def subdividir_poligono(geom, max_vertices=MAX_VERTICES_PARTE):
+    """
+    Decompõe um polígono em partes disjuntas com no máximo `max_vertices`
+
+    Divide recursivamente (quadtree, sem recursão em Python) o bbox em
+    quatro quadrantes até que cada parte fique pequena. As partes não se
+    sobrepõem e cobrem exatamente o polígono original, o que as torna
+    adequadas para uma STRtree.
+    """
+    partes = []
+    pendentes = list(shapely.get_parts(geom))
+
+    while pendentes:
+        g = pendentes.pop()
+        minx, miny, maxx, maxy = g.bounds
+        if (shapely.get_num_coordinates(g) <= max_vertices
+                or max(maxx - minx, maxy - miny) < 1):
+            partes.append(g)
+            continue
+
+        mx, my = (minx + maxx) / 2, (miny + maxy) / 2
+        quadrantes = shapely.box(
+            [minx, mx, minx, mx], [miny, miny, my, my],
+            [mx, maxx, mx, maxx], [my, my, maxy, maxy]
+        )
+        for parte in shapely.get_parts(shapely.intersection(g, quadrantes)):
+            if shapely.get_type_id(parte) == shapely.GeometryType.POLYGON and not parte.is_empty:
+                pendentes.append(parte)
+
+    return np.array(partes, dtype=object)
+
+
+def preparar_poligonos(poligonos, max_vertices=MAX_VERTICES_PARTE):
+    """
+    Partes indexáveis de um conjunto de polígonos, sem unary_union
+
+    Cada polígono é corrigido (make_valid), separado em partes simples e
+    subdividido com subdividir_poligono. Polígonos de entrada que se
+    sobrepõem continuam sobrepostos (o recorte em _proporcao_por_pares não
+    conta a sobreposição duas vezes).
+
+    Retorna (partes, arvore), com as partes preparadas para predicados.
+    """
+    geoms = np.asarray(poligonos, dtype=object)
+    geoms = geoms[~shapely.is_missing(geoms) & ~shapely.is_empty(geoms)]
+    geoms = shapely.get_parts(shapely.make_valid(geoms))
+    geoms = geoms[shapely.get_type_id(geoms) == shapely.GeometryType.POLYGON]
+
+    partes = [subdividir_poligono(g, max_vertices) for g in geoms]
+    partes = np.concatenate(partes) if partes else np.array([], dtype=object)
+    shapely.prepare(partes)
+    return partes, STRtree(partes)
+
+
+def calcular_proporcao_em_poligonos(linhas, partes, arvore=None):
+    """
+    Proporção (0-1) de cada linha dentro da união das partes poligonais
+
+    Mesmo resultado de calcular_proporcao_sobreposta, com um atalho para
+    polígonos grandes (áreas urbanas, municípios): as linhas cobertas por uma
+    única parte (covers sobre as partes preparadas) recebem 1 sem recorte, e
+    só as que cruzam alguma borda passam pelo recorte em lote.
+    """
+    linhas = np.asarray(linhas, dtype=object)
+    if len(linhas) == 0 or len(partes) == 0:
+        return np.zeros(len(linhas), dtype=float)
+
+    if arvore is None:
+        arvore = STRtree(partes)
+    shapely.prepare(partes)
+
+    idx_linha, idx_parte = arvore.query(linhas, predicate='intersects')
+    coberta = np.zeros(len(linhas), dtype=bool)
+    coberta[idx_linha[shapely.covers(partes[idx_parte], linhas[idx_linha])]] = True
+
+    borda = ~coberta[idx_linha]
+    proporcao = _proporcao_por_pares(linhas, partes, idx_linha[borda], idx_parte[borda])
+    proporcao[coberta & (shapely.length(linhas) > 0)] = 1.0
+    return proporcao
+
+
+def _salvar_wkb(arquivo, **geometrias):
+    """Salva arrays de geometrias como WKB concatenado + offsets (.npz)"""
+    dados = {}
+    for nome, geoms in geometrias.items():
+        wkb = shapely.to_wkb(np.asarray(geoms, dtype=object))
+        tamanhos = np.array([len(b) for b in wkb], dtype=np.int64)
+        dados[f'{nome}_wkb'] = np.frombuffer(b''.join(wkb), dtype=np.uint8)
+        dados[f'{nome}_offsets'] = np.concatenate([[0], np.cumsum(tamanhos)])
+    np.savez(arquivo, **dados)
+
+
+def _carregar_wkb(arquivo, nome):
+    """Lê um array de geometrias salvo por _salvar_wkb"""
+    with np.load(arquivo) as dados:
+        buf = dados[f'{nome}_wkb'].tobytes()
+        offsets = dados[f'{nome}_offsets']
+    wkb = [buf[offsets[i]:offsets[i + 1]] for i in range(len(offsets) - 1)]
+    return shapely.from_wkb(np.array(wkb, dtype=object))
+
+
+def carregar_buffer_der(der, arquivo_der, buffer_m, jurisdicoes=None, cache_dir=CACHE_DIR):
+    """
+    Retorna o buffer unido da malha DER, usando cache em disco
+
+    A chave do cache combina o hash do shapefile de origem, o CRS de `der`,
+    o filtro de jurisdição e a distância do buffer; qualquer mudança em um
+    deles gera uma nova entrada. `der` deve estar no CRS de trabalho (metros).
+
+    Retorna (uniao, partes): o polígono unido (já preparado para predicados
+    repetidos) e sua decomposição em partes disjuntas (ver
+    subdividir_poligono), prontas para uma STRtree.
+    """
+    chave = {
+        'versao': VERSAO_CACHE,
+        'hash_der': hash_arquivo_der(arquivo_der),
+        'crs': der.crs.to_string(),
+        'jurisdicoes': sorted(jurisdicoes) if jurisdicoes else None,
+        'buffer_m': float(buffer_m),
+    }
+    hash_chave = hashlib.sha256(json.dumps(chave, sort_keys=True).encode()).hexdigest()[:20]
+    cache_dir = Path(cache_dir)
+    arquivo_cache = cache_dir / f'buffer_der_{hash_chave}.npz'
+
+    if arquivo_cache.exists():
+        print(f"  Buffer DER ({buffer_m}m) carregado do cache: {arquivo_cache.name}")
+        uniao = _carregar_wkb(arquivo_cache, 'uniao')[0]
+        partes = _carregar_wkb(arquivo_cache, 'partes')
+        shapely.prepare(uniao)
+        return uniao, partes
+
+    print(f"  Cache ausente, criando buffer unido de {buffer_m}m (pode demorar)...")
+    if jurisdicoes:
+        der = der[der['Jurisdicao'].isin(jurisdicoes)]
+    uniao = shapely.union_all(shapely.buffer(np.asarray(der.geometry, dtype=object), buffer_m))
+    partes = subdividir_poligono(uniao)
+
+    cache_dir.mkdir(parents=True, exist_ok=True)
+    _salvar_wkb(arquivo_cache, uniao=[uniao], partes=partes)
+    with open(arquivo_cache.with_suffix('.json'), 'w', encoding='utf-8') as f:
+        json.dump({**chave, 'arquivo_der': str(arquivo_der), 'n_partes': len(partes)},
+                  f, ensure_ascii=False, indent=2)
+    print(f"  Buffer salvo no cache: {arquivo_cache} ({len(partes):,} partes)")
+
+    shapely.prepare(uniao)
+    return uniao, partes
@@ -10,7 +10,9 @@ import geopandas as gpd
 import pandas as pd
 from pathlib import Path
 from datetime import datetime
-from shapely.ops import unary_union
+from shapely import STRtree
+from esquema_malha import ler_malha, gravar_malha
+from sobreposicao_der import JURISDICOES_SRE, filtrar_sre, carregar_buffer_der, calcular_proporcao_sobreposta
 import warnings
 warnings.filterwarnings('ignore')
 
@@ -36,7 +38,7 @@ def carregar_dados():
     log_section("CARREGANDO DADOS")
     
     print(f"Carregando base OSM: {BASE_OSM}")
-    osm = gpd.read_file(BASE_OSM)
+    osm = ler_malha(BASE_OSM)
     print(f"  Total: {len(osm):,} segmentos")
     print(f"  CRS: {osm.crs}")
     
@@ -78,48 +80,24 @@ def subtrair_apenas_der(osm, der):
     
     # Filtrar apenas rodovias estaduais e federais do DER
     print("\nFiltrando rodovias estaduais e federais do DER...")
-    der_estadual_federal = der_utm[der_utm['Jurisdicao'].isin(['Estadual', 'Federal'])]
+    der_estadual_federal = filtrar_sre(der_utm)
     print(f"  Segmentos estaduais/federais: {len(der_estadual_federal):,}")
     
     # Calcular extensão do DER
     ext_der = der_estadual_federal.geometry.length.sum() / 1000
     print(f"  Extensão DER estadual/federal: {ext_der:,.1f} km")
     
-    # Criar buffer ao redor da malha DER
-    print(f"\nCriando buffer de {BUFFER_SUBTRACAO}m ao redor da malha DER...")
-    der_buffer = der_estadual_federal.geometry.buffer(BUFFER_SUBTRACAO)
-    der_union = unary_union(der_buffer)
-    print("  Buffer criado!")
-    
-    # Identificar segmentos OSM que interceptam o buffer do DER
-    print("\nIdentificando sobreposições com DER...")
-    osm_utm = osm_utm.reset_index(drop=True)
-    
-    # Verificar interseção
-    intersecta_der = osm_utm.geometry.intersects(der_union)
-    print(f"  Segmentos que intersectam DER: {intersecta_der.sum():,}")
+    # Buffer ao redor da malha DER (cache em disco)
+    print(f"\nObtendo buffer de {BUFFER_SUBTRACAO}m ao redor da malha DER...")
+    _, buffers = carregar_buffer_der(der_utm, MALHA_DER, BUFFER_SUBTRACAO, jurisdicoes=JURISDICOES_SRE)
+    arvore = STRtree(buffers)
+    print("  Buffer pronto!")
     
     # Calcular proporção de sobreposição para cada segmento
-    print("Calculando proporção de sobreposição (pode demorar)...")
-    proporcao_sobreposta = []
-    
-    total = len(osm_utm)
-    for idx, row in osm_utm.iterrows():
-        if idx % 100000 == 0:
-            print(f"  Processando {idx:,}/{total:,} ({100*idx/total:.1f}%)...")
-        
-        if intersecta_der[idx]:
-            try:
-                intersecao = row.geometry.intersection(der_union)
-                if not intersecao.is_empty and row.geometry.length > 0:
-                    prop = intersecao.length / row.geometry.length
-                else:
-                    prop = 0
-            except:
-                prop = 0
-        else:
-            prop = 0
-        proporcao_sobreposta.append(prop)
+    print("\nCalculando proporção de sobreposição com DER...")
+    osm_utm = osm_utm.reset_index(drop=True)
+    proporcao_sobreposta = calcular_proporcao_sobreposta(osm_utm.geometry, buffers, arvore)
+    print(f"  Segmentos com sobreposição ao DER: {(proporcao_sobreposta > 0).sum():,}")
     
     osm_utm['prop_sobreposta'] = proporcao_sobreposta
     
@@ -155,7 +133,7 @@ def salvar_resultados(osm_filtrado, osm_original, removidos):
     # Nome do arquivo
     output_file = OUTPUT_DIR / 'osm_sp_menos_der.gpkg'
     print(f"Salvando: {output_file}")
-    osm_filtrado.to_file(output_file, driver='GPKG')
+    osm_filtrado = gravar_malha(osm_filtrado, output_file, driver='GPKG')
     
     # Estatísticas
     ext_original = osm_original.to_crs(epsg=31983).geometry.length.sum() / 1000
@@ -0,0 +1,175 @@
+"""
+União dos trechos OSM fragmentados em rotas contínuas
+
+O OSM divide cada estrada vicinal em muitas ways curtas (a cada mudança de
+atributo, ponte, relação etc.), o que infla a contagem de segmentos e o
+tamanho dos GeoJSON e tiles publicados. Esta etapa une as ways contíguas com
+os mesmos name/ref/highway/surface em uma única rota:
+
+1. Cada extremidade vira uma chave (grupo de atributos, x, y) agrupada por hash
+2. Extremidades com exatamente duas ocorrências no mesmo grupo são pontos de
+   continuação; as demais (pontas, bifurcações) encerram a rota
+3. Os trechos ligados por pontos de continuação formam componentes conexos e
+   cada componente é costurado com line_merge (local, só as suas partes)
+
+Saídas:
+- malha_municipal_sp_rotas.gpkg: uma feição por rota (id_rota)
+- malha_municipal_sp_rotas_osm_id.csv: mapeamento id_rota -> osm_id
+
+Autor: Análise automatizada
+Data: Janeiro/2026
+"""
+
+import geopandas as gpd
+import numpy as np
+import pandas as pd
+import shapely
+from pathlib import Path
+from datetime import datetime
+from scipy.sparse import coo_matrix
+from scipy.sparse.csgraph import connected_components
+from grafo_malha import renumerar_por_ordem
+import warnings
+warnings.filterwarnings('ignore')
+
+# Configurações
+MALHA_MUNICIPAL = r'D:\ESTUDO_VICINAIS_V2\resultados\dados_processados\malha_municipal_sp.gpkg'
+OUTPUT_DIR = Path(r'D:\ESTUDO_VICINAIS_V2\resultados\dados_processados')
+MALHA_ROTAS = OUTPUT_DIR / 'malha_municipal_sp_rotas.gpkg'
+MAPA_OSM_ID = OUTPUT_DIR / 'malha_municipal_sp_rotas_osm_id.csv'
+
+# Atributos que precisam coincidir para dois trechos virarem a mesma rota
+ATRIBUTOS_UNIAO = ['name', 'ref', 'highway', 'surface']
+
+
+def log_section(titulo):
+    """Imprime seção formatada"""
+    print(f"\n{'='*60}")
+    print(f"{titulo}")
+    print(f"{'='*60}")
+
+
+def extrair_surface(gdf):
+    """Coluna surface, ou a tag surface de other_tags (formato hstore do GDAL)"""
+    if 'surface' in gdf.columns:
+        return gdf['surface']
+    if 'other_tags' in gdf.columns:
+        return gdf['other_tags'].str.extract(r'"surface"=>"([^"]*)"', expand=False)
+    return pd.Series(np.nan, index=gdf.index)
+
+
+def rotular_rotas(grupo_parte, inicio, fim):
+    """
+    Rota de cada parte linear
+
+    Duas partes do mesmo grupo são unidas quando compartilham uma
+    extremidade que só elas duas usam (grau 2 no grupo). Retorna o rótulo
+    da rota por parte, em ordem de primeira ocorrência.
+    """
+    n_partes = len(grupo_parte)
+    if n_partes == 0:
+        return np.zeros(0, dtype=np.int64)
+
+    # Chave de hash da extremidade: (grupo, x, y)
+    extremidades = pd.DataFrame({
+        'grupo': np.concatenate([grupo_parte, grupo_parte]),
+        'x': np.concatenate([inicio[:, 0], fim[:, 0]]),
+        'y': np.concatenate([inicio[:, 1], fim[:, 1]]),
+    })
+    no = extremidades.groupby(['grupo', 'x', 'y'], sort=False).ngroup().to_numpy()
+    parte = np.concatenate([np.arange(n_partes), np.arange(n_partes)])
+
+    # Pares de partes nos nós de grau 2
+    grau = np.bincount(no)
+    continuacao = np.flatnonzero(grau[no] == 2)
+    continuacao = continuacao[np.argsort(no[continuacao], kind='stable')]
+    pares = parte[continuacao].reshape(-1, 2)
+
+    grafo = coo_matrix(
+        (np.ones(len(pares), dtype=np.int8), (pares[:, 0], pares[:, 1])),
+        shape=(n_partes, n_partes),
+    )
+    _, rota = connected_components(grafo, directed=False)
+    return renumerar_por_ordem(rota)
+
+
+def unir_trechos(gdf, atributos=ATRIBUTOS_UNIAO):
+    """
+    Une os trechos contíguos com os mesmos atributos
+
+    Retorna (rotas, mapa): GeoDataFrame com uma linha por rota (no CRS de
+    entrada) e DataFrame id_rota -> osm_id (posição da linha quando a camada
+    não tem osm_id).
+    """
+    gdf = gdf.reset_index(drop=True)
+    valores = pd.DataFrame({c: gdf[c] if c in gdf.columns else np.nan for c in atributos})
+    if 'surface' in atributos:
+        valores['surface'] = extrair_surface(gdf)
+    grupo = valores.fillna('').groupby(atributos, sort=False).ngroup().to_numpy()
+
+    # Partes lineares (MultiLineString vira várias partes da mesma linha)
+    partes, linha = shapely.get_parts(np.asarray(gdf.geometry, dtype=object), return_index=True)
+    coords, idx = shapely.get_coordinates(partes, return_index=True)
+    n_vertices = np.bincount(idx, minlength=len(partes))
+    validas = n_vertices > 0
+    partes, linha, n_vertices = partes[validas], linha[validas], n_vertices[validas]
+    fim = np.cumsum(n_vertices) - 1
+    inicio = fim - n_vertices + 1
+
+    rota = rotular_rotas(grupo[linha], coords[inicio], coords[fim])
+
+    # Costura local de cada rota
+    ordem = np.argsort(rota, kind='stable')
+    multi = shapely.multilinestrings(partes[ordem], indices=rota[ordem])
+    geometria = shapely.line_merge(multi)
+
+    primeira = np.zeros(rota.max() + 1 if len(rota) else 0, dtype=np.int64)
+    primeira[rota[::-1]] = linha[::-1]
+    rotas = valores.iloc[primeira].reset_index(drop=True)
+    rotas.insert(0, 'id_rota', np.arange(len(rotas)))
+    rotas['n_trechos'] = pd.Series(linha).groupby(rota).nunique().to_numpy()
+    rotas = gpd.GeoDataFrame(rotas, geometry=geometria, crs=gdf.crs)
+
+    osm_id = gdf['osm_id'].to_numpy() if 'osm_id' in gdf.columns else np.arange(len(gdf))
+    mapa = pd.DataFrame({'id_rota': rota, 'osm_id': osm_id[linha]}).drop_duplicates()
+    return rotas, mapa
+
+
+def main():
+    log_section("UNIÃO DE TRECHOS OSM EM ROTAS")
+    print(f"Início: {datetime.now().strftime('%Y-%m-%d %H:%M:%S')}")
+
+    print(f"\nCarregando malha municipal: {MALHA_MUNICIPAL}")
+    municipal = gpd.read_file(MALHA_MUNICIPAL)
+    print(f"  Total: {len(municipal):,} trechos")
+    if 'osm_id' not in municipal.columns:
+        print("  ⚠ Camada sem osm_id: o mapeamento usa a posição da linha")
+
+    log_section("UNIÃO POR EXTREMIDADES")
+    print(f"Atributos: {ATRIBUTOS_UNIAO}")
+    rotas, mapa = unir_trechos(municipal)
+    rotas['comprimento_m'] = rotas.geometry.to_crs(epsg=31983).length
+
+    n_multi = (rotas.geom_type == 'MultiLineString').sum()
+    print(f"  Rotas: {len(rotas):,} ({len(municipal) / max(len(rotas), 1):.1f} trechos por rota)")
+    print(f"  Rotas não costuradas em uma única linha: {n_multi:,}")
+    print(f"  Extensão: {rotas['comprimento_m'].sum()/1000:,.1f} km")
+    print(f"\nTrechos por rota:")
+    print(rotas['n_trechos'].describe().round(2).to_string())
+
+    log_section("SALVANDO")
+    print(f"Rotas: {MALHA_ROTAS}")
+    rotas.to_file(MALHA_ROTAS, driver='GPKG')
+    print(f"Mapeamento osm_id: {MAPA_OSM_ID}")
+    mapa.to_csv(MAPA_OSM_ID, index=False)
+
+    print(f"\nRedução de feições: {len(municipal):,} -> {len(rotas):,} "
+          f"({100 * (1 - len(rotas) / max(len(municipal), 1)):.1f}%)")
+    print(f"\nFim: {datetime.now().strftime('%Y-%m-%d %H:%M:%S')}")
+    print("\n✅ União concluída!")
+
+    return rotas
+
+
+if __name__ == "__main__":
+    resultado = main()
@@ -0,0 +1,138 @@
+"""
+Varredura de sensibilidade da subtração DER (buffer x limiar)
+
+Os scripts de subtração usam parâmetros diferentes:
+- extrair_pbf_subtrair_der.py / refinamento_conectividade.py: buffer 15m, limiar 50%
+- refinar_subtrair_der.py: buffer 15m, limiar 70%
+- conectividade: buffer 50m
+
+Este script calcula a sobreposição de cada via UMA vez para várias
+distâncias de buffer (uma única consulta indexada) e tabula, para uma
+grade de limiares, quantas vias e quantos km seriam mantidos/removidos.
+Gera uma tabela no console e um JSON no diretório de relatórios.
+
+Autor: Análise automatizada
+Data: Janeiro/2026
+"""
+
+import argparse
+import json
+import geopandas as gpd
+import numpy as np
+from pathlib import Path
+from datetime import datetime
+from extracao_pbf import ler_base_osm
+from sobreposicao_der import JURISDICOES_SRE, calcular_sobreposicao_multibuffer
+import warnings
+warnings.filterwarnings('ignore')
+
+# Configurações
+BASE_OSM = r'D:\ESTUDO_VICINAIS_V2\resultados\intermediarios\osm_sp_highways.gpkg'
+MALHA_DER = r'D:\ESTUDO_VICINAIS_V2\dados\Sistema Rodoviário Estadual\MALHA_RODOVIARIA\MALHA_OUT.shp'
+RELATORIO_DIR = Path(r'D:\ESTUDO_VICINAIS_V2\resultados\relatorios')
+
+# Grade padrão da varredura
+BUFFERS_M = [10, 15, 25, 50]
+LIMIARES = [0.3, 0.4, 0.5, 0.6, 0.7, 0.8, 0.9]
+
+
+def log_section(titulo):
+    """Imprime seção formatada"""
+    print(f"\n{'='*60}")
+    print(f"{titulo}")
+    print(f"{'='*60}")
+
+
+def tabelar_varredura(proporcoes, comprimento_m, limiares):
+    """
+    Monta a tabela buffer x limiar
+
+    Uma via é removida quando proporção >= limiar (mesma regra dos scripts
+    de subtração, que mantêm proporção < limiar).
+    """
+    total_km = comprimento_m.sum() / 1000
+    linhas = []
+    for buffer_m, prop in proporcoes.items():
+        for limiar in limiares:
+            remover = prop >= limiar
+            km_removidos = comprimento_m[remover].sum() / 1000
+            linhas.append({
+                'buffer_m': buffer_m,
+                'limiar': limiar,
+                'removidos': int(remover.sum()),
+                'mantidos': int((~remover).sum()),
+                'km_removidos': round(float(km_removidos), 1),
+                'km_mantidos': round(float(total_km - km_removidos), 1),
+            })
+    return linhas
+
+
+def imprimir_tabela(tabela):
+    """Imprime a tabela da varredura"""
+    print(f"\n{'Buffer':>8} {'Limiar':>8} {'Removidos':>12} {'Mantidos':>12} {'km removidos':>14} {'km mantidos':>14}")
+    print("-" * 72)
+    buffer_anterior = None
+    for t in tabela:
+        if buffer_anterior is not None and t['buffer_m'] != buffer_anterior:
+            print()
+        buffer_anterior = t['buffer_m']
+        print(f"{t['buffer_m']:>7}m {100*t['limiar']:>7.0f}% {t['removidos']:>12,} {t['mantidos']:>12,} "
+              f"{t['km_removidos']:>14,.1f} {t['km_mantidos']:>14,.1f}")
+
+
+def main(base_osm=BASE_OSM, buffers_m=BUFFERS_M, limiares=LIMIARES, todas_jurisdicoes=False):
+    log_section("VARREDURA DE SENSIBILIDADE - SUBTRAÇÃO DER")
+
+    print(f"Carregando base OSM: {base_osm}")
+    osm = ler_base_osm(base_osm, colunas=[]).to_crs(epsg=31983)
+    print(f"  Total: {len(osm):,} segmentos")
+
+    print(f"\nCarregando malha DER: {MALHA_DER}")
+    der = gpd.read_file(MALHA_DER).to_crs(epsg=31983)
+    if not todas_jurisdicoes:
+        der = der[der['Jurisdicao'].isin(JURISDICOES_SRE)]
+    print(f"  Segmentos DER usados: {len(der):,}")
+
+    log_section("CÁLCULO DA SOBREPOSIÇÃO (passagem única)")
+    print(f"Buffers: {buffers_m}")
+    proporcoes = calcular_sobreposicao_multibuffer(osm.geometry, der.geometry, buffers_m)
+
+    comprimento_m = np.nan_to_num(osm.geometry.length.to_numpy())
+    tabela = tabelar_varredura(proporcoes, comprimento_m, limiares)
+
+    log_section("RESULTADO DA VARREDURA")
+    print(f"Base: {len(osm):,} segmentos ({comprimento_m.sum()/1000:,.1f} km)")
+    imprimir_tabela(tabela)
+
+    # Salvar JSON
+    RELATORIO_DIR.mkdir(parents=True, exist_ok=True)
+    output_file = RELATORIO_DIR / 'varredura_sobreposicao_der.json'
+    with open(output_file, 'w', encoding='utf-8') as f:
+        json.dump({
+            'data': datetime.now().strftime('%Y-%m-%d %H:%M:%S'),
+            'base_osm': str(base_osm),
+            'malha_der': MALHA_DER,
+            'jurisdicoes': None if todas_jurisdicoes else JURISDICOES_SRE,
+            'total_segmentos': len(osm),
+            'total_km': round(float(comprimento_m.sum() / 1000), 1),
+            'varredura': tabela,
+        }, f, ensure_ascii=False, indent=2)
+
+    print(f"\nJSON salvo: {output_file}")
+    print("\n✅ Varredura concluída!")
+
+    return tabela
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Varredura buffer x limiar da subtração DER")
+    parser.add_argument('--entrada', default=BASE_OSM, help="Base OSM (GPKG ou GeoParquet)")
+    parser.add_argument('--buffers', type=float, nargs='+', default=BUFFERS_M,
+                        help="Distâncias de buffer em metros")
+    parser.add_argument('--limiares', type=float, nargs='+', default=LIMIARES,
+                        help="Limiares de remoção (proporção 0-1)")
+    parser.add_argument('--todas-jurisdicoes', action='store_true',
+                        help="Usar toda a malha DER (como refinar_subtrair_der.py)")
+    args = parser.parse_args()
+
+    resultado = main(args.entrada, args.buffers, args.limiares, args.todas_jurisdicoes)